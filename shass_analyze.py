@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+
+"""\
+Static code size and cycle report per routine.
+
+    ./shass_analyze.py a.obj
+    ./shass_analyze.py prog.bin --symbols prog.sym
+    ./shass_main.py prog.asm --analyze
+
+    from shass_analyze import analyzeRoutines, formatReport
+
+    print(formatReport(analyzeRoutines(result.words, result.code_symbols, result.ranges)))
+
+The code is split into routines at the labels, each running up to the next
+label or gap in the code. For each routine the report gives its words and
+instructions, and the fewest and most cycles of a run through it: from its
+label to where it is left by an RTS, a jump out of it or falling through
+into the next one.
+
+Cycles are estimates from Opcode.cycles. Jumps have a delay slot, so the
+instruction after a jump runs on both of its paths, and a jump takes as
+long taken or not. A path ends at a jump backwards, so loops count once,
+and a CALL counts without the routine called.
+
+Loops are the jumps backwards. Each is listed with the cycles of one
+iteration, and hot spots worth a look are flagged:
+    - jumps with a NOP in their delay slot, a cycle that could do the work
+      of an instruction from before the jump
+    - loops longer than LONG_LOOP_WORDS words
+"""
+
+import argparse
+import sys
+
+from shass_instruction import *
+from shass_output import *
+from shass_disasm import *
+
+# loops with more words than this are flagged
+LONG_LOOP_WORDS = 32
+
+# conditional jumps, and the jumps that are not
+_conditional_jumps = frozenset(Opcode.inverse_jumps)
+_jumps = _conditional_jumps | frozenset(Opcode.long_operand_codes)
+
+class Loop:
+    """A jump backwards, and what one iteration takes."""
+
+    __slots__ = ("start", "jump", "words", "best", "worst")
+
+    def __init__(self, start, jump, words, best, worst):
+        # the address jumped back to, and the jump's
+        self.start = start
+        self.jump = jump
+
+        # words from the start up to the jump's delay slot
+        self.words = words
+
+        # fewest and most cycles of an iteration, None if no path of the
+        #   loop's code leads back to the jump
+        self.best = best
+        self.worst = worst
+
+class Routine:
+    """The code from a label up to the next label."""
+
+    __slots__ = ("name", "start", "end", "instructions", "best", "worst", "loops", "hot_spots")
+
+    def __init__(self, name, start, end):
+        self.name = name
+
+        # code addresses start up to end (excluded)
+        self.start = start
+        self.end = end
+
+        # words that are instructions
+        self.instructions = 0
+
+        # fewest and most cycles from its start until it is left
+        self.best = 0
+        self.worst = 0
+
+        # Loops whose jump is in the routine
+        self.loops = []
+
+        # (address, message) of the hot spots in the routine
+        self.hot_spots = []
+
+    def words(self):
+        return self.end - self.start
+
+def _codeWords(words, ranges):
+    """The address -> word mapping of the code, from a mapping or from a
+    sequence indexed from address 0 holding code in the given ranges."""
+
+    if isinstance(words, dict):
+        return words
+    if ranges is None:
+        ranges = [(0, len(words))]
+    return {address: words[address] for start, end in ranges for address in range(start, end)}
+
+def _flow(code):
+    """What running the code from every address takes, and where it goes
+    next: address -> (cycles, tuple of the following addresses). There are
+    none where execution leaves (RTS) or stops (a word that is no
+    instruction). A jump is taken together with its delay slot, going on
+    to the target and, unless the jump always takes it, past the slot."""
+
+    table = decodeTable()
+    flow = {}
+    for address, word in code.items():
+        entry = table[word]
+        if entry is None:
+            flow[address] = (0, ())
+            continue
+
+        mnemonic, kind, _, value = entry
+        cycles = Opcode.cycles[mnemonic]
+        if mnemonic == "RTS":
+            flow[address] = (cycles, ())
+        elif mnemonic in _jumps:
+            slot = table[code[address + 1]] if address + 1 in code else None
+            if slot is None:
+                flow[address] = (cycles, ())
+                continue
+            cycles += Opcode.cycles[slot[0]]
+
+            if kind == OPERAND_RELATIVE:
+                target = (address + 1 + (value ^ 0x80) - 0x80) & 0x1FFF
+            else:
+                target = value
+
+            if mnemonic == "CALL":
+                flow[address] = (cycles, (address + 2,))
+            elif mnemonic == "JMP":
+                flow[address] = (cycles, (target,))
+            else:
+                flow[address] = (cycles, (address + 2, target))
+        else:
+            flow[address] = (cycles, (address + 1,))
+    return flow
+
+def _paths(flow, start, end, until=None):
+    """Fewest and most cycles of the paths from every address from start to
+    end (excluded) forward, as two address -> cycles dicts.
+
+    Without until, a path ends where it leaves the range or jumps
+    backwards. With until, paths have to reach that address, and the
+    addresses from which none does are left out."""
+
+    best = {}
+    worst = {}
+    for address in range(end - 1, start - 1, -1):
+        if address not in flow:
+            continue
+        cycles, followings = flow[address]
+
+        if address == until:
+            best[address] = worst[address] = cycles
+            continue
+
+        options = []
+        for following in followings:
+            if following in best and address < following:
+                options.append((best[following], worst[following]))
+            elif until is None:
+                options.append((0, 0))
+        if not options:
+            if until is None:
+                best[address] = worst[address] = cycles
+            continue
+
+        best[address] = cycles + min(option[0] for option in options)
+        worst[address] = cycles + max(option[1] for option in options)
+    return best, worst
+
+def _routineBounds(code, code_symbols):
+    """(name, start, end) of the routines, split at labels and gaps."""
+
+    names = {}
+    for name, address in sorted(code_symbols.items(), key=lambda item: (item[1], item[0])):
+        if address in code:
+            names.setdefault(address, name)
+
+    bounds = []
+    start = None
+    for address in sorted(code):
+        if start is None or address in names or address != previous + 1:
+            if start is not None:
+                bounds.append((names.get(start, f"${start:04X}"), start, previous + 1))
+            start = address
+        previous = address
+    if start is not None:
+        bounds.append((names.get(start, f"${start:04X}"), start, previous + 1))
+    return bounds
+
+def analyzeRoutines(words, code_symbols, ranges=None, long_loop=LONG_LOOP_WORDS):
+    """Analyze the code of a program, returning its Routines in address
+    order. words maps code addresses to words (a dict, or a sequence from
+    address 0 with the code in the given (start, end) ranges)."""
+
+    code = _codeWords(words, ranges)
+    flow = _flow(code)
+    table = decodeTable()
+
+    routines = []
+    for name, start, end in _routineBounds(code, code_symbols):
+        routine = Routine(name, start, end)
+        routine.instructions = sum(1 for address in range(start, end) if table[code[address]] is not None)
+
+        best, worst = _paths(flow, start, end)
+        routine.best = best.get(start, 0)
+        routine.worst = worst.get(start, 0)
+
+        for address in range(start, end):
+            entry = table[code[address]]
+            if entry is None or entry[0] not in _jumps or address + 1 not in code:
+                continue
+            mnemonic = entry[0]
+
+            slot = table[code[address + 1]]
+            if slot is not None and slot[0] == "NOP":
+                routine.hot_spots.append((address, f"NOP in the delay slot of {mnemonic}."))
+
+            # a jump backwards, with its delay slot
+            for target in flow[address][1]:
+                if target > address or target not in code:
+                    continue
+                loop_best, loop_worst = _paths(flow, target, address + 1, address)
+                loop = Loop(target, address, address + 2 - target, loop_best.get(target), loop_worst.get(target))
+                routine.loops.append(loop)
+                if loop.words > long_loop:
+                    routine.hot_spots.append((address, f"Loop of {loop.words} words back to ${target:04X}."))
+
+        routines.append(routine)
+    return routines
+
+def _cycleRange(best, worst):
+    if best is None:
+        return "-"
+    return str(best) if best == worst else f"{best}-{worst}"
+
+def formatReport(routines):
+    """The text of the report on the Routines of a program."""
+
+    lines = ["{:<20} {:>6} {:>6} {:>6} {:>12}".format("Routine", "Start", "Words", "Instr", "Cycles")]
+    for routine in routines:
+        lines.append("{:<20} {:>6} {:>6} {:>6} {:>12}".format(
+            routine.name, f"${routine.start:04X}", routine.words(), routine.instructions,
+            _cycleRange(routine.best, routine.worst)))
+    lines.append("{:<20} {:>6} {:>6} {:>6}".format(
+        "Total", "", sum(routine.words() for routine in routines),
+        sum(routine.instructions for routine in routines)))
+
+    loops = [(routine, loop) for routine in routines for loop in routine.loops]
+    if loops:
+        lines.append("")
+        lines.append("Loops (cycles per iteration):")
+        for routine, loop in loops:
+            lines.append("  ${:04X} -> ${:04X}  {:<20} {:>4} words {:>12} cycles".format(
+                loop.jump, loop.start, routine.name, loop.words, _cycleRange(loop.best, loop.worst)))
+
+    hot_spots = [(address, routine, message) for routine in routines for address, message in routine.hot_spots]
+    if hot_spots:
+        lines.append("")
+        lines.append("Hot spots:")
+        for address, routine, message in hot_spots:
+            lines.append(f"  ${address:04X}  {routine.name:<20} {message}")
+
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Code size and cycle report of Caltech10 code.")
+    argparser.add_argument("image", nargs="?", default="a.obj",
+                           help="listing, .bin or .hex file to analyze (default: a.obj)")
+    argparser.add_argument("--symbols", metavar="FILE", help="symbol file with the labels")
+    argparser.add_argument("--endian", choices=["little", "big"], default="little",
+                           help="byte order of .bin and .hex images")
+    argparser.add_argument("--long-loop", type=int, default=LONG_LOOP_WORDS, metavar="WORDS",
+                           help=f"flag loops longer than this (default {LONG_LOOP_WORDS})")
+    args = argparser.parse_args()
+
+    try:
+        words, code_symbols = readImage(args.image, args.endian)
+        if args.symbols is not None:
+            code_symbols, _ = readSymbolFile(args.symbols)
+    except OSError as e:
+        print(f"File \"{e.filename}\" could not be read: {e.strerror}.")
+        sys.exit(1)
+
+    print(formatReport(analyzeRoutines(words, code_symbols, long_loop=args.long_loop)))
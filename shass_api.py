@@ -0,0 +1,133 @@
+"""\
+In-process interface to the shass-asm assembler.
+
+Assembles from strings or files without writing "a.obj" or quitting:
+
+    from shass_api import assemble
+
+    result = assemble(source_text, include_resolver={"lib.asm": lib_text})
+    result.words        # array('H') of code words from address 0
+    result.listing      # lines of the a.obj listing
+
+Errors in the sources raise AssemblerError, carrying a Diagnostic with
+the file, line number and message.
+"""
+
+import os
+import pathlib
+
+from shass_parser import *
+from shass_output import *
+
+class AssemblyResult:
+    """The output of a successful assembly."""
+
+    def __init__(self, parser, stats=None):
+        # code words, indexed by code address
+        self.words = parser.codeImage()
+
+        # sorted (start, end) address ranges actually holding code
+        self.ranges = parser.codeRanges()
+
+        # symbol tables: name -> address
+        self.code_symbols = dict(parser.getCodeSymbols())
+        self.data_symbols = dict(parser.getDataSymbols())
+
+        # the lines of the object file listing (as written to a.obj)
+        self.listing = list(parser.listing())
+
+        # any diagnostics that did not stop assembly
+        self.diagnostics = list(parser.getDiagnostics())
+
+        # the shass_stats.AssemblyStats passed to assemble(), if any
+        self.stats = stats
+
+        # the shass_object.ObjectModule of a relocatable assembly, else None
+        self.module = parser.objectModule() if parser.isRelocatable() else None
+
+        # the shass_symbols.SymbolMap, for address -> symbol lookups
+        self.symbols = parser.symbolMap()
+
+        # the shass_memory.MemoryMap of the used and free addresses
+        self.memory = parser.memoryMap()
+
+    def toBytes(self, byteorder="little"):
+        """Return the code words packed as bytes, in the given byte order."""
+        return formatBinary(self.words, byteorder)
+
+    def toIntelHex(self, byteorder="little"):
+        """Return the code as Intel HEX text."""
+        return formatIntelHex(self.words, self.ranges, byteorder)
+
+    def listingText(self):
+        """Return the listing exactly as written to a.obj."""
+        return formatListing(self.listing)
+
+    def writeOutputs(self, paths, byteorder="little"):
+        """Write the outputs given as a format -> path mapping."""
+        writeOutputs(paths, self.listing, self.words, self.ranges, byteorder, self.stats, self.module,
+                     self.symbols)
+
+def _makeIncludeGraph(include_resolver, include_paths):
+    """Build the IncludeGraph the parser reads all files through."""
+
+    # a mapping of virtual files works as a resolver too
+    if include_resolver is not None and not callable(include_resolver):
+        include_resolver = include_resolver.get
+
+    # without a resolver, includes are read from disk, next to the file
+    # including them or on the search paths
+    return IncludeGraph(include_paths, include_resolver, read_disk=include_resolver is None)
+
+def assemble(source, include_resolver=None, filename="<string>", single_pass=False, cache=None,
+             recover=False, stats=None, include_paths=(), includes=None, jobs=1, relocatable=False,
+             relax=False, overlap=False):
+    """Assemble a program and return an AssemblyResult.
+
+    source is either the program text (str, bytes or another buffer), or an
+    os.PathLike path of the entry file. include_resolver maps an .include
+    name to its text (None if it does not exist), and may also be a dict of
+    virtual files. Without one, includes are read from disk, relative to the
+    including file's directory (the current one for source text), then to
+    each of include_paths. includes is an optional shass_include.IncludeGraph
+    to share between calls, so files included by several programs are read
+    and tokenized only once; it replaces include_resolver and include_paths.
+    cache is an optional shass_cache.SourceCache; the caller closes it to
+    persist entries. With recover, assembly carries on after errors, and the
+    AssemblerError raised at the end lists every one of them in its
+    diagnostics. stats is an optional shass_stats.AssemblyStats, filled in
+    with timings and counts of this run (and of writeOutputs() on the result).
+    With jobs above 1, the code of large programs is encoded on that many
+    processes (see shass_encode), giving the same result. With relocatable,
+    the program is assembled as a module for the linker, and the result has
+    its shass_object.ObjectModule. With relax, conditional jumps that
+    cannot reach their target become an inverse jump over a JMP. With
+    overlap, code placed by .org over code placed before is no error.
+    """
+
+    if includes is None:
+        includes = _makeIncludeGraph(include_resolver, include_paths)
+
+    if isinstance(source, os.PathLike):
+        filename = os.fspath(source)
+    else:
+        includes.addSource(filename, source if isinstance(source, str) else bytes(source).decode())
+
+    parser = Parser(filename, cache=cache, recover=recover, stats=stats, includes=includes, jobs=jobs,
+                    relocatable=relocatable, relax=relax, overlap=overlap)
+
+    if single_pass:
+        parser.single_parse()
+    else:
+        parser.first_parse()
+        parser.second_parse()
+
+    return AssemblyResult(parser, stats)
+
+def assembleFile(path, include_resolver=None, single_pass=False, cache=None, recover=False, stats=None,
+                 include_paths=(), includes=None, jobs=1, relocatable=False, relax=False, overlap=False):
+    """Assemble the entry file at path. See assemble()."""
+
+    return assemble(pathlib.Path(path), include_resolver, single_pass=single_pass, cache=cache,
+                    recover=recover, stats=stats, include_paths=include_paths, includes=includes, jobs=jobs,
+                    relocatable=relocatable, relax=relax, overlap=overlap)
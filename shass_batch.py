@@ -0,0 +1,130 @@
+"""\
+Batch assembly of many entry files across a process pool.
+
+Each entry file is assembled on its own, with its output files written next
+to it (entry "dir/prog.asm" gives "dir/prog.obj" for the listing), and the
+run ends with an aggregated report.
+
+Every worker reads its files through one IncludeGraph, so a library
+included by many entry files is only read and tokenized once per worker.
+"""
+
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from shass_api import *
+from shass_cache import *
+
+class BatchEntryResult:
+    """Outcome of assembling a single entry file."""
+
+    __slots__ = ("entry", "output", "error", "seconds")
+
+    def __init__(self, entry, output, error, seconds):
+        self.entry = entry
+        self.output = output
+        # None on success, otherwise the error message
+        self.error = error
+        self.seconds = seconds
+
+def expandEntries(patterns):
+    """Expand glob patterns into a sorted, duplicate-free list of entry files."""
+
+    entries = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            entries.extend(sorted(glob.glob(pattern, recursive=True)))
+        else:
+            entries.append(pattern)
+
+    # keep the first occurrence of every file
+    return list(dict.fromkeys(entries))
+
+def outputPath(entry, fmt="listing"):
+    """The output file written for an entry file in a format."""
+
+    return os.path.splitext(entry)[0] + format_extensions[fmt]
+
+# the include graph shared by all entries a worker assembles
+_includes = None
+
+def _includeGraph(include_paths):
+    """The worker's include graph, made on first use."""
+
+    global _includes
+    if _includes is None or _includes.search_paths != list(include_paths):
+        _includes = IncludeGraph(include_paths)
+    return _includes
+
+def assembleEntry(entry, single_pass=False, cache_dir=None, cache_size=None,
+                  formats=("listing",), byteorder="little", recover=False, include_paths=(), relax=False,
+                  overlap=False):
+    """Assemble one entry file into its own output files. Runs in the workers.
+    Without a cache_dir, the cache is not used."""
+
+    start = time.perf_counter()
+    paths = {fmt: outputPath(entry, fmt) for fmt in formats}
+    output = ", ".join(paths.values())
+
+    # pruning is left to the parent, once the whole batch is done
+    cache = None if cache_dir is None else SourceCache(cache_dir, cache_size, prune=False)
+    try:
+        result = assembleFile(entry, single_pass=single_pass, cache=cache, recover=recover,
+                              includes=_includeGraph(include_paths), relocatable="object" in formats,
+                              relax=relax, overlap=overlap)
+        result.writeOutputs(paths, byteorder)
+        error = None
+    except AssemblerError as e:
+        output = None
+        error = str(e)
+    except OSError as e:
+        output = None
+        error = f"File \"{entry}\" could not be read: {e.strerror}."
+    finally:
+        if cache is not None:
+            cache.close()
+    return BatchEntryResult(entry, output, error, time.perf_counter() - start)
+
+def runBatch(entries, jobs=None, single_pass=False, cache_dir=None, cache_size=None,
+             formats=("listing",), byteorder="little", recover=False, include_paths=(), relax=False,
+             overlap=False):
+    """Assemble all entries on a process pool, returning results in entry order."""
+
+    jobs = jobs or os.cpu_count() or 1
+
+    # Hand out entries in chunks, so thousands of small programs do not
+    # each pay a round trip to the pool.
+    chunksize = max(1, len(entries) // (jobs * 8))
+
+    count = len(entries)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(assembleEntry, entries, [single_pass] * count,
+                                    [cache_dir] * count, [cache_size] * count,
+                                    [tuple(formats)] * count, [byteorder] * count, [recover] * count,
+                                    [tuple(include_paths)] * count, [relax] * count, [overlap] * count,
+                                    chunksize=chunksize))
+
+    if cache_dir is not None:
+        SourceCache(cache_dir, cache_size).prune()
+
+    return results
+
+def printReport(results, wall_time):
+    """Print per-file timings and the aggregated success/error report."""
+
+    for result in results:
+        if result.error is None:
+            print(f"OK    {result.seconds * 1000:8.1f} ms  {result.entry} -> {result.output}")
+        else:
+            print(f"FAIL  {result.seconds * 1000:8.1f} ms  {result.entry}")
+            for line in result.error.splitlines():
+                print("      " + line)
+
+    failed = sum(1 for result in results if result.error is not None)
+    busy = sum(result.seconds for result in results)
+
+    print()
+    print(f"{len(results) - failed} assembled, {failed} failed, "
+          f"{wall_time:.2f} s wall, {busy:.2f} s assembling")
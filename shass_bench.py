@@ -0,0 +1,691 @@
+#!/usr/bin/env python3
+
+"""\
+Benchmarks for the shass-asm assembler.
+
+Run with the name of a benchmark, for example:
+    ./shass_bench.py ir-memory --lines 500000
+    ./shass_bench.py encoder --count 1000000
+    ./shass_bench.py sim --count 5000000
+    ./shass_bench.py stream --lines 2000000
+    ./shass_bench.py rept --count 8000
+    ./shass_bench.py encode-jobs --lines 1000000
+    ./shass_bench.py relax --lines 100000
+    ./shass_bench.py lex --lines 6000000
+
+The suite runs a matrix of generated programs (see shass_gen), timing both
+passes and every encoder and recording peak memory, and saves the results
+as JSON. Results of two runs (e.g. two commits) can then be compared:
+    ./shass_bench.py suite --json new.json --baseline old.json
+    ./shass_bench.py compare --json new.json --baseline old.json
+Both exit with status 1 if anything got slower (or bigger) than the
+threshold allows.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from shass_parser import *
+from shass_api import *
+from shass_sim import *
+from shass_gen import *
+from shass_stats import *
+from shass_include import lexLines, lexText
+
+# bytes of IR memory a line may take at most, checked by ir-memory
+IR_LINE_BUDGET = 240
+
+def generateLines(lines):
+    """Generate the lines of a simple synthetic program of roughly the given
+    number of lines."""
+
+    yield ".dseg\n"
+    for i in range(16):
+        yield f"var{i}    1\n"
+    yield ".cseg\n"
+
+    written = 18
+    label = 0
+    while written < lines:
+        # a label followed by a small block referencing it, the next label
+        # and some variables
+        yield f"L{label}\n"
+        yield f"        LDD   var{label % 16}      ; load\n"
+        yield f"        ADDI  {label % 200}\n"
+        yield f"        STD   var{(label + 1) % 16}\n"
+        yield f"        CMPI  0\n"
+        yield f"        JNZ   L{label}\n"
+        yield f"        NOP\n"
+        yield f"        JMP   L{label + 1}\n"
+        yield f"        NOP\n"
+        written += 9
+        label += 1
+
+        # stay within the 13-bit code space, over the code before (so these
+        # programs are assembled with overlap allowed)
+        if label % 900 == 0:
+            yield ".org 0\n"
+            written += 1
+
+    # the target of the last forward jump
+    yield f"L{label}\n"
+
+def generateSource(path, lines):
+    """Write a simple synthetic program of roughly the given number of lines."""
+
+    with open(path, "w") as f:
+        f.writelines(generateLines(lines))
+
+class _NullWriter:
+    """Discards the listing, so only parsing is measured."""
+
+    def writeLine(self, str):
+        pass
+
+def benchIRMemory(lines):
+    """Measure the memory held by the intermediate representation."""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "main.asm")
+        generateSource(path, lines)
+        source_size = os.path.getsize(path)
+
+        # time both passes without tracing overhead first
+        parser = Parser(path, overlap=True)
+
+        start = time.perf_counter()
+        parser.first_parse()
+        first_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parser.second_parse(_NullWriter())
+        second_time = time.perf_counter() - start
+
+        # then measure what the IR built by the first pass holds on to
+        tracemalloc.start()
+        parser = Parser(path, overlap=True)
+        parser.first_parse()
+        ir_size, ir_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        ir_lines = len(parser.getLines())
+
+        print(f"source lines:      {lines} ({source_size / 2**20:.1f} MiB)")
+        print(f"IR lines:          {ir_lines}")
+        print(f"IR memory:         {ir_size / 2**20:.1f} MiB ({ir_size / ir_lines:.0f} bytes/line)")
+        print(f"first pass peak:   {ir_peak / 2**20:.1f} MiB")
+        print(f"first pass:        {first_time:.2f} s")
+        print(f"second pass:       {second_time:.2f} s (from IR)")
+
+        assert ir_size / ir_lines <= IR_LINE_BUDGET, \
+            f"IR takes {ir_size / ir_lines:.0f} bytes/line, over the budget of {IR_LINE_BUDGET}."
+
+def benchEncodeJobs(lines):
+    """Time the second pass encoding on 1, 2, 4, ... processes, up to the
+    number of cores, checking the code is the same as encoded serially."""
+
+    cores = os.cpu_count() or 1
+    jobs = [1, 2]
+    while jobs[-1] < cores:
+        jobs.append(jobs[-1] * 2)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "main.asm")
+        generateSource(path, lines)
+
+        print(f"source lines:      {lines} ({cores} cores)")
+        serial = None
+        for count in jobs:
+            parser = Parser(path, jobs=count, overlap=True)
+            parser.first_parse()
+
+            start = time.perf_counter()
+            parser.second_parse()
+            seconds = time.perf_counter() - start
+
+            words = [srcline.word for srcline in parser.getLines() if srcline.kind == SourceLine.CODE]
+            if serial is None:
+                serial = (words, seconds)
+            assert words == serial[0], f"{count} processes encoded different code"
+
+            print(f"{count:2d} processes:      {seconds:.2f} s ({serial[1] / seconds:.2f}x, "
+                  f"{len(words) / seconds:.0f} lines/s)")
+
+def _sampleInstructions():
+    """One instruction of every mnemonic, with typical operands."""
+
+    dsym = {"var": 3}
+    csym = {"target": 40}
+    samples = []
+    for opcode in Opcode.no_operand_codes:
+        samples.append((opcode, Operands([], dsym, csym, 50)))
+    for opcode in Opcode.one_operand_codes:
+        samples.append((opcode, Operands(["target" if opcode[0] == "J" else "var"], dsym, csym, 50)))
+    for opcode in Opcode.long_operand_codes:
+        samples.append((opcode, Operands(["target"], dsym, csym, 50)))
+    for opcode in Opcode.st_ld_codes:
+        samples.append((opcode, Operands(["X+", "var"], dsym, csym, 50)))
+    for opcode in Opcode.alu_codes:
+        samples.append((opcode, Operands(["S", "var"], dsym, csym, 50)))
+    return samples
+
+# The encoder the assembler had before the dispatch table (instruction
+# classes formatting the word as text), kept as it was for comparison.
+
+class _OldOpcode:
+    def __init__(self, opcode):
+        self._opcode = opcode
+
+    def factory(opcode, operand):
+        if opcode in Opcode.no_operand_codes:
+            return _OldNoOperandOpcode(opcode, operand)
+        elif opcode in Opcode.one_operand_codes:
+            return _OldOneOperandOpcode(opcode, operand)
+        elif opcode in Opcode.long_operand_codes:
+            return _OldLongOperandOpcode(opcode, operand)
+        elif opcode in Opcode.st_ld_codes:
+            return _OldStLdOpcode(opcode, operand)
+        elif opcode in Opcode.alu_codes:
+            return _OldAluOpcode(opcode, operand)
+        else:
+            raise Exception(f"Opcode {opcode} is not defined.")
+
+class _OldNoOperandOpcode(_OldOpcode):
+    def __init__(self, opcode, operand):
+        super().__init__(opcode)
+        if operand.getCount() != 0:
+            raise Exception(f"Opcode {opcode} should have no arguments.")
+
+    def __str__(self):
+        return "{:04X}".format(Opcode.no_operand_codes[self._opcode])
+
+class _OldOneOperandOpcode(_OldOpcode):
+    def __init__(self, opcode, operand):
+        super().__init__(opcode)
+        if operand.getCount() != 1:
+            raise Exception(f"Opcode {opcode} should have 1 argument.")
+        self._operand = operand
+
+    def __str__(self):
+        opcode_str = "{:02X}".format(Opcode.one_operand_codes[self._opcode])
+        operand_str = "{:02X}".format(self._operand.evaluateOneOperand())
+        return opcode_str + operand_str
+
+class _OldLongOperandOpcode(_OldOpcode):
+    def __init__(self, opcode, operand):
+        super().__init__(opcode)
+        if operand.getCount() != 1:
+            raise Exception(f"Opcode {opcode} should have 1 argument.")
+        self._operand = operand
+
+    def __str__(self):
+        opcode_str = "{:03b}".format(Opcode.long_operand_codes[self._opcode])
+        operand_str = "{:013b}".format(self._operand.evaluateOneOperand(absolute = True))
+        return "{:04X}".format(int(opcode_str + operand_str, 2))
+
+class _OldStLdOpcode(_OldOpcode):
+    def __init__(self, opcode, operand):
+        super().__init__(opcode)
+        if operand.getCount() != 2:
+            raise Exception(f"Opcode {opcode} should have 2 arguments.")
+        self._operand = operand
+
+    def __str__(self):
+        opcode_str = "{:03b}".format(Opcode.st_ld_codes[self._opcode])
+        opcode_str += self._operand.sxPattern()
+        operand_str = "{:08b}".format(self._operand.evaluateOneOperand(swap = True))
+        return "{:04X}".format(int(opcode_str + operand_str, 2))
+
+class _OldAluOpcode(_OldOpcode):
+    def __init__(self, opcode, operand):
+        super().__init__(opcode)
+        self._operand = operand
+
+    def __str__(self):
+        opcode_str = "{:06b}".format(Opcode.alu_codes[self._opcode])
+
+        if self._operand.getCount() == 0:
+            raise Exception("ALU operation needs at least one operand.")
+
+        if self._operand.getCount() == 1:
+            opcode_str += "00"
+            operand_str = "{:08b}".format(self._operand.evaluateOneOperand())
+        elif self._operand.aluX():
+            opcode_str += "01"
+            operand_str = "{:08b}".format(self._operand.evaluateOneOperand(swap = True))
+        else:
+            opcode_str += "10"
+            operand_str = "{:08b}".format(self._operand.evaluateOneOperand(swap = True))
+
+        return "{:04X}".format(int(opcode_str + operand_str, 2))
+
+def benchEncoder(count):
+    """Compare the encoder dispatch table against the old opcode classes."""
+
+    samples = _sampleInstructions()
+    rounds = max(1, count // len(samples))
+    total = rounds * len(samples)
+
+    # both must agree on every sample before timing anything
+    for opcode, operands in samples:
+        assert str(_OldOpcode.factory(opcode, operands)) == "{:04X}".format(Opcode.encode(opcode, operands))
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for opcode, operands in samples:
+            str(_OldOpcode.factory(opcode, operands))
+    class_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for opcode, operands in samples:
+            Opcode.encode(opcode, operands)
+    table_time = time.perf_counter() - start
+
+    print(f"instructions:      {total}")
+    print(f"opcode classes:    {class_time / total * 1e9:.0f} ns/instruction (factory + str)")
+    print(f"encoder table:     {table_time / total * 1e9:.0f} ns/instruction (int word)")
+    print(f"speedup:           {class_time / table_time:.2f}x")
+
+# endless loop mixing every kind of instruction, for the simulator
+_sim_source = """\
+.dseg
+count   1
+table   16
+.cseg
+Loop
+        LDD   count
+        ADDI  1
+        STD   count
+        TAX
+        LD    X+ table
+        ADD   X table
+        ST    -X table
+        LSR
+        CALL  Sub
+        NOP
+        CMPI  0
+        JNE   Loop
+        NOP
+        JMP   Loop
+        NOP
+Sub
+        XORI  85
+        RTS
+"""
+
+def benchSim(count):
+    """Measure the simulator in instructions per second."""
+
+    words = assemble(_sim_source).words
+
+    start = time.perf_counter()
+    sim = Simulator(words)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sim.run(count)
+    run_time = time.perf_counter() - start
+
+    print(f"instructions:      {sim.steps}")
+    print(f"load + predecode:  {load_time * 1000:.1f} ms (decode table built on first load)")
+    print(f"run:               {run_time:.2f} s")
+    print(f"speed:             {sim.steps / run_time / 1e6:.2f} M instructions/s")
+
+class _CountingWriter:
+    """Counts the streamed listing lines."""
+
+    def __init__(self):
+        self.lines = 0
+
+    def writeLine(self, str):
+        self.lines += 1
+
+def _streamRun(lines):
+    """Stream a generated program of the given size through the parser,
+    returning (listing lines, seconds, peak traced bytes)."""
+
+    writer = _CountingWriter()
+    tracemalloc.start()
+    start = time.perf_counter()
+    Parser("<stream>", overlap=True).stream_parse(generateLines(lines), writer)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return writer.lines, seconds, peak
+
+def benchStream(lines):
+    """Stream generated source, never written to disk, through the parser,
+    checking that memory does not grow with the program like the IR does."""
+
+    small = max(1000, lines // 4)
+    small_lines, _, small_peak = _streamRun(small)
+    listing_lines, seconds, peak = _streamRun(lines)
+
+    # every code line and label must come out
+    expected = sum(1 for line in generateLines(lines) if line[0] == " " or line[0] == "L")
+    assert listing_lines == expected, (listing_lines, expected)
+
+    # what is left besides the symbol tables, which stream_parse keeps
+    growth = (peak - small_peak) / (lines - small)
+
+    print(f"source lines:      {lines} (streamed from a generator)")
+    print(f"listing lines:     {listing_lines}")
+    print(f"stream time:       {seconds:.2f} s ({lines / seconds:.0f} lines/s, traced)")
+    print(f"peak memory:       {peak / 2**20:.1f} MiB ({small_peak / 2**20:.1f} MiB at {small} lines)")
+    print(f"growth:            {growth:.1f} bytes/line (symbol tables only, the IR takes ~280)")
+
+_rept_macro = """\
+.macro ENTRY v
+        LDI v
+.endm
+"""
+
+def _timedAssemble(source):
+    """Assemble source, returning (result, seconds, peak traced bytes)."""
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = assemble(source)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak
+
+def benchRept(count):
+    """Compare a table written with .rept and a macro against the same
+    table written out line by line, as generators used to."""
+
+    # a table has to fit the code space
+    count = min(count, 8000)
+
+    repeated = _rept_macro + f"Table\n.rept {count}\n        ENTRY 5\n.endr\n"
+    expanded = _rept_macro + "Table\n" + "        LDI 5\n" * count
+
+    rept_result, rept_time, rept_peak = _timedAssemble(repeated)
+    expanded_result, expanded_time, expanded_peak = _timedAssemble(expanded)
+    assert rept_result.words == expanded_result.words
+
+    print(f"table entries:     {count}")
+    print(f"source size:       {len(repeated)} bytes with .rept, {len(expanded)} written out")
+    print(f"with .rept:        {rept_time * 1000:.1f} ms, peak {rept_peak / 2**20:.1f} MiB (traced)")
+    print(f"written out:       {expanded_time * 1000:.1f} ms, peak {expanded_peak / 2**20:.1f} MiB (traced)")
+
+def generateBranches(lines, seed=0):
+    """Generate the lines of a program of roughly the given number of
+    instructions, full of conditional jumps to labels up to about 400
+    words away, many of them just out of range of the 8-bit offset."""
+
+    rng = random.Random(seed)
+    label = 0
+    written = 0
+    while written < lines:
+        # regions leaving room in the code space for the relaxed jumps
+        yield ".org 0\n"
+        first = label
+        last = label + 700
+        for label in range(first, last):
+            yield f"L{label}\n"
+            yield "        CMPI  1\n"
+            for _ in range(6):
+                yield "        NOP\n"
+            target = min(last - 1, max(first, label + rng.randint(-50, 50)))
+            yield f"        JNZ   L{target}\n"
+            yield "        NOP\n"
+            written += 9
+        label = last
+
+def benchRelax(lines):
+    """Time relaxing the conditional jumps of a program whose jumps often
+    get out of range, checking that they all reach their targets after."""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "main.asm")
+        with open(path, "w") as f:
+            f.writelines(generateBranches(lines))
+
+        start = time.perf_counter()
+        parser = Parser(path, overlap=True)
+        parser.first_parse()
+        first_time = time.perf_counter() - start
+
+        stats = AssemblyStats()
+        parser = Parser(path, stats=stats, relax=True, overlap=True)
+        parser.first_parse()
+        relaxed, passes = parser.getRelaxation()
+
+        # encoding reports any jump still out of range
+        parser.second_parse()
+        words = sum(1 for srcline in parser.getLines() if srcline.kind == SourceLine.CODE)
+        jumps = sum(1 for line in generateBranches(lines) if "JNZ" in line)
+
+        print(f"instructions:      {words - 2 * relaxed} ({jumps} conditional jumps)")
+        print(f"relaxed:           {relaxed} jumps in {passes} passes, {words} words")
+        print(f"first pass:        {first_time:.2f} s without relaxing")
+        print(f"relaxation:        {stats.times['jump relaxation']:.2f} s")
+
+def _lexRun(lex, text):
+    """Lex text, returning (records, seconds); the records are dropped as
+    they come, so only lexing is measured."""
+
+    records = 0
+    start = time.perf_counter()
+    for _ in lex(text):
+        records += 1
+    return records, time.perf_counter() - start
+
+def benchLex(lines):
+    """Compare lexing the whole text of a file at once against lexing
+    it line by line, as files used to be."""
+
+    text = "".join(generateLines(lines))
+    size = len(text) / 2**20
+
+    # the same records, on a part of the text
+    sample = text[:2**20]
+    assert list(lexText(sample)) == list(lexLines(io.StringIO(sample, newline=None)))
+
+    line_records, line_time = _lexRun(lambda text: lexLines(io.StringIO(text, newline=None)), text)
+    text_records, text_time = _lexRun(lexText, text)
+    assert line_records == text_records
+
+    print(f"source:            {lines} lines, {size:.1f} MiB, {text_records} statements")
+    print(f"line by line:      {line_time:.2f} s ({size / line_time:.1f} MiB/s)")
+    print(f"whole text:        {text_time:.2f} s ({size / text_time:.1f} MiB/s)")
+    print(f"speedup:           {line_time / text_time:.2f}x")
+
+# Bump when results are no longer comparable with older ones.
+SUITE_VERSION = 1
+
+# programs of the suite: name -> shass_gen parameters
+suite_configs = {
+    "1k": {"lines": 1000},
+    "10k": {"lines": 10000},
+    "100k": {"lines": 100000},
+    "1m": {"lines": 1000000},
+    "10k-dense-labels": {"lines": 10000, "label_density": 0.5},
+    "10k-sparse-labels": {"lines": 10000, "label_density": 0.02},
+    "10k-forward": {"lines": 10000, "forward_ratio": 0.9},
+    "10k-backward": {"lines": 10000, "forward_ratio": 0.1},
+    "10k-big-data": {"lines": 10000, "data_size": 256},
+    "10k-includes": {"lines": 10000, "includes": 16},
+}
+
+def _gitRevision():
+    """The commit of the working tree, or None outside of git."""
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _encoderThroughput(parser):
+    """Time every encoder on the code lines of a parsed program, in
+    nanoseconds per instruction."""
+
+    groups = {}
+    for srcline in parser.getLines():
+        if srcline.kind == SourceLine.CODE:
+            encoder = Opcode.encoders[srcline.tokens[0]][0].__name__
+            groups.setdefault(encoder, []).append(srcline)
+
+    csym = parser.getCodeSymbols()
+    dsym = parser.getDataSymbols()
+    results = {}
+    for encoder, srclines in sorted(groups.items()):
+        start = time.perf_counter()
+        for srcline in srclines:
+            Opcode.encode(srcline.tokens[0], Operands(srcline.tokens[1:], dsym, csym, srcline.address))
+        results[encoder] = (time.perf_counter() - start) / len(srclines) * 1e9
+    return results
+
+def runSuiteConfig(params, seed=0, repeat=3):
+    """Generate one program and benchmark it, returning a dict of results.
+    Timings are the best of repeat runs."""
+
+    with tempfile.TemporaryDirectory() as tmp:
+        entry = generateProgram(tmp, seed=seed, **params)
+
+        # includes are read relative to the working directory
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            first_times = []
+            second_times = []
+            for _ in range(repeat):
+                parser = Parser(os.path.basename(entry), overlap=True)
+                start = time.perf_counter()
+                parser.first_parse()
+                first_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                parser.second_parse()
+                second_times.append(time.perf_counter() - start)
+
+            encoders = _encoderThroughput(parser)
+            statements = len(parser.getLines())
+            code_lines = sum(srcline.kind == SourceLine.CODE for srcline in parser.getLines())
+
+            # memory is measured apart, tracing slows everything down
+            tracemalloc.start()
+            parser = Parser(os.path.basename(entry), overlap=True)
+            parser.first_parse()
+            parser.second_parse()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        finally:
+            os.chdir(cwd)
+
+    first_time = min(first_times)
+    second_time = min(second_times)
+    return {"params": params, "statements": statements, "code_lines": code_lines,
+            "first_parse": first_time, "second_parse": second_time,
+            "lines_per_second": statements / (first_time + second_time),
+            "peak_memory": peak, "encoders": encoders}
+
+def benchSuite(args):
+    """Run the suite, print a summary and save it as JSON."""
+
+    results = {}
+    for name, params in suite_configs.items():
+        if params["lines"] > args.max_lines:
+            continue
+        result = runSuiteConfig(params, args.seed, args.repeat)
+        results[name] = result
+        print(f"{name:<18} first {result['first_parse'] * 1000:9.1f} ms   "
+              f"second {result['second_parse'] * 1000:9.1f} ms   "
+              f"{result['lines_per_second']:9.0f} lines/s   "
+              f"peak {result['peak_memory'] / 2**20:7.1f} MiB")
+
+    report = {"version": SUITE_VERSION, "commit": _gitRevision(), "python": platform.python_version(),
+              "seed": args.seed, "results": results}
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to \"{args.json}\"")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if compareResults(baseline, report, args.threshold):
+            sys.exit(1)
+
+def compareResults(baseline, current, threshold=0.1):
+    """Print how every metric changed between two suite reports, returning
+    the number of regressions beyond the threshold (0.1 is 10% worse)."""
+
+    if baseline.get("version") != current.get("version") or baseline.get("seed") != current.get("seed"):
+        print("Results are from different suite versions or seeds, and cannot be compared.")
+        return 1
+
+    print(f"baseline {baseline.get('commit')} -> current {current.get('commit')}")
+    regressions = 0
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        old = baseline["results"][name]
+
+        metrics = [(metric, old[metric], result[metric])
+                   for metric in ("first_parse", "second_parse", "peak_memory")]
+        metrics += [("encoder " + encoder, old["encoders"][encoder], value)
+                    for encoder, value in result["encoders"].items() if encoder in old["encoders"]]
+
+        for metric, old_value, value in metrics:
+            ratio = value / old_value if old_value else 1.0
+            regressed = ratio > 1 + threshold
+            regressions += regressed
+            print(f"{name:<18} {metric:<30} {ratio:6.2f}x{'  REGRESSION' if regressed else ''}")
+
+    print(f"{regressions} regressions beyond {threshold:.0%}")
+    return regressions
+
+def benchCompare(args):
+    """Compare two saved suite reports."""
+
+    if args.json is None or args.baseline is None:
+        sys.exit("compare needs both --json and --baseline")
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    with open(args.json, "r") as f:
+        current = json.load(f)
+    if compareResults(baseline, current, args.threshold):
+        sys.exit(1)
+
+benchmarks = {
+    "ir-memory": lambda args: benchIRMemory(args.lines),
+    "encoder": lambda args: benchEncoder(args.count),
+    "sim": lambda args: benchSim(args.count),
+    "stream": lambda args: benchStream(args.lines),
+    "rept": lambda args: benchRept(args.count),
+    "encode-jobs": lambda args: benchEncodeJobs(args.lines),
+    "relax": lambda args: benchRelax(args.lines),
+    "lex": lambda args: benchLex(args.lines),
+    "suite": benchSuite,
+    "compare": benchCompare,
+}
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Benchmarks for the shass-asm assembler.")
+    argparser.add_argument("benchmark", choices=sorted(benchmarks))
+    argparser.add_argument("--lines", type=int, default=500000, help="number of generated source lines")
+    argparser.add_argument("--count", type=int, default=1000000, help="number of encoded or simulated instructions")
+    argparser.add_argument("--json", default=None, help="suite results file to write (or compare)")
+    argparser.add_argument("--baseline", default=None, help="suite results file to compare against")
+    argparser.add_argument("--threshold", type=float, default=0.1,
+                           help="relative slowdown counted as a regression (default 0.1)")
+    argparser.add_argument("--max-lines", type=int, default=100000,
+                           help="skip suite programs larger than this (1000000 runs all)")
+    argparser.add_argument("--seed", type=int, default=0, help="seed of the generated suite programs")
+    argparser.add_argument("--repeat", type=int, default=3, help="runs per suite program, the best counts")
+    args = argparser.parse_args()
+
+    benchmarks[args.benchmark](args)
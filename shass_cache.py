@@ -0,0 +1,261 @@
+"""\
+Persistent cache for incremental reassembly.
+
+Entries are keyed by the content hash of a source file together with the
+assembler version, so they stay valid for that file wherever it is included.
+Each entry holds the tokenized lines of the file, what the first pass got
+from its runs of lines for the addresses they started at, and the encoded
+words of its code for the addresses and referenced symbol values they were
+encoded with. A file whose lines start at the same addresses skips the
+first pass, and one whose code lands on the same addresses, referencing
+symbols with the same values, reuses its words without encoding them again.
+
+The cache directory is bounded in size, evicting the least recently used
+entries first.
+"""
+
+import glob
+import hashlib
+import os
+import pickle
+import tempfile
+from array import array
+
+from shass_expr import expressionNames
+
+# Bump when the meaning of cached data changes.
+ASSEMBLER_VERSION = "1.1"
+
+# Default size bound of the cache directory.
+DEFAULT_MAX_SIZE = 100 * 2**20
+
+# How many different placements of a file's code to remember encodings
+# (and first pass results) for.
+MAX_PLACEMENTS = 4
+
+def _versionKey():
+    """The assembler version combined with a hash of its own sources, so any
+    change to the assembler invalidates all entries."""
+
+    digest = hashlib.blake2b(ASSEMBLER_VERSION.encode(), digest_size=16)
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "shass_*.py"))):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.digest()
+
+_VERSION_KEY = _versionKey()
+
+def defaultCacheDir():
+    """The per-user cache directory."""
+
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "shass-asm")
+
+def contentKey(text):
+    """The cache key for the contents of a source file."""
+
+    digest = hashlib.blake2b(_VERSION_KEY, digest_size=20)
+    digest.update(text.encode("utf-8", "surrogatepass"))
+    return digest.hexdigest()
+
+class SourceCache:
+    """Content-hash keyed cache of tokenized source files and their code."""
+
+    def __init__(self, directory=None, max_size=None, prune=True, persistent=True):
+        # where the entries are stored
+        self._directory = directory or defaultCacheDir()
+
+        # whether entries are read from and written to the directory at all,
+        #   rather than only kept in memory for the life of the cache
+        self._persistent = persistent
+
+        # size bound of the directory in bytes
+        self._max_size = max_size or DEFAULT_MAX_SIZE
+
+        # whether close() should evict entries to get back within the bound
+        self._prune = prune
+
+        # entries loaded or created during this run: key -> entry dict
+        self._entries = {}
+
+        # keys of entries that need to be written back
+        self._dirty = set()
+
+    def contentKey(self, text):
+        """Return the cache key for the contents of a source file."""
+        return contentKey(text)
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + ".pickle")
+
+    def _load(self, key):
+        """Return the entry for a key, reading it from disk if needed."""
+
+        if key in self._entries:
+            return self._entries[key]
+        if not self._persistent:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+            # mark as recently used
+            os.utime(path)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        self._entries[key] = entry
+        return entry
+
+    def loadRecords(self, key):
+        """Return the tokenized lines of a file, or None if not cached."""
+
+        entry = self._load(key)
+        return None if entry is None else entry["records"]
+
+    def storeRecords(self, key, records):
+        """Remember the tokenized lines of a file."""
+
+        self._entries[key] = {"records": records, "chunks": {}, "words": {}}
+        self._dirty.add(key)
+
+    def loadChunk(self, key, start, state):
+        """Return what the first pass got from the run of a file's lines
+        from record start on, when it started out in the given state, or
+        None if not cached."""
+
+        entry = self._load(key)
+        if entry is None:
+            return None
+        placements = entry["chunks"].get(start)
+        return None if placements is None else placements.get(state)
+
+    def storeChunk(self, key, start, state, chunk):
+        """Remember what the first pass got from the run of a file's lines
+        from record start on, started out in the given state."""
+
+        entry = self._load(key)
+        if entry is None:
+            return
+
+        placements = entry["chunks"].setdefault(start, {})
+        placements.pop(state, None)
+        placements[state] = chunk
+
+        # forget the oldest placements
+        while len(placements) > MAX_PLACEMENTS:
+            del placements[next(iter(placements))]
+
+        self._dirty.add(key)
+
+    def _snapshot(self, code_lines, code_symbols, data_symbols, constants):
+        """Values of every symbol the code lines could reference."""
+
+        snapshot = {}
+        for srcline in code_lines:
+            for token in srcline.tokens[1:]:
+                for name in expressionNames(token):
+                    snapshot[name] = (code_symbols.get(name), data_symbols.get(name), constants.get(name))
+        return snapshot
+
+    def reuseWords(self, key, code_lines, code_symbols, data_symbols, constants=None):
+        """Set the words of a file's code lines from the cache, if they were
+        encoded at the same addresses with the same symbol values.
+        Returns whether the words could be reused."""
+
+        entry = self._load(key)
+        if entry is None:
+            return False
+
+        addresses = array("L", [srcline.address for srcline in code_lines]).tobytes()
+        if addresses not in entry["words"]:
+            return False
+
+        snapshot, words = entry["words"][addresses]
+        constants = constants or {}
+        for name, value in snapshot.items():
+            if (code_symbols.get(name), data_symbols.get(name), constants.get(name)) != value:
+                return False
+
+        for srcline, word in zip(code_lines, array("H", words)):
+            srcline.word = word
+        return True
+
+    def storeWords(self, key, code_lines, code_symbols, data_symbols, constants=None):
+        """Remember the words a file's code lines were encoded to."""
+
+        entry = self._load(key)
+        if entry is None:
+            return
+
+        addresses = array("L", [srcline.address for srcline in code_lines]).tobytes()
+        words = array("H", [srcline.word for srcline in code_lines]).tobytes()
+
+        placements = entry["words"]
+        placements.pop(addresses, None)
+        placements[addresses] = (self._snapshot(code_lines, code_symbols, data_symbols, constants or {}), words)
+
+        # forget the oldest placements
+        while len(placements) > MAX_PLACEMENTS:
+            del placements[next(iter(placements))]
+
+        self._dirty.add(key)
+
+    def retain(self, keys):
+        """Drop the entries of all other keys from memory, such as those of
+        old versions of files, without writing them back."""
+
+        keys = set(keys)
+        self._entries = {key: entry for key, entry in self._entries.items() if key in keys}
+        self._dirty &= keys
+
+    def close(self):
+        """Write back changed entries, and evict old ones if over the size bound."""
+
+        if not self._persistent:
+            self._dirty = set()
+            self._entries = {}
+            return
+
+        if self._dirty:
+            os.makedirs(self._directory, exist_ok=True)
+
+        for key in self._dirty:
+            # write then rename, so concurrent runs never see partial entries
+            fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(self._entries[key], f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+
+        self._dirty = set()
+        self._entries = {}
+
+        if self._prune:
+            self.prune()
+
+    def prune(self):
+        """Evict least recently used entries until within the size bound."""
+
+        try:
+            files = [entry for entry in os.scandir(self._directory)
+                     if entry.is_file() and entry.name.endswith(".pickle")]
+        except FileNotFoundError:
+            return
+
+        stats = []
+        for entry in files:
+            try:
+                stats.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+            except FileNotFoundError:
+                pass
+
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in sorted(stats):
+            if total <= self._max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
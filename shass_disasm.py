@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+"""\
+Disassembler for Caltech10 code.
+
+Turns a code image (an a.obj listing, a .bin or .hex image) back into source
+that assembles to the same words:
+
+    ./shass_disasm.py a.obj
+    ./shass_disasm.py dump.bin --symbols a.sym -o dump.asm
+    ./shass_disasm.py --round-trip
+
+Decoding looks every word up in a 65536-entry table inverting the opcode
+tables of shass_instruction.Opcode. The table is built once and kept in the
+cache directory, keyed by a hash of the opcode tables, so later runs just
+load it.
+
+Labels come from the listing's "; label" lines, or from a symbol file with
+one "ADDRESS  code|data  NAME" line per symbol (address in hex). Without
+labels, relative jumps keep their 8-bit offset and absolute operands their
+number, both of which assemble to the same word.
+"""
+
+import argparse
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+
+from shass_instruction import *
+from shass_output import *
+from shass_cache import defaultCacheDir
+
+# Bump when the layout of the decode table changes.
+DECODE_TABLE_VERSION = 1
+
+# operand kinds of decode table entries
+OPERAND_NONE = 0        # no operand
+OPERAND_IMMEDIATE = 1   # 8-bit number: immediate value or I/O port
+OPERAND_DATA = 2        # 8-bit data address
+OPERAND_RELATIVE = 3    # 8-bit jump offset from the next instruction
+OPERAND_ABSOLUTE = 4    # 13-bit code address
+OPERAND_INDEXED = 5     # S/X index (pattern) and an 8-bit offset
+
+# the index patterns of LD/ST, as written in the source
+stld_patterns = ("S", "S+", "S-", "+S", "-S", "X", "X+", "X-", "+X", "-X")
+
+_decode_table = None
+
+def _tableKey():
+    """Hash of everything the decode table is built from."""
+
+    tables = (DECODE_TABLE_VERSION, Opcode.no_operand_codes, Opcode.one_operand_codes,
+              Opcode.long_operand_codes, Opcode.st_ld_codes, Opcode.alu_codes,
+              [Operands([pattern, "0"], {}, {}, 0).sxPattern() for pattern in stld_patterns])
+    return hashlib.blake2b(repr(tables).encode(), digest_size=12).hexdigest()
+
+def buildDecodeTable():
+    """Invert the opcode tables into a list indexed by instruction word,
+    holding (mnemonic, kind, index, value) entries, or None for words that
+    are no instruction. index is the S/X pattern of OPERAND_INDEXED."""
+
+    table = [None] * 65536
+
+    def add(word, entry):
+        # aliases (JZ/JE, ...) share words, the first mnemonic is kept
+        if table[word] is None:
+            table[word] = entry
+
+    for mnemonic, (encoder, base) in Opcode.encoders.items():
+        if encoder == Opcode.encodeNoOperand:
+            add(base, (mnemonic, OPERAND_NONE, None, None))
+
+        elif encoder == Opcode.encodeOneOperand:
+            if mnemonic[0] == "J":
+                kind = OPERAND_RELATIVE
+            elif mnemonic in ("LDD", "STD"):
+                kind = OPERAND_DATA
+            else:
+                kind = OPERAND_IMMEDIATE
+            for operand in range(256):
+                add(base | operand, (mnemonic, kind, None, operand))
+
+        elif encoder == Opcode.encodeLongOperand:
+            for operand in range(8192):
+                add(base | operand, (mnemonic, OPERAND_ABSOLUTE, None, operand))
+
+        elif encoder == Opcode.encodeStLd:
+            for pattern in stld_patterns:
+                bits = int(Operands([pattern, "0"], {}, {}, 0).sxPattern(), 2)
+                for operand in range(256):
+                    add(base | (bits << 8) | operand, (mnemonic, OPERAND_INDEXED, pattern, operand))
+
+        elif encoder == Opcode.encodeAlu:
+            for operand in range(256):
+                add(base | operand, (mnemonic, OPERAND_DATA, None, operand))
+            for mode, index in ((0b01, "X"), (0b10, "S")):
+                for operand in range(256):
+                    add(base | (mode << 8) | operand, (mnemonic, OPERAND_INDEXED, index, operand))
+
+    return table
+
+def decodeTable(cache_dir=None):
+    """The decode table, built once and then loaded from the cache directory."""
+
+    global _decode_table
+    if _decode_table is not None:
+        return _decode_table
+
+    path = os.path.join(cache_dir or defaultCacheDir(), "decode-" + _tableKey() + ".marshal")
+    try:
+        with open(path, "rb") as f:
+            _decode_table = marshal.load(f)
+        return _decode_table
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    _decode_table = buildDecodeTable()
+
+    # a missing or read-only cache only costs building the table again
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            marshal.dump(_decode_table, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+
+    return _decode_table
+
+def readSymbolFile(path):
+    """Code and data symbols of a symbol file, as two name -> address dicts."""
+
+    code_symbols = {}
+    data_symbols = {}
+    with open(path, "r") as f:
+        for line in f:
+            # symbol maps (see shass_symbols) have more fields after these
+            fields = line.split()
+            if len(fields) < 3 or fields[0].startswith(";"):
+                continue
+            address, segment, name = fields[:3]
+            if segment == "code":
+                code_symbols[name] = int(address, 16)
+            elif segment == "data":
+                data_symbols[name] = int(address, 16)
+    return code_symbols, data_symbols
+
+def _byAddress(symbols):
+    """Invert a symbol table, keeping the first name of every address."""
+
+    names = {}
+    for name, address in sorted(symbols.items(), key=lambda item: (item[1], item[0])):
+        names.setdefault(address, name)
+    return names
+
+def decodeWord(word, address=0, code_names=None, data_names=None):
+    """Disassemble a single word at a code address into the instruction
+    text, or None if it is no instruction. code_names and data_names map
+    addresses to the labels and variables to use as operands."""
+
+    entry = decodeTable()[word]
+    if entry is None:
+        return None
+
+    mnemonic, kind, index, value = entry
+    if kind == OPERAND_NONE:
+        return mnemonic
+
+    if kind == OPERAND_RELATIVE:
+        target = (address + 1 + (value ^ 0x80) - 0x80) & 0x1FFF
+        operand = code_names.get(target, str(value)) if code_names else str(value)
+    elif kind == OPERAND_ABSOLUTE:
+        operand = code_names.get(value, str(value)) if code_names else str(value)
+    elif kind == OPERAND_DATA:
+        operand = data_names.get(value, str(value)) if data_names else str(value)
+    elif kind == OPERAND_INDEXED:
+        operand = f"{index} {value}"
+    else:
+        operand = str(value)
+
+    return f"{mnemonic:<6}{operand}"
+
+def _dataSection(data_symbols):
+    """.dseg lines reserving the variables at their addresses, sized by the
+    gap to the next one."""
+
+    names = sorted(_byAddress(data_symbols).items())
+    if not names:
+        return []
+
+    lines = [".dseg"]
+    if names[0][0] > 0:
+        lines.append(f"Reserved   {names[0][0]}")
+    for (address, name), (next_address, _) in zip(names, names[1:] + [(names[-1][0] + 1, None)]):
+        lines.append(f"{name:<10} {next_address - address}")
+    return lines
+
+def disassemble(words, code_symbols=None, data_symbols=None):
+    """Yield the source lines of a code image, given as an address -> word
+    mapping (a dict, or a sequence indexed from address 0)."""
+
+    code_names = _byAddress(code_symbols or {})
+    data_names = _byAddress(data_symbols or {})
+    table = decodeTable()
+
+    yield from _dataSection(data_symbols or {})
+    yield ".cseg"
+
+    if isinstance(words, dict):
+        items = sorted(words.items())
+    else:
+        items = enumerate(words)
+
+    # padded instruction text of words not using their address, which is
+    # most of them, so every distinct word is only formatted once
+    texts = {}
+
+    next_address = 0
+    for address, word in items:
+        if address != next_address:
+            yield f".org {address}"
+        next_address = address + 1
+
+        if address in code_names:
+            yield code_names[address]
+
+        text = texts.get(word)
+        if text is not None:
+            yield "        {}; {:04X}  {:04X}".format(text, address, word)
+            continue
+
+        entry = table[word]
+        if entry is None:
+            # no instruction assembles to this word, keep it as a comment
+            yield "        ; {:04X}  {:04X}  not an instruction".format(address, word)
+            continue
+
+        text = "{:<24}".format(decodeWord(word, address, code_names, data_names))
+        if entry[1] != OPERAND_RELATIVE:
+            texts[word] = text
+            yield "        {}; {:04X}  {:04X}".format(text, address, word)
+            continue
+
+        target = (address + 1 + (entry[3] ^ 0x80) - 0x80) & 0x1FFF
+        if target in code_names:
+            yield "        {}; {:04X}  {:04X}".format(text, address, word)
+        else:
+            yield "        {}; {:04X}  {:04X}  -> {:04X}".format(text, address, word, target)
+
+def roundTrip():
+    """Disassemble every valid word and assemble it again. Returns a list of
+    (word, text, encoded) for words that do not come back the same."""
+
+    mismatches = []
+    table = decodeTable()
+
+    for word in range(65536):
+        if table[word] is None:
+            continue
+
+        text = decodeWord(word)
+        tokens = text.split()
+        try:
+            encoded = Opcode.encode(tokens[0], Operands(tokens[1:], {}, {}, 0))
+        except Exception as e:
+            encoded = str(e)
+        if encoded != word:
+            mismatches.append((word, text, encoded))
+
+    return mismatches
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Caltech10 disassembler.")
+    argparser.add_argument("image", nargs="?", default="a.obj",
+                           help="listing, .bin or .hex file to disassemble (default: a.obj)")
+    argparser.add_argument("--symbols", metavar="FILE", help="symbol file to restore labels from")
+    argparser.add_argument("--endian", choices=["little", "big"], default="little",
+                           help="byte order of .bin and .hex images")
+    argparser.add_argument("-o", "--output", help="write the source to a file instead of stdout")
+    argparser.add_argument("--round-trip", action="store_true",
+                           help="check that every valid word disassembles to source assembling to it")
+    args = argparser.parse_args()
+
+    if args.round_trip:
+        mismatches = roundTrip()
+        for word, text, encoded in mismatches:
+            print("{:04X}  {:<24} -> {}".format(word, text, encoded))
+        valid = sum(1 for entry in decodeTable() if entry is not None)
+        print(f"{valid} valid words, {len(mismatches)} mismatches")
+        sys.exit(1 if mismatches else 0)
+
+    try:
+        words, code_symbols = readImage(args.image, args.endian)
+        data_symbols = {}
+        if args.symbols is not None:
+            code_symbols, data_symbols = readSymbolFile(args.symbols)
+    except OSError as e:
+        print(f"File \"{e.filename}\" could not be read: {e.strerror}.")
+        sys.exit(1)
+
+    lines = disassemble(words, code_symbols, data_symbols)
+    if args.output is None:
+        for line in lines:
+            print(line)
+    else:
+        writeAtomic(args.output, "".join(line + "\n" for line in lines))
@@ -0,0 +1,79 @@
+"""\
+Parallel encoding of the second pass.
+
+Once the first pass is done the symbol tables are fixed, and the word of a
+code line only depends on its tokens, its address and those tables. So
+the code lines are split into chunks that a pool of processes encodes,
+and the words are put back in order, giving the same code (and the same
+errors, in the same order) as encoding one line after the other.
+
+The symbol tables go to every worker once, when it starts, rather than
+with every chunk. Only the tokens and addresses of the lines go out and
+only the words come back, so small programs are not worth the pool's
+start-up; they are encoded in the parser's own process.
+"""
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from shass_instruction import *
+from shass_error import *
+
+# programs with fewer code lines to encode are not encoded on a pool
+MIN_PARALLEL_LINES = 20000
+
+# number of chunks handed to each worker, so they finish at about the same time
+CHUNKS_PER_JOB = 4
+
+# the symbol tables of the program a worker encodes
+_code_symbols = None
+_data_symbols = None
+_constants = None
+
+def _initWorker(code_symbols, data_symbols, constants):
+    """Receive the symbol tables, once per worker."""
+
+    global _code_symbols, _data_symbols, _constants
+    _code_symbols = code_symbols
+    _data_symbols = data_symbols
+    _constants = constants
+
+def _encodeChunk(lines):
+    """Encode (tokens, address) lines in a worker. Returns the words as
+    bytes, 0 for lines that failed, and (position, message, operand index
+    or None) of the failures."""
+
+    words = array("H")
+    errors = []
+    for position, (tokens, address) in enumerate(lines):
+        try:
+            operands = Operands(tokens[1:], _data_symbols, _code_symbols, address, _constants)
+            words.append(Opcode.encode(tokens[0], operands))
+        except Exception as error:
+            words.append(0)
+            errors.append((position, str(error), error.index if isinstance(error, OperandError) else None))
+    return words.tobytes(), errors
+
+def encodeParallel(lines, code_symbols, data_symbols, constants, jobs):
+    """Encode (tokens, address) lines on a pool of jobs processes.
+
+    Returns (words, errors): an array with a word for every line (0 where
+    encoding failed), and (position, exception) of the failures in order."""
+
+    chunksize = max(1, -(-len(lines) // (jobs * CHUNKS_PER_JOB)))
+    chunks = [lines[start:start + chunksize] for start in range(0, len(lines), chunksize)]
+
+    words = array("H")
+    errors = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_initWorker,
+                             initargs=(code_symbols, data_symbols, constants)) as executor:
+        for chunk_words, chunk_errors in executor.map(_encodeChunk, chunks):
+            offset = len(words)
+            words.frombytes(chunk_words)
+
+            # the exceptions the serial encoder would have seen
+            for position, message, index in chunk_errors:
+                error = Exception(message) if index is None else OperandError(message, index)
+                errors.append((offset + position, error))
+
+    return words, errors
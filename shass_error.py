@@ -1,26 +1,88 @@
+import json
 import os.path
-import sys
+
+class Diagnostic:
+    """A single message reported about a source file."""
+
+    __slots__ = ("file", "line_num", "column", "message", "severity")
+
+    def __init__(self, file, line_num, message, severity="error", column=None):
+        self.file = file
+        self.line_num = line_num
+        # 1-based column of the offending token, None if not known
+        self.column = column
+        self.message = str(message)
+        self.severity = severity
+
+    def __str__(self):
+        return self.format()
+
+    def format(self, with_column=False):
+        """Format the diagnostic the way the command line prints it."""
+
+        where = f"on line {self.line_num}"
+        if with_column and self.column is not None:
+            where += f", column {self.column}"
+        return f"{self.severity.capitalize()} in file \"{self.file}\" {where}:\n     {self.message}"
+
+    def toDict(self):
+        """Return the diagnostic as a plain dict, e.g. for JSON output."""
+        return {"file": self.file, "line": self.line_num, "column": self.column,
+                "message": self.message, "severity": self.severity}
+
+class AssemblerError(Exception):
+    """Raised when assembling stops on an error in the sources.
+
+    diagnostic is the (first) error, diagnostics all that were reported."""
+
+    def __init__(self, diagnostic, diagnostics=None):
+        self.diagnostics = diagnostics or [diagnostic]
+        super().__init__("\n".join(str(d) for d in self.diagnostics))
+        self.diagnostic = diagnostic
+        self.file = diagnostic.file
+        self.line_num = diagnostic.line_num
+        self.message = diagnostic.message
+
+class OperandError(Exception):
+    """Raised for an error in a specific operand (0 is the first one)."""
+
+    def __init__(self, message, index=0):
+        super().__init__(message)
+        self.index = index
+
+class UndefinedSymbolError(OperandError):
+    """Raised when an operand names a symbol that is not (yet) defined."""
+
+    def __init__(self, message, index=0, symbol=None):
+        super().__init__(message, index)
+        # the name that is not defined, if known
+        self.symbol = symbol
 
 class ErrorHandler:
     """Class used for handling errors during parsing."""
 
-    def genericError(file, line_num, message):
+    def genericError(file, line_num, message, column=None):
         """Throw a generic error in file, on line number."""
 
-        print(f"Error in file \"{file}\" on line {line_num}:")
-        print("    ", message)
+        # After an error is found, stop assembling. The command line
+        # prints the message and quits, library users get the exception.
+        raise AssemblerError(Diagnostic(file, line_num, message, column=column))
+
+    def printError(error, file=None):
+        """Print an AssemblerError the way the command line reports it."""
 
-        # After an error is found, stop execution.
-        quit()
+        print(error.diagnostic, file=file)
 
-    def getCommandLineArgument():
-        """Get user supplied command line argument."""
+    def printDiagnostics(diagnostics, fmt="text", file=None):
+        """Print all diagnostics, as text (with columns) or as JSON."""
 
-        try:
-            return sys.argv[1]
-        except:
-            # If no arg supplied, go to main.asm by default.
-            return "main.asm"
+        if fmt == "json":
+            print(json.dumps({"diagnostics": [d.toDict() for d in diagnostics],
+                              "errors": sum(1 for d in diagnostics if d.severity == "error")},
+                             indent=2), file=file)
+        else:
+            for diagnostic in diagnostics:
+                print(diagnostic.format(with_column=True), file=file)
 
     def checkFileExists(file, doExcept = False):
         """Check for existence of a file"""
@@ -31,4 +93,4 @@ class ErrorHandler:
                 print(f"File \"{file}\" does not exist.")
                 quit()
             else:
-                raise Exception(f"File \"{file}\" does not exist.")
\ No newline at end of file
+                raise FileNotFoundError(f"File \"{file}\" does not exist.")
@@ -0,0 +1,285 @@
+"""\
+Constant expressions in operands.
+
+Besides a number or a name, an operand can be an expression such as
+label+2, .IP-3, $1F, 0b1010, HIGH(table) or SIZE*2, made of:
+
+    numbers     decimal, $1F or 0x1F (hex), 0b1010 (binary)
+    names       labels, variables and .equ constants
+    .IP         the address of the instruction
+    operators   + - * / and parentheses
+    HIGH(e)     bits 8-15 of e, and LOW(e) bits 0-7
+
+Whitespace separates operands, so expressions have none.
+
+Every distinct operand text is compiled once into a cached Expression, with
+the parts that depend on no symbol folded into constants. Evaluating it
+looks the names up in the symbol tables at encode time.
+
+Values carry a weight: how often a code address (a label or .IP) is added
+in. Relative jumps turn values of weight 1 into offsets from the next
+instruction, while the difference of two labels (weight 0) stays a plain
+number, as do the results of *, /, HIGH and LOW.
+"""
+
+import re
+
+from shass_error import *
+
+# bound of the number of compiled operands kept
+MAX_CACHED_EXPRESSIONS = 100000
+
+# numbers, names (alphanumeric like labels), .IP and operators
+_token_pattern = re.compile(r"\$[0-9A-Fa-f]+|\.IP|[^\W_]+|[-+*/()]|.")
+
+_hex_pattern = re.compile(r"0[xX][0-9A-Fa-f]+")
+_binary_pattern = re.compile(r"0[bB][01]+")
+
+# compiled operands: text -> Expression
+_cache = {}
+
+# operands with syntax errors: text -> message
+_errors = {}
+
+class Expression:
+    """A compiled operand."""
+
+    __slots__ = ("text", "value", "name", "names", "_evaluate")
+
+    def __init__(self, text, node):
+        self.text = text
+
+        # the value if the expression depends on no symbol, else None
+        self.value = node[1] if node[0] == "num" else None
+
+        # the name if the expression is nothing but one, else None
+        self.name = node[1] if node[0] == "name" else None
+
+        # every symbol name it references
+        self.names = sorted(_names(node))
+
+        self._evaluate = _closure(node)
+
+    def evaluate(self, code_symbols, data_symbols, constants, ip):
+        """Return (value, weight) of the expression at code address ip.
+        Raises UndefinedSymbolError for names in none of the tables."""
+        return self._evaluate(code_symbols, data_symbols, constants, ip)
+
+def lookup(name, code_symbols, data_symbols, constants):
+    """(value, weight) of a name: a label, a variable or a constant."""
+
+    if name in code_symbols:
+        return code_symbols[name], 1
+    if name in data_symbols:
+        return data_symbols[name], 0
+    if constants is not None and name in constants:
+        return constants[name]
+    raise UndefinedSymbolError("Invalid argument given.", 0, name)
+
+def _number(token):
+    """The value of a number token, or None if it is no number."""
+
+    if token.isnumeric():
+        return int(token)
+    if token[0] == "$" and len(token) > 1:
+        return int(token[1:], 16)
+    if _hex_pattern.fullmatch(token):
+        return int(token[2:], 16)
+    if _binary_pattern.fullmatch(token):
+        return int(token[2:], 2)
+    return None
+
+class _SyntaxParser:
+    """Recursive descent parser of an operand into a tree of tuples."""
+
+    def __init__(self, text):
+        self._tokens = _token_pattern.findall(text)
+        self._pos = 0
+
+    def _peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise ValueError("Incomplete expression.")
+        self._pos += 1
+        return token
+
+    def _expect(self, token):
+        if self._next() != token:
+            raise ValueError(f"Expected \"{token}\".")
+
+    def parse(self):
+        node = self._sum()
+        if self._peek() is not None:
+            raise ValueError("Invalid argument given.")
+        return node
+
+    def _sum(self):
+        node = self._product()
+        while self._peek() in ("+", "-"):
+            op = "add" if self._next() == "+" else "sub"
+            node = _fold((op, node, self._product()))
+        return node
+
+    def _product(self):
+        node = self._unary()
+        while self._peek() in ("*", "/"):
+            op = "mul" if self._next() == "*" else "div"
+            node = _fold((op, node, self._unary()))
+        return node
+
+    def _unary(self):
+        if self._peek() == "-":
+            self._next()
+            return _fold(("neg", self._unary()))
+        if self._peek() == "+":
+            self._next()
+            return self._unary()
+        return self._primary()
+
+    def _primary(self):
+        token = self._next()
+
+        if token == "(":
+            node = self._sum()
+            self._expect(")")
+            return node
+
+        if token == ".IP":
+            return ("ip",)
+
+        number = _number(token)
+        if number is not None:
+            return ("num", number)
+
+        if token.isalnum():
+            if token in ("HIGH", "LOW") and self._peek() == "(":
+                self._next()
+                node = self._sum()
+                self._expect(")")
+                return _fold((token.lower(), node))
+            return ("name", token)
+
+        raise ValueError("Invalid argument given.")
+
+def _apply(op, a, b=None):
+    """Apply an operator to values."""
+
+    if op == "add":
+        return a + b
+    if op == "sub":
+        return a - b
+    if op == "mul":
+        return a * b
+    if op == "div":
+        if b == 0:
+            raise OperandError("Division by zero.", 0)
+        return a // b
+    if op == "neg":
+        return -a
+    if op == "high":
+        return (a >> 8) & 0xFF
+    return a & 0xFF
+
+def _fold(node):
+    """Replace an operator applied to numbers only by its value."""
+
+    if all(child[0] == "num" for child in node[1:]):
+        try:
+            return ("num", _apply(node[0], *[child[1] for child in node[1:]]))
+        except OperandError:
+            # reported when the operand is used
+            pass
+    return node
+
+def _names(node):
+    """The symbol names in a tree."""
+
+    if node[0] == "name":
+        return {node[1]}
+    names = set()
+    for child in node[1:]:
+        if isinstance(child, tuple):
+            names |= _names(child)
+    return names
+
+def _closure(node):
+    """Turn a tree into a function of (code symbols, data symbols,
+    constants, ip) returning (value, weight)."""
+
+    kind = node[0]
+
+    if kind == "num":
+        result = (node[1], 0)
+        return lambda csym, dsym, consts, ip: result
+
+    if kind == "name":
+        name = node[1]
+        return lambda csym, dsym, consts, ip: lookup(name, csym, dsym, consts)
+
+    if kind == "ip":
+        return lambda csym, dsym, consts, ip: (ip, 1)
+
+    if kind in ("neg", "high", "low"):
+        inner = _closure(node[1])
+        if kind == "neg":
+            def evaluate(csym, dsym, consts, ip):
+                value, weight = inner(csym, dsym, consts, ip)
+                return -value, -weight
+        else:
+            def evaluate(csym, dsym, consts, ip):
+                return _apply(kind, inner(csym, dsym, consts, ip)[0]), 0
+        return evaluate
+
+    left = _closure(node[1])
+    right = _closure(node[2])
+    if kind == "add":
+        def evaluate(csym, dsym, consts, ip):
+            a, wa = left(csym, dsym, consts, ip)
+            b, wb = right(csym, dsym, consts, ip)
+            return a + b, wa + wb
+    elif kind == "sub":
+        def evaluate(csym, dsym, consts, ip):
+            a, wa = left(csym, dsym, consts, ip)
+            b, wb = right(csym, dsym, consts, ip)
+            return a - b, wa - wb
+    else:
+        def evaluate(csym, dsym, consts, ip):
+            return _apply(kind, left(csym, dsym, consts, ip)[0], right(csym, dsym, consts, ip)[0]), 0
+    return evaluate
+
+def compileExpression(text):
+    """The compiled Expression of an operand text, compiled once and then
+    taken from the cache. Raises OperandError (index 0) on syntax errors."""
+
+    expression = _cache.get(text)
+    if expression is not None:
+        return expression
+
+    message = _errors.get(text)
+    if message is None:
+        try:
+            expression = Expression(text, _SyntaxParser(text).parse())
+        except ValueError as e:
+            message = str(e)
+
+    if len(_cache) + len(_errors) >= MAX_CACHED_EXPRESSIONS:
+        _cache.clear()
+        _errors.clear()
+
+    if message is not None:
+        _errors[text] = message
+        raise OperandError(message, 0)
+
+    _cache[text] = expression
+    return expression
+
+def expressionNames(text):
+    """The symbol names an operand text references, none if it is invalid."""
+
+    try:
+        return compileExpression(text).names
+    except OperandError:
+        return []
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+"""\
+Seeded generator of synthetic Caltech10 programs, for benchmarks.
+
+The same seed and parameters always give the same sources:
+
+    ./shass_gen.py out_dir --lines 100000 --seed 1 --includes 4
+
+writes out_dir/main.asm, including out_dir/inc0.asm ... inc3.asm.
+
+Parameters:
+    lines           total number of source lines, over all files
+    label_density   fraction of instructions that start a new labelled block
+    forward_ratio   fraction of branches jumping forward rather than back
+    data_size       number of variables in the data segment (at most 256)
+    includes        number of files the entry file includes (fan-out)
+"""
+
+import argparse
+import os
+import random
+
+# Code is restarted at address 0 after this many words, so any program
+# size stays within the 13-bit code space. Relative branches never cross
+# such a restart. The regions overlap, so programs bigger than one are
+# assembled with overlap allowed (--allow-overlap).
+REGION_SIZE = 8000
+
+# furthest a relative branch reaches
+_BRANCH_REACH = 120
+
+_no_operand = ("INC", "DEC", "NEG", "NOT", "LSL", "LSR", "ASR", "RLC", "RRC", "ROL", "ROR",
+               "TAX", "TXA", "INX", "DEX", "CLC", "STC", "NOP")
+_alu = ("ADD", "ADC", "SUB", "SBB", "CMP", "AND", "OR", "XOR", "TST")
+_conditional = ("JA", "JAE", "JB", "JBE", "JE", "JNE", "JG", "JGE", "JL", "JLE",
+                "JS", "JNS", "JC", "JNC", "JZ", "JNZ", "JV", "JNV", "JU", "JNU")
+_stld_patterns = ("X", "S", "X+", "X-", "+X", "-X", "S+", "S-", "+S", "-S")
+
+class _Block:
+    """A labelled run of instructions, laid out before any text is written."""
+
+    __slots__ = ("label", "region", "address", "size")
+
+    def __init__(self, label, region, address, size):
+        self.label = label
+        self.region = region
+        self.address = address
+        self.size = size
+
+class ProgramGenerator:
+    """Generates the files of one synthetic program."""
+
+    def __init__(self, lines, seed=0, label_density=0.1, forward_ratio=0.5, data_size=32, includes=0):
+        self.lines = lines
+        self.label_density = label_density
+        self.forward_ratio = forward_ratio
+        self.data_size = max(1, min(256, data_size))
+        self.includes = includes
+        self._random = random.Random(seed)
+
+    def _layout(self, count):
+        """Split count instructions into labelled blocks and place them."""
+
+        blocks = []
+        address = 0
+        region = 0
+        remaining = count
+        while remaining > 0:
+            # block lengths vary around the mean given by the label density
+            mean = max(1.0, 1.0 / max(self.label_density, 1e-6))
+            size = min(remaining, max(2, int(self._random.expovariate(1.0 / mean)) + 1))
+            if address + size > REGION_SIZE:
+                region += 1
+                address = 0
+            blocks.append(_Block(f"L{len(blocks)}", region, address, size))
+            address += size
+            remaining -= size
+        return blocks
+
+    def _branchTarget(self, blocks, index, address):
+        """A label for a relative branch at address in block index, or None
+        if no block in reach."""
+
+        forward = self._random.random() < self.forward_ratio
+        step = 1 if forward else -1
+        candidates = []
+        other = index + step
+        while 0 <= other < len(blocks) and len(candidates) < 4:
+            block = blocks[other]
+            if block.region != blocks[index].region or abs(block.address - address) > _BRANCH_REACH:
+                break
+            candidates.append(block)
+            other += step
+
+        # fall back to the other direction, then to the own label, as long
+        # as they are in reach too (the own label is not, deep in a big block)
+        if not candidates:
+            for block in (blocks[index - step] if 0 <= index - step < len(blocks) else None, blocks[index]):
+                if (block is not None and block.region == blocks[index].region
+                        and abs(block.address - address) <= _BRANCH_REACH):
+                    candidates.append(block)
+                    break
+        if not candidates:
+            return None
+        return self._random.choice(candidates).label
+
+    def _instruction(self, blocks, index, address, remaining):
+        """One instruction line (or two, for a jump and its delay slot)."""
+
+        rnd = self._random
+        var = f"v{rnd.randrange(self.data_size)}"
+        kind = rnd.random()
+
+        if remaining >= 2 and kind < 0.12:
+            target = self._branchTarget(blocks, index, address)
+            if target is not None:
+                return [f"        {rnd.choice(_conditional):<6}{target}", "        NOP"]
+
+        # an absolute jump, also where no label is in reach of a branch
+        if remaining >= 2 and kind < 0.15:
+            target = rnd.choice(blocks).label
+            return [f"        {rnd.choice(('JMP', 'CALL')):<6}{target}", "        NOP"]
+        if kind < 0.35:
+            return [f"        {rnd.choice(('LDD', 'STD')):<6}{var}"]
+        if kind < 0.55:
+            return [f"        {rnd.choice(_alu):<6}{var}"]
+        if kind < 0.65:
+            return [f"        {rnd.choice(_alu) + 'I':<6}{rnd.randrange(256)}"]
+        if kind < 0.75:
+            return [f"        {rnd.choice(('LD', 'ST')):<6}{rnd.choice(_stld_patterns)} {rnd.randrange(256)}"]
+        if kind < 0.82:
+            return [f"        {rnd.choice(_alu):<6}{rnd.choice(('X', 'S'))} {rnd.randrange(256)}"]
+        if kind < 0.85:
+            return [f"        LDI   {rnd.randrange(256)}"]
+        return [f"        {rnd.choice(_no_operand)}"]
+
+    def _codeLines(self, blocks):
+        """Source lines of a list of blocks."""
+
+        lines = []
+        region = blocks[0].region if blocks else 0
+        lines.append(f".org {blocks[0].address}" if blocks else ".cseg")
+        for index, block in enumerate(blocks):
+            if block.region != region:
+                region = block.region
+                lines.append(".org 0")
+            lines.append(block.label + "          ; block of " + str(block.size))
+            address = block.address
+            while address < block.address + block.size:
+                for line in self._instruction(blocks, index, address, block.address + block.size - address):
+                    lines.append(line)
+                    address += 1
+        return lines
+
+    def generate(self, directory):
+        """Write the program into directory, returning the entry file path."""
+
+        os.makedirs(directory, exist_ok=True)
+
+        # about one line in ten is a label, .org or comment
+        instructions = max(1, int(self.lines * 0.9))
+        blocks = self._layout(instructions)
+
+        # share the blocks out between the entry file and its includes
+        parts = self.includes + 1
+        per_part = (len(blocks) + parts - 1) // parts
+        chunks = [blocks[i * per_part:(i + 1) * per_part] for i in range(parts)]
+
+        entry = [f"; generated program, {self.lines} lines", ".dseg"]
+        entry += [f"v{i}    1" for i in range(self.data_size)]
+        entry.append(".cseg")
+        entry += self._codeLines(chunks[0])
+
+        for number, chunk in enumerate(chunks[1:]):
+            name = f"inc{number}.asm"
+            with open(os.path.join(directory, name), "w") as f:
+                f.write("\n".join(self._codeLines(chunk)) + "\n")
+            entry.append(f".include {name}")
+
+        # the last include leaves the code segment where it ended
+        path = os.path.join(directory, "main.asm")
+        with open(path, "w") as f:
+            f.write("\n".join(entry) + "\n")
+        return path
+
+def generateProgram(directory, lines, seed=0, label_density=0.1, forward_ratio=0.5, data_size=32,
+                    includes=0):
+    """Write a synthetic program into directory, returning its entry file."""
+
+    return ProgramGenerator(lines, seed, label_density, forward_ratio, data_size, includes).generate(directory)
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Generate a synthetic Caltech10 program.")
+    argparser.add_argument("directory")
+    argparser.add_argument("--lines", type=int, default=10000)
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument("--label-density", type=float, default=0.1)
+    argparser.add_argument("--forward-ratio", type=float, default=0.5)
+    argparser.add_argument("--data-size", type=int, default=32)
+    argparser.add_argument("--includes", type=int, default=0)
+    args = argparser.parse_args()
+
+    print(generateProgram(args.directory, args.lines, args.seed, args.label_density, args.forward_ratio,
+                          args.data_size, args.includes))
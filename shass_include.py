@@ -0,0 +1,304 @@
+"""\
+Reading, tokenizing and resolving the source files of a program.
+
+An IncludeGraph knows which file includes which. It reads and tokenizes
+every physical file once, however often and from wherever it is included,
+and can be shared by the parsers of several entry files in one process so
+they reuse each other's files:
+
+    graph = IncludeGraph(search_paths=["lib"])
+    for entry in entries:
+        parser = Parser(entry, includes=graph)
+        ...
+
+An .include name is looked up next to the including file first, then in
+each search path in order, and last in the current directory.
+"""
+
+import os
+import re
+import sys
+from array import array
+
+from shass_cache import contentKey
+from shass_error import *
+
+# the text is split into lines a block of about this many characters at a time
+LEX_BLOCK_SIZE = 1 << 20
+
+# distinct lines remembered while lexing a text, so lines that repeat are
+# lexed once
+LEX_MEMO_SIZE = 1 << 16
+
+_comment_pattern = re.compile(r";[^\n]*")
+
+def lexLines(lines):
+    """Generate a (line number, indent, text, tokens) record for every
+    non-empty line read from an iterable, such as an open file. Used for
+    streams, whose text is never whole; see lexText."""
+
+    # Start on line number 1.
+    for line_num, line in enumerate(lines, 1):
+
+        # Remove comments from parsing
+        line += " "
+        line = line[:line.find(';')]
+
+        # Split the line on whitespace
+        split_line = line.split()
+
+        # Only non-empty lines are of interest.
+        if len(split_line) > 0:
+            # mnemonics, labels and operands repeat a lot, so share the strings
+            tokens = tuple([sys.intern(token) for token in split_line])
+            stripped = line.lstrip()
+            yield (line_num, len(line) - len(stripped), stripped.rstrip(), tokens)
+
+class LexedRecords:
+    """The records of the lines of a source file, packed: the line numbers
+    in an array, and the (indent, text, tokens) of every line, shared by the
+    lines that repeat. Iterating or indexing gives (line number, indent,
+    text, tokens) records, made as they are read rather than kept."""
+
+    __slots__ = ("line_nums", "lexed")
+
+    def __init__(self, line_nums=None, lexed=None):
+        self.line_nums = array("I") if line_nums is None else line_nums
+        self.lexed = [] if lexed is None else lexed
+
+    def __len__(self):
+        return len(self.lexed)
+
+    def __iter__(self):
+        for line_num, known in zip(self.line_nums, self.lexed):
+            yield (line_num, *known)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LexedRecords(self.line_nums[index], self.lexed[index])
+        return (self.line_nums[index], *self.lexed[index])
+
+def lexText(text):
+    """Return the LexedRecords of the lines of a source file's text, the
+    same records as lexLines would generate, but working on the whole text:
+    comments are cut from all of it at once, it is split into lines a block
+    at a time, and every distinct line is lexed once. Lines that repeat,
+    like most instructions, share the text and tokens of their records."""
+
+    # Same newline handling as a file.
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if ";" in text:
+        text = _comment_pattern.sub("", text)
+
+    intern = sys.intern
+    records = LexedRecords()
+    add_line_num = records.line_nums.append
+    add_lexed = records.lexed.append
+    # line -> (indent, text, tokens), or None for blank lines
+    lexed = {}
+    line_num = 0
+    start = 0
+    while True:
+        end = text.find("\n", start + LEX_BLOCK_SIZE)
+        for line in (text[start:] if end < 0 else text[start:end]).split("\n"):
+            line_num += 1
+            known = lexed.get(line, False)
+            if known is False:
+                tokens = line.split()
+                known = None
+                if tokens:
+                    stripped = line.lstrip()
+                    # mnemonics, labels and operands repeat a lot, so share the strings
+                    known = (len(line) - len(stripped), stripped.rstrip(), tuple(map(intern, tokens)))
+
+                if len(lexed) >= LEX_MEMO_SIZE:
+                    lexed.clear()
+                lexed[line] = known
+
+            if known is not None:
+                add_line_num(line_num)
+                add_lexed(known)
+
+        if end < 0:
+            break
+        start = end + 1
+
+    return records
+
+class SourceFile:
+    """A source file, read and tokenized."""
+
+    __slots__ = ("path", "key", "records", "includes")
+
+    def __init__(self, path, key, records, includes):
+        # the name the file was first read under
+        self.path = path
+
+        # content hash, as used for the SourceCache
+        self.key = key
+
+        # the lexed non-empty lines, as LexedRecords
+        self.records = records
+
+        # (line number, name, resolved path or None) of its .include lines
+        self.includes = includes
+
+class IncludeGraph:
+    """Source files of one or more programs and the includes between them."""
+
+    def __init__(self, search_paths=(), source_reader=None, read_disk=True):
+        # directories searched for included files
+        self.search_paths = list(search_paths)
+
+        # callable returning the text of a file by name, or None if it does
+        #   not know it, consulted before the disk
+        self._source_reader = source_reader
+
+        # whether .include names the reader does not know are looked up on disk
+        self._read_disk = read_disk
+
+        # texts of files that are not on disk: name -> text
+        self._sources = {}
+
+        # every file read so far: identity (real path or name) -> SourceFile
+        self._files = {}
+
+        # resolved includes: (directory, name) -> path, or None if not found
+        self._resolved = {}
+
+    def addSource(self, name, text):
+        """Add (or replace) a file that is not read from disk."""
+
+        self._sources[name] = text
+        self._files.pop(name, None)
+
+    def _identity(self, path):
+        """What tells physical files apart: the real path of files on disk."""
+
+        if path in self._sources or not self._read_disk:
+            return path
+        return os.path.realpath(path)
+
+    def resolve(self, name, including=None):
+        """The path of the file an .include name in the file including
+        refers to, or None if there is no such file."""
+
+        directory = os.path.dirname(including) if including else ""
+        resolved_key = (directory, name)
+        if resolved_key in self._resolved:
+            return self._resolved[resolved_key]
+
+        path = None
+        if name in self._sources:
+            path = name
+        elif self._source_reader is not None:
+            text = self._source_reader(name)
+            if text is not None:
+                self._sources[name] = text
+                path = name
+
+        if path is None and self._read_disk:
+            for base in [directory] + self.search_paths + [""]:
+                candidate = os.path.normpath(os.path.join(base, name))
+                if os.path.isfile(candidate):
+                    path = candidate
+                    break
+
+        if path is not None:
+            path = sys.intern(path)
+        self._resolved[resolved_key] = path
+        return path
+
+    def _read(self, path):
+        """The text of a file, from the known sources or from disk."""
+
+        if path in self._sources:
+            return self._sources[path]
+        if self._source_reader is not None:
+            text = self._source_reader(path)
+            if text is not None:
+                return text
+
+        # entry files are read from disk even with read_disk off, which only
+        # keeps includes from being looked up there
+        ErrorHandler.checkFileExists(path, True)
+        with open(path, "r") as f:
+            return f.read()
+
+    def load(self, path, cache=None):
+        """Read and tokenize a file once, returning its SourceFile.
+
+        With a shass_cache.SourceCache, the tokens of an unchanged file come
+        from the cache, and the cache gets an entry for every file loaded."""
+
+        identity = self._identity(path)
+        source = self._files.get(identity)
+
+        if source is None:
+            text = self._read(path)
+            key = contentKey(text)
+            records = None if cache is None else cache.loadRecords(key)
+            if records is None:
+                records = lexText(text)
+                if cache is not None:
+                    cache.storeRecords(key, records)
+
+            includes = [(line_num, tokens[1], self.resolve(tokens[1], path))
+                        for line_num, indent, _, tokens in records
+                        if not indent and tokens[0] == ".include" and len(tokens) > 1]
+            source = SourceFile(sys.intern(path), key, records, includes)
+            self._files[identity] = source
+
+        elif cache is not None and cache.loadRecords(source.key) is None:
+            # loaded for another entry, without this cache
+            cache.storeRecords(source.key, source.records)
+
+        return source
+
+    def build(self, entry, cache=None):
+        """Resolve the whole include graph of an entry file up front, reading
+        and tokenizing every file in it. Returns the include cycles found,
+        as lists of paths starting and ending with the same file.
+
+        Files that cannot be read are left out; parsing reports them at
+        their .include line."""
+
+        cycles = []
+        # identities and paths of the files being visited
+        stack = []
+        paths = []
+        done = set()
+
+        def visit(path):
+            source = self.load(path, cache)
+            stack.append(self._identity(path))
+            paths.append(path)
+            for _, _, target in source.includes:
+                if target is None:
+                    continue
+                identity = self._identity(target)
+                if identity in stack:
+                    cycles.append(paths[stack.index(identity):] + [target])
+                elif identity not in done:
+                    try:
+                        visit(target)
+                    except Exception:
+                        pass
+            paths.pop()
+            done.add(stack.pop())
+
+        visit(entry)
+        return cycles
+
+    def forget(self, path):
+        """Drop a file that changed, so it is read and tokenized again."""
+
+        self._files.pop(self._identity(path), None)
+
+        # a new or deleted file can change what any name resolves to
+        self._resolved = {}
+
+    def files(self):
+        """Every SourceFile read so far."""
+        return list(self._files.values())
@@ -1,8 +1,9 @@
 import re
 from shass_error import *
+from shass_expr import *
 
 class Opcode:
-    """Generic parent class for handling an instruction by a given opcode."""
+    """Encoding of the instructions, by their opcode."""
 
     # Constants for translating opcodes into bytecode
     no_operand_codes = {
@@ -73,6 +74,29 @@ class Opcode:
         "OUT": 0b10110000,
         
     }
+    # conditional jumps and the jump taken on the opposite condition
+    inverse_jumps = {
+        "JA": "JBE",
+        "JBE": "JA",
+        "JNC": "JC",
+        "JC": "JNC",
+        "JAE": "JB",
+        "JB": "JAE",
+        "JE": "JNE",
+        "JNE": "JE",
+        "JZ": "JNZ",
+        "JNZ": "JZ",
+        "JG": "JLE",
+        "JLE": "JG",
+        "JGE": "JL",
+        "JL": "JGE",
+        "JS": "JNS",
+        "JNS": "JS",
+        "JU": "JNU",
+        "JNU": "JU",
+        "JV": "JNV",
+        "JNV": "JV"
+    }
     long_operand_codes = {
         "JMP": 0b110,
         "CALL": 0b111
@@ -93,123 +117,89 @@ class Opcode:
         "XOR": 0b001101
     }
 
-    def __init__(self, opcode):
-        self._opcode = opcode
-
-    def opcodeFactory(opcode, operand):
-        """Returns the correct child class for a given opcode."""
-
-        if opcode in Opcode.no_operand_codes:
-            return NoOperandOpcode(opcode, operand)
-        elif opcode in Opcode.one_operand_codes:
-            return OneOperandOpcode(opcode, operand)
-        elif opcode in Opcode.long_operand_codes:
-            return LongOperandOpcode(opcode, operand)
-        elif opcode in Opcode.st_ld_codes:
-            return StLdOpcode(opcode, operand)
-        elif opcode in Opcode.alu_codes:
-            return AluOpcode(opcode, operand)
-        else:
+    def encode(opcode, operand):
+        """Encode an instruction into its 16-bit word using the dispatch table."""
+
+        try:
+            encoder, base = Opcode.encoders[opcode]
+        except KeyError:
             raise Exception(f"Opcode {opcode} is not defined.")
 
-class NoOperandOpcode(Opcode):
-    """Child opcode class for instructions with no operands."""
+        return encoder(opcode, base, operand)
+
+    def encodeNoOperand(opcode, base, operand):
+        """Encoder for instructions with no operands."""
 
-    def __init__(self, opcode, operand):
-        super().__init__(opcode)
         if operand.getCount() != 0:
             raise Exception(f"Opcode {opcode} should have no arguments.")
+        return base
 
-    def __str__(self):
-        return "{:04X}".format(Opcode.no_operand_codes[self._opcode])
+    def encodeOneOperand(opcode, base, operand):
+        """Encoder for instructions with a single 8-bit operand."""
 
-class OneOperandOpcode(Opcode):
-    """Child opcode class for instructions with a single operand."""
-
-    def __init__(self, opcode, operand):
-        super().__init__(opcode)
         if operand.getCount() != 1:
             raise Exception(f"Opcode {opcode} should have 1 argument.")
-        self._operand = operand
-
-    def __str__(self):
-        opcode_str = "{:02X}".format(Opcode.one_operand_codes[self._opcode])
-        operand_str = "{:02X}".format(self._operand.evaluateOneOperand())
-        return opcode_str + operand_str
+        return base | operand.evaluateOneOperand()
 
-class LongOperandOpcode(Opcode):
-    """Child opcode class for instructions with a long (13-bit) single operand."""
+    def encodeLongOperand(opcode, base, operand):
+        """Encoder for instructions with a long (13-bit) absolute operand."""
 
-    def __init__(self, opcode, operand):
-        super().__init__(opcode)
         if operand.getCount() != 1:
             raise Exception(f"Opcode {opcode} should have 1 argument.")
-        self._operand = operand
-
-    def __str__(self):
-        opcode_str = "{:03b}".format(Opcode.long_operand_codes[self._opcode])
-
-        # Long operands correspond to absolute addresses, so pass with corresponding arg.
-        operand_str = "{:013b}".format(self._operand.evaluateOneOperand(absolute = True))
-        return "{:04X}".format(int(opcode_str + operand_str, 2))
+        return base | operand.evaluateOneOperand(absolute = True)
 
-class StLdOpcode(Opcode):
-    """Child opcode class for store and load instructions."""
+    def encodeStLd(opcode, base, operand):
+        """Encoder for store and load instructions."""
 
-    def __init__(self, opcode, operand):
-        super().__init__(opcode)
         if operand.getCount() != 2:
             raise Exception(f"Opcode {opcode} should have 2 arguments.")
-        self._operand = operand
 
-    def __str__(self):
-        opcode_str = "{:03b}".format(Opcode.st_ld_codes[self._opcode])
+        # Pattern for +X, -X, X+, X- etc. goes right above the 8-bit operand
+        return base | (operand.sxBits() << 8) | operand.evaluateOneOperand(swap = True)
 
-        # Get the correct pattern for +X, -X, X+, X- etc.
-        opcode_str += self._operand.sxPattern()
+    def encodeAlu(opcode, base, operand):
+        """Encoder for ALU instructions."""
 
-        # Evaluate other operand, but swap order, since it is the second one
-        operand_str = "{:08b}".format(self._operand.evaluateOneOperand(swap = True))
-
-        return "{:04X}".format(int(opcode_str + operand_str, 2))
-
-class AluOpcode(Opcode):
-    """Child opcode class for ALU instructions."""
-
-    def __init__(self, opcode, operand):
-        super().__init__(opcode)
-        self._operand = operand
-
-    def __str__(self):
-        opcode_str = "{:06b}".format(Opcode.alu_codes[self._opcode])
-
-        if self._operand.getCount() == 0:
+        if operand.getCount() == 0:
             raise Exception("ALU operation needs at least one operand.")
 
         # If only a single operand given, it is absolute addressing
-        if self._operand.getCount() == 1:
-            opcode_str += "00"
-            operand_str = "{:08b}".format(self._operand.evaluateOneOperand())
-
-        # If X is passed as the first argument
-        elif self._operand.aluX():
-            opcode_str += "01"
-            operand_str = "{:08b}".format(self._operand.evaluateOneOperand(swap = True))
-
-        # If S is passed as the first argument
-        else:
-            opcode_str += "10"
-            operand_str = "{:08b}".format(self._operand.evaluateOneOperand(swap = True))
-
-
-        return "{:04X}".format(int(opcode_str + operand_str, 2))
+        if operand.getCount() == 1:
+            return base | operand.evaluateOneOperand()
+
+        # Otherwise indexed by X (01) or S (10)
+        mode = 0b01 if operand.aluX() else 0b10
+        return base | (mode << 8) | operand.evaluateOneOperand(swap = True)
+
+# Dispatch table from mnemonic to (encoder, base word), with the opcode bits
+# already shifted into place.
+Opcode.encoders = {}
+for _opcode, _code in Opcode.no_operand_codes.items():
+    Opcode.encoders[_opcode] = (Opcode.encodeNoOperand, _code)
+for _opcode, _code in Opcode.one_operand_codes.items():
+    Opcode.encoders[_opcode] = (Opcode.encodeOneOperand, _code << 8)
+for _opcode, _code in Opcode.long_operand_codes.items():
+    Opcode.encoders[_opcode] = (Opcode.encodeLongOperand, _code << 13)
+for _opcode, _code in Opcode.st_ld_codes.items():
+    Opcode.encoders[_opcode] = (Opcode.encodeStLd, _code << 13)
+for _opcode, _code in Opcode.alu_codes.items():
+    Opcode.encoders[_opcode] = (Opcode.encodeAlu, _code << 10)
+
+# Estimated clock cycles of every mnemonic, for shass_analyze: one to fetch
+# and execute, and one more for every access to data memory, an I/O port or
+# the stack. Thanks to their delay slot, jumps take as long taken or not.
+Opcode.cycles = dict.fromkeys(Opcode.encoders, 1)
+for _opcode in list(Opcode.st_ld_codes) + list(Opcode.alu_codes) + ["LDD", "STD", "IN", "OUT", "PUSHF", "POPF"]:
+    Opcode.cycles[_opcode] = 2
+Opcode.cycles["CALL"] = 3
+Opcode.cycles["RTS"] = 3
 
 class Operands:
     """Class handling the various types of operands passed to an instruction."""
 
-    def __init__(self, operand_arr, dsym, csym, ip):
+    def __init__(self, operand_arr, dsym, csym, ip, constants=None):
         if len(operand_arr) > 2:
-            raise Exception("An instruction can have no more than 2 operands.")
+            raise OperandError("An instruction can have no more than 2 operands.", 2)
         
         # Set number of operands passed
         self._op_count = len(operand_arr)
@@ -218,9 +208,10 @@ class Operands:
         self._op1 = None if self._op_count == 0 else operand_arr[0]
         self._op2 = None if self._op_count < 2 else operand_arr[1]
 
-        # Store data and code symbol tables
+        # Store data and code symbol tables, and the .equ constants
         self._dsym = dsym
         self._csym = csym
+        self._constants = constants
 
         # Store current instruction pointer
         self._ip = ip
@@ -238,29 +229,34 @@ class Operands:
         elif self._op1 == "S":
             return False
         else:
-            raise Exception("First operand needs to be either \"S\" or \"X\".")
+            raise OperandError("First operand needs to be either \"S\" or \"X\".", 0)
 
     def sxPattern(self):
         """Get store/load instruction pattern."""
 
+        return "{:05b}".format(self.sxBits())
+
+    def sxBits(self):
+        """Get store/load instruction pattern as a 5-bit number."""
+
         pat = re.search(r"[+-][SX]|[SX][+-]|[SX]", self._op1)
 
         if not pat:
-            raise Exception("Invalid pattern given for first operand.")
+            raise OperandError("Invalid pattern given for first operand.", 0)
 
         pat = pat.group()
 
         # Check that the argument contains ONLY S/X and +/-
         if len(pat) != len(self._op1):
-            raise Exception(f"Invalid argument: {self._op1}")
+            raise OperandError(f"Invalid argument: {self._op1}", 0)
         
         # Set the correct pattern according to datasheet.
-        prepost = "1" if len(pat) == 1 or pat[1] == "+" or pat[1] == "-" else "0"
-        incdec = "0" if len(pat) == 1 or pat[0] == "+" or pat[1] == "+" else "1"
-        sx = "0" if "S" in pat else "1" 
-        addrmode = "11" if len(pat) == 1 else "10"
+        prepost = 1 if len(pat) == 1 or pat[1] == "+" or pat[1] == "-" else 0
+        incdec = 0 if len(pat) == 1 or pat[0] == "+" or pat[1] == "+" else 1
+        sx = 0 if "S" in pat else 1
+        addrmode = 0b11 if len(pat) == 1 else 0b10
 
-        return prepost+incdec+sx+addrmode
+        return (prepost << 4) | (incdec << 3) | (sx << 2) | addrmode
     
     def evaluateOneOperand(self, absolute = False, swap = False):
         """Evaluate a single generic operand"""
@@ -268,65 +264,105 @@ class Operands:
         # Absolute: no difference between label and IP should be calculated
         # Swap: the argument is given as the second one
 
-        # Return value initially zero.
-        num = 0
-
         op = self._op1 if not swap else self._op2
 
-        # immediate value - just copy in
-        if op.isnumeric():
-            num = int(op)
-
-        # If in the code symbol table
-        elif op in self._csym:
-            num = self._csym[op]
-            
-            # relative jump - calculate offset
+        # index of the operand, for error reporting
+        index = 1 if swap else 0
+
+        # numbers, names and expressions are compiled once per distinct text
+        try:
+            expression = compileExpression(op)
+            num = expression.value
+            name = expression.name
+
+            # folded to a number
+            if num is not None:
+                weight = 0
+
+            # a single name, looked up here as most operands are one
+            elif name is not None:
+                if name in self._csym:
+                    num, weight = self._csym[name], 1
+                elif name in self._dsym:
+                    num, weight = self._dsym[name], 0
+                else:
+                    num, weight = lookup(name, self._csym, self._dsym, self._constants)
+
+            else:
+                num, weight = expression.evaluate(self._csym, self._dsym, self._constants, self._ip)
+        except OperandError as error:
+            # report against this operand
+            error.index = index
+            raise
+
+        return Operands.operandField(num, weight, self._ip, absolute, index)
+
+    def operandField(num, weight, ip, absolute=False, index=0):
+        """The bits of an operand with the given value and weight (see
+        shass_expr), in an instruction at code address ip. Also used by the
+        linker on relocated operands."""
+
+        # a code address (label or .IP) - relative jump: calculate offset
+        if weight == 1:
             if not absolute:
-                num = num - self._ip - 1
+                num = num - ip - 1
+
+                # the CPU reads the offset as a signed 8-bit number
+                if not (-128 <= num <= 127):
+                    raise OperandError("Argument outside range.", index)
 
                 # If negative, two's complement
                 if num < 0:
                     num = (1<<8) + num
 
-        # variable - look up and copy in
-        elif op in self._dsym:
-            num = self._dsym[op]
+        # sums of several code addresses mean nothing
+        elif weight != 0:
+            raise OperandError("Invalid argument given.", index)
 
-        # instruction pointer - just copy in
-        elif op == ".IP":
-            num = self._ip
+        # negative 8-bit numbers, in two's complement
+        elif not absolute and -128 <= num < 0:
+            num = (1<<8) + num
 
-            # relative jump - calculate offset
-            if not absolute:
-                num = num - self._ip - 1
-
-                # If negative, two's complement
-                if num < 0:
-                    num = (1<<8) + num
-        else:
-            raise Exception("Invalid argument given.")
-        
         # Check for a valid range for 13 or 8 bit number
-        if not (0 <= num <= 8191 if absolute else 255):
-            raise Exception("Argument outside range.")
+        if not (0 <= num <= (8191 if absolute else 255)):
+            raise OperandError("Argument outside range.", index)
 
         return num
     
 class PseudoOp:
     """Handles a pseudo-op operation."""
 
-    def handlePseudoOp(parser, op, arg=""):
+    def handlePseudoOp(parser, op, arg="", value="", *rest):
         if op == ".org":
-            if not arg.isnumeric():
-                raise Exception(f"Pseudo op \"{op}\" passed non-numeric argument: \"{arg}\"")
+            if not arg:
+                raise OperandError(f"Pseudo op \"{op}\" needs an argument.", 0)
             parser.setCodeOrigin(arg)
         elif op == ".cseg":
             parser.setCodeSegment()
         elif op == ".dseg":
             parser.setDataSegment()
         elif op == ".include":
-            ErrorHandler.checkFileExists(arg, True)
             parser.includeFile(arg)
+        elif op == ".equ":
+            if not value:
+                raise OperandError(f"Pseudo op \"{op}\" needs a name and a value.", 1 if arg else 0)
+            parser.defineConstant(arg, value)
+        elif op == ".macro":
+            parser.beginMacro(arg, (value,) + rest if value else ())
+        elif op == ".endm":
+            parser.endMacro()
+        elif op == ".rept":
+            parser.beginRepeat(arg)
+        elif op == ".endr":
+            parser.endRepeat()
+        elif op == ".global" or op == ".extern":
+            if not arg:
+                raise OperandError(f"Pseudo op \"{op}\" needs at least one name.", 0)
+            for index, name in enumerate((arg, value) + rest):
+                if name:
+                    if op == ".global":
+                        parser.exportSymbol(name, index)
+                    else:
+                        parser.importSymbol(name, index)
         else:
             raise Exception(f"Pseudo op \"{op}\" does not exist.")
\ No newline at end of file
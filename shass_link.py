@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+"""\
+Linker of relocatable modules (see shass_object) into a program.
+
+    ./shass_link.py main.o lib.o -o prog.obj
+    ./shass_link.py main.asm lib.asm -f listing,bin -o prog
+
+Sources given instead of objects are assembled into objects next to them
+first, on a process pool. Only modules whose object is missing, or was
+assembled from other contents of one of its files, are assembled again, so
+after an edit just the changed modules are, and linking is the rest.
+
+Code after an .org stays at its address. The relocatable code of every
+module is placed, in the order the modules are given, at the lowest
+address from --code-base on where it fits between the code placed before.
+Variables are placed one module after the other from data address 0.
+A symbol exported by several modules, an imported symbol no module
+exports, overlapping code, variables past the end of the data space and
+relocated operands out of range are errors.
+"""
+
+import argparse
+import bisect
+import os
+import sys
+from array import array
+
+from shass_cache import contentKey, defaultCacheDir
+from shass_object import *
+from shass_output import *
+from shass_symbols import *
+from shass_memory import *
+from shass_error import *
+
+class LinkResult:
+    """A linked program, with the outputs of shass_api.AssemblyResult."""
+
+    def __init__(self, words, ranges, listing, code_symbols, data_symbols, symbols):
+        # code words, indexed by code address
+        self.words = words
+
+        # sorted (start, end) address ranges holding code
+        self.ranges = ranges
+
+        # the lines of the object file listing
+        self.listing = listing
+
+        # symbol tables: name -> address. Exported symbols, and the others
+        #   of the first module defining them
+        self.code_symbols = code_symbols
+        self.data_symbols = data_symbols
+
+        # the shass_symbols.SymbolMap, with the module defining each symbol
+        self.symbols = symbols
+
+    def listingText(self):
+        """Return the listing exactly as written to a.obj."""
+        return formatListing(self.listing)
+
+    def writeOutputs(self, paths, byteorder="little"):
+        """Write the outputs given as a format -> path mapping."""
+        writeOutputs(paths, self.listing, self.words, self.ranges, byteorder, symbols=self.symbols)
+
+class Linker:
+    """Links ObjectModules into a program."""
+
+    def __init__(self, modules, code_base=0):
+        self._modules = list(modules)
+        self._code_base = code_base
+
+        # (module index, section index) -> address of the section
+        self._bases = {}
+
+        # module index -> first data address of its variables
+        self._data_bases = []
+
+        # exported symbols: name -> (kind, address, module index)
+        self._globals = {}
+
+        # (kind, name) -> module index of the symbols in the tables
+        self._owners = {}
+
+    def _placeSections(self):
+        """Give every section its address."""
+
+        # (start, end, module index) of the code placed so far, sorted
+        placed = []
+
+        def overlap(start, end):
+            index = bisect.bisect_left(placed, (start,))
+            for other in placed[max(0, index - 1):index + 1]:
+                if other[0] < end and start < other[1]:
+                    return other
+            return None
+
+        # the fixed sections first
+        for m, module in enumerate(self._modules):
+            for s, section in enumerate(module.sections):
+                if section["origin"] is None:
+                    continue
+                start = section["origin"]
+                end = start + len(section["words"])
+                if end > CODE_SIZE:
+                    raise Exception(f"Code of \"{module.name}\" at ${start:04X} does not fit the code space.")
+                other = overlap(start, end)
+                if other is not None and start < end:
+                    raise Exception(f"Code of \"{module.name}\" at ${start:04X} overlaps code of "
+                                    f"\"{self._modules[other[2]].name}\".")
+                self._bases[(m, s)] = start
+                bisect.insort(placed, (start, end, m))
+
+        # then the relocatable ones, first fit
+        for m, module in enumerate(self._modules):
+            for s, section in enumerate(module.sections):
+                if section["origin"] is not None:
+                    continue
+                size = len(section["words"])
+                start = self._code_base
+                for other in placed:
+                    if start + size <= other[0]:
+                        break
+                    start = max(start, other[1])
+                if start + size > CODE_SIZE:
+                    raise Exception(f"Code of \"{module.name}\" ({size} words) does not fit the code space.")
+                self._bases[(m, s)] = start
+                bisect.insort(placed, (start, start + size, m))
+
+        data_address = 0
+        for module in self._modules:
+            self._data_bases.append(data_address)
+            data_address += module.data_size
+        if data_address > DATA_SIZE:
+            raise Exception(f"Variables of the modules take {data_address} bytes, more than the "
+                            f"{DATA_SIZE} of the data space.")
+
+    def _address(self, m, symbol):
+        """Final address of a symbol of a module."""
+
+        kind, section, offset, _ = symbol
+        if kind == "data":
+            return self._data_bases[m] + offset
+        return self._bases[(m, section)] + offset
+
+    def _collectSymbols(self):
+        """Exported symbols of every module, and the table of all of them."""
+
+        code_symbols = {}
+        data_symbols = {}
+        for m, module in enumerate(self._modules):
+            for name, symbol in module.symbols.items():
+                address = self._address(m, symbol)
+                table = code_symbols if symbol[0] == "code" else data_symbols
+                if name not in table:
+                    table[name] = address
+                    self._owners[(symbol[0], name)] = m
+
+                if symbol[3]:
+                    if name in self._globals:
+                        other = self._modules[self._globals[name][2]]
+                        raise Exception(f"Symbol \"{name}\" is exported by both \"{other.name}\" "
+                                        f"and \"{module.name}\".")
+                    self._globals[name] = (symbol[0], address, m)
+
+        # exported symbols win over the local ones of other modules
+        for name, (kind, address, m) in self._globals.items():
+            (code_symbols if kind == "code" else data_symbols)[name] = address
+            self._owners[(kind, name)] = m
+        return code_symbols, data_symbols
+
+    def _symbolMap(self, code_symbols, data_symbols, ranges):
+        """The SymbolMap of the program, each symbol defined by its module."""
+
+        # a variable takes the data up to the next one of its module
+        data_sizes = {}
+        for (kind, name), m in self._owners.items():
+            if kind != "data":
+                continue
+            module = self._modules[m]
+            offset = module.symbols[name][2]
+            following = [other[2] for other in module.symbols.values()
+                         if other[0] == "data" and other[2] > offset]
+            data_sizes[name] = min(following, default=module.data_size) - offset
+
+        origins = {key: (self._modules[m].name, 0) for key, m in self._owners.items()}
+        return buildSymbolMap(code_symbols, data_symbols, ranges, data_sizes, origins)
+
+    def _relocate(self, m, module, words):
+        """Fill in the relocated operands of a module."""
+
+        for section, offset, field, target, addend, weight, file, line_num in module.relocations:
+            address = self._bases[(m, section)] + offset
+
+            if target == TARGET_CODE:
+                base = self._bases[(m, 0)]
+                weight += 1
+            elif target == TARGET_DATA:
+                base = self._data_bases[m]
+            elif target == TARGET_ABSOLUTE:
+                base = 0
+            elif target in self._globals:
+                kind, base, _ = self._globals[target]
+                if kind == "code":
+                    weight += 1
+            else:
+                ErrorHandler.genericError(file, line_num, f"\"{target}\" is not exported by any module.")
+
+            try:
+                words[address] |= Operands.operandField(base + addend, weight, address,
+                                                        field == FIELD_ABSOLUTE)
+            except OperandError as error:
+                ErrorHandler.genericError(file, line_num, str(error))
+
+    def link(self):
+        """Link the modules, returning a LinkResult. Raises AssemblerError
+        for errors in operands, and Exception for others."""
+
+        self._placeSections()
+        code_symbols, data_symbols = self._collectSymbols()
+
+        words = array("H", bytes(2 * CODE_SIZE))
+        for m, module in enumerate(self._modules):
+            for s, section in enumerate(module.sections):
+                base = self._bases[(m, s)]
+                words[base:base + len(section["words"])] = array("H", section["words"])
+        for m, module in enumerate(self._modules):
+            self._relocate(m, module, words)
+
+        # the listing and ranges in address order
+        listing = []
+        ranges = []
+        for (m, s), base in sorted(self._bases.items(), key=lambda item: (item[1], item[0])):
+            section = self._modules[m].sections[s]
+            labels = sorted(section["labels"], key=lambda label: label[0])
+            index = 0
+            for offset, raw in enumerate(section["source"]):
+                while index < len(labels) and labels[index][0] <= offset:
+                    listing.append(listingLabelLine(labels[index][1]))
+                    index += 1
+                listing.append(listingCodeLine(base + offset, words[base + offset], raw))
+            for _, name in labels[index:]:
+                listing.append(listingLabelLine(name))
+
+            end = base + len(section["words"])
+            if base == end:
+                continue
+            if ranges and ranges[-1][1] == base:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((base, end))
+
+        # shrink the image to the used addresses, as the assembler does
+        used = max((end for _, end in ranges), default=0)
+        return LinkResult(words[:used], ranges, listing, code_symbols, data_symbols,
+                          self._symbolMap(code_symbols, data_symbols, ranges))
+
+def objectIsCurrent(path):
+    """Whether an object file exists and was assembled from the current
+    contents of all its files."""
+
+    try:
+        module = ObjectModule.read(path)
+    except Exception:
+        return False
+
+    for source, key in module.sources:
+        try:
+            with open(source, "r") as f:
+                if contentKey(f.read()) != key:
+                    return False
+        except OSError:
+            return False
+    return True
+
+def linkFiles(paths, code_base=0):
+    """Link object files, returning a LinkResult."""
+
+    modules = []
+    for path in paths:
+        try:
+            modules.append(ObjectModule.read(path))
+        except OSError as error:
+            raise Exception(f"File \"{path}\" could not be read: {error.strerror}.")
+    return Linker(modules, code_base).link()
+
+if __name__ == "__main__":
+    # only the command line assembles stale modules
+    from shass_batch import *
+
+    argparser = argparse.ArgumentParser(description="Linker for Caltech10 relocatable modules.")
+    argparser.add_argument("inputs", nargs="+", metavar="input",
+                           help="object files, or sources to assemble into objects first")
+    argparser.add_argument("-f", "--format", default="listing",
+                           help="output formats, comma separated: listing, bin, ihex, symbols")
+    argparser.add_argument("-o", "--output", default=None,
+                           help="output path, extensions are added for several formats")
+    argparser.add_argument("--endian", choices=("little", "big"), default="little",
+                           help="byte order of binary outputs")
+    argparser.add_argument("--code-base", type=lambda text: int(text, 0), default=0,
+                           help="lowest address of relocatable code (default 0)")
+    argparser.add_argument("--jobs", type=int, default=None,
+                           help="number of processes assembling changed modules")
+    argparser.add_argument("-I", "--include-path", action="append", default=[], metavar="DIR",
+                           help="directory to search for included files, may be repeated")
+    argparser.add_argument("--relax", action="store_true",
+                           help="relax conditional jumps of the modules assembled, see shass_main.py")
+    args = argparser.parse_args()
+
+    formats = list(dict.fromkeys(args.format.split(",")))
+    for fmt in formats:
+        if fmt not in format_extensions or fmt == "object":
+            argparser.error(f"unknown output format \"{fmt}\"")
+
+    # assemble the modules whose objects are missing or out of date
+    objects = [outputPath(path, "object") if path.endswith(".asm") else path for path in args.inputs]
+    stale = list(dict.fromkeys(path for path, obj in zip(args.inputs, objects)
+                               if path.endswith(".asm") and not objectIsCurrent(obj)))
+    if stale:
+        results = runBatch(stale, args.jobs, cache_dir=defaultCacheDir(), formats=("object",),
+                           include_paths=args.include_path, relax=args.relax)
+        for result in results:
+            if result.error is not None:
+                print(result.error)
+                sys.exit(1)
+        print(f"Assembled {len(stale)} of {len(objects)} modules.")
+
+    try:
+        result = linkFiles(objects, args.code_base)
+    except AssemblerError as error:
+        ErrorHandler.printError(error)
+        sys.exit(1)
+    except Exception as error:
+        print(error)
+        sys.exit(1)
+
+    try:
+        result.writeOutputs(outputPaths(args.output, formats), args.endian)
+    except OSError as error:
+        print(f"Cannot write output \"{error.filename}\": {error.strerror}.")
+        sys.exit(1)
+    print("Linker finished successfully!")
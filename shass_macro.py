@@ -0,0 +1,130 @@
+"""\
+Macros and repeated blocks.
+
+    .macro NAME [PARAM ...]
+            ...
+    .endm
+
+    .rept COUNT
+            ...
+    .endr
+
+Both pseudo-ops go in the first column. A macro is invoked like an
+instruction, as an indented line with the macro name and one argument per
+parameter, and every word in its body equal to a parameter is replaced by
+the argument. The lines of an expansion are reported at the line of the
+invocation. COUNT is a constant expression, using symbols defined above.
+
+Block bodies are kept as the lexed records of their lines, tokenized only
+once, and the lines of a macro are substituted once for every distinct
+tuple of arguments. Expanding yields the records lazily, so a .rept 8000
+table is never lexed as 8000 lines of text. Every repetition still
+becomes a line of the IR, though, with its own address and word, so it
+takes about as long to assemble as the table written out.
+
+A .rept count is at most MAX_REPEAT_COUNT, and a repeat stops expanding
+once its code runs past the end of the code space.
+"""
+
+import re
+import sys
+
+from shass_memory import CODE_SIZE
+
+# words a parameter can match: alphanumeric, like labels
+_word_pattern = re.compile(r"[^\W_]+")
+
+# bound of the number of argument tuples a macro keeps the expansion of
+MAX_CACHED_EXPANSIONS = 1000
+
+# bound of the nesting of expansions, which stops macros invoking themselves
+MAX_NESTING = 64
+
+# bound of a .rept count: repeated more often than there are code
+# addresses, a block of code cannot fit
+MAX_REPEAT_COUNT = CODE_SIZE
+
+class Block:
+    """A .macro or .rept block while its lines are read."""
+
+    __slots__ = ("op", "args", "srcline", "body", "_depth")
+
+    def __init__(self, op, args, srcline):
+        # ".macro" or ".rept"
+        self.op = op
+
+        # (name, params) of a macro, (count,) of a repetition, None if the
+        #   header was invalid and the block is only skipped
+        self.args = args
+
+        # the line opening the block, for errors
+        self.srcline = srcline
+
+        # the lexed records of the lines between the pseudo-ops
+        self.body = []
+
+        # number of blocks opened inside it and not closed yet
+        self._depth = 0
+
+    def add(self, record):
+        """Add a record to the body. Returns False for the line ending the
+        block, which is not added."""
+
+        _, indent, _, tokens = record
+        if not indent:
+            if tokens[0] == ".macro" or tokens[0] == ".rept":
+                self._depth += 1
+            elif tokens[0] == ".endm" or tokens[0] == ".endr":
+                if self._depth == 0:
+                    return False
+                self._depth -= 1
+
+        self.body.append(record)
+        return True
+
+class Macro:
+    """A macro definition."""
+
+    __slots__ = ("name", "params", "body", "key", "_expansions")
+
+    def __init__(self, name, params, body, key=None):
+        self.name = name
+        self.params = params
+
+        # (indent, raw, tokens) of the lines of the body
+        self.body = tuple((indent, raw, tokens) for _, indent, raw, tokens in body)
+
+        # cache key of the file it is defined in, None if not known
+        self.key = key
+
+        # arguments -> (indent, raw, tokens) of the expanded lines
+        self._expansions = {}
+
+    def _substitute(self, args):
+        """The lines of the body with the parameters replaced."""
+
+        values = dict(zip(self.params, args))
+
+        def replace(match):
+            return values.get(match.group(), match.group())
+
+        lines = []
+        for indent, raw, tokens in self.body:
+            if any(name in values for token in tokens for name in _word_pattern.findall(token)):
+                raw = _word_pattern.sub(replace, raw)
+                tokens = tuple([sys.intern(token) for token in raw.split()])
+            lines.append((indent, raw, tokens))
+        return tuple(lines)
+
+    def expand(self, args, line_num):
+        """Generate the records of an invocation with the given arguments
+        on line line_num."""
+
+        lines = self._expansions.get(args)
+        if lines is None:
+            if len(self._expansions) >= MAX_CACHED_EXPANSIONS:
+                self._expansions.clear()
+            lines = self._expansions[args] = self._substitute(args)
+
+        for indent, raw, tokens in lines:
+            yield (line_num, indent, raw, tokens)
@@ -5,45 +5,404 @@ This is the entry file of the shass-asm assembler for the Caltech10 CPU.
 
 To run the assembler, this program should be run with one argument - 
 the main (entry) assembly file. By default, main.asm will be assembled.
+
+Options:
+    --single-pass   encode in a single pass over the sources, backpatching
+                    forward references instead of reading everything twice
+    --batch         assemble every given entry file (globs are expanded, and
+                    @file reads more arguments from a manifest) on a process
+                    pool, writing each one's object file next to it
+    --jobs N        number of worker processes for --batch (default: cores)
+    --encode-jobs N encode the code of a large program on N processes in
+                    the second pass (default 1); the output is the same
+    --relax         turn conditional jumps that cannot reach their target
+                    into the inverse jump over a NOP and a JMP to it (three
+                    words instead of one), moving the code after them
+    --allow-overlap allow .org to place code over code placed before, which
+                    is an error otherwise (as is code past $1FFF)
+    --no-cache      do not use the persistent cache of tokenized files and
+                    encoded code (kept in ~/.cache/shass-asm by default)
+    --cache-dir D   directory for the persistent cache
+    --cache-size M  size bound of the cache in MiB (default 100)
+    -f, --format F  output formats, comma separated: listing (a.obj, the
+                    default), bin (raw 16-bit image), ihex (Intel HEX),
+                    object (a relocatable module for shass_link.py, a.o)
+                    and symbols (labels and variables sorted by address,
+                    with sizes and where they are defined, a.sym)
+    -o, --output P  output path; with several formats, extensions are added
+    --endian E      byte order of bin and ihex output: little (default) or big
+    --all-errors    carry on after errors, reporting all of them (with
+                    columns) in a single run
+    --diagnostics-format F
+                    text (default) or json, printing all diagnostics as JSON
+    --stream        read the source from stdin and write the listing to
+                    stdout as lines get encoded, without keeping the whole
+                    program in memory (lines with forward references come
+                    out once the symbol is defined); errors go to stderr
+    -I, --include-path DIR
+                    also look for included files in DIR (may be repeated);
+                    includes are looked up next to the including file
+                    first, then in these directories in order, and last in
+                    the current directory. Included files may include others.
+    --watch         stay running, reassembling whenever the entry file or one
+                    of its includes is saved. Only the changed file is read
+                    again, and the code of the others is reused where it
+                    did not move. Stop with Ctrl-C.
+    --analyze       report the size and estimated cycles of every routine,
+                    its loops and hot spots (see shass_analyze.py)
+    --memory-map    report the used and free ranges of the code and data
+                    spaces
+    --stats         report the time of every phase, throughput, symbol table
+                    sizes and the count of every encoded mnemonic
+    --profile FILE  run under cProfile, writing the profile to FILE and
+                    reporting the functions taking the most time
+    --trace-memory  report the peak memory and top allocation sites
 """
 
+import argparse
+import time
+
 from shass_parser import *
+from shass_batch import *
+from shass_cache import *
+from shass_output import *
+from shass_stats import *
+from shass_watch import *
+from shass_analyze import analyzeRoutines, formatReport
 
 class CommandLineInputParser:
-    """Class for getting the entry file as specified by user."""
+    """Class for getting the entry file and options as specified by user."""
     def __init__(self):
-        # get the argument for the main file
-        self._main_file = ErrorHandler.getCommandLineArgument()
+        argparser = argparse.ArgumentParser(description="Assembler for the Caltech10 CPU.",
+                                            fromfile_prefix_chars="@")
+        argparser.add_argument("entry_files", nargs="*", metavar="entry_file")
+        argparser.add_argument("--single-pass", action="store_true",
+                               help="encode in one pass, backpatching forward references")
+        argparser.add_argument("--batch", action="store_true",
+                               help="assemble all given entry files on a process pool")
+        argparser.add_argument("--jobs", type=int, default=None,
+                               help="number of worker processes for --batch")
+        argparser.add_argument("--encode-jobs", type=int, default=1,
+                               help="number of processes encoding a large program's code")
+        argparser.add_argument("--relax", action="store_true",
+                               help="replace conditional jumps out of range by a jump over a JMP")
+        argparser.add_argument("--allow-overlap", action="store_true",
+                               help="allow .org to place code over code placed before")
+        argparser.add_argument("--no-cache", action="store_true",
+                               help="do not use the persistent cache")
+        argparser.add_argument("--cache-dir", default=defaultCacheDir(),
+                               help="directory for the persistent cache")
+        argparser.add_argument("--cache-size", type=float, default=100,
+                               help="size bound of the cache in MiB")
+        argparser.add_argument("-f", "--format", default="listing",
+                               help="output formats, comma separated: " + ", ".join(format_extensions))
+        argparser.add_argument("-o", "--output", default=None,
+                               help="output path, extensions are added for several formats")
+        argparser.add_argument("--endian", choices=("little", "big"), default="little",
+                               help="byte order of binary outputs")
+        argparser.add_argument("--all-errors", action="store_true",
+                               help="report all errors in one run instead of stopping at the first")
+        argparser.add_argument("--diagnostics-format", choices=("text", "json"), default="text",
+                               help="how to print errors")
+        argparser.add_argument("--stream", action="store_true",
+                               help="assemble stdin to a listing on stdout, as lines resolve")
+        argparser.add_argument("-I", "--include-path", action="append", default=[], metavar="DIR",
+                               help="directory to search for included files, may be repeated")
+        argparser.add_argument("--watch", action="store_true",
+                               help="reassemble whenever a source file changes")
+        argparser.add_argument("--analyze", action="store_true",
+                               help="report size and estimated cycles per routine")
+        argparser.add_argument("--memory-map", action="store_true",
+                               help="report the used and free ranges of code and data space")
+        argparser.add_argument("--stats", action="store_true",
+                               help="report per-phase timings, throughput and mnemonic counts")
+        argparser.add_argument("--profile", metavar="FILE", default=None,
+                               help="run under cProfile, writing the profile to FILE")
+        argparser.add_argument("--trace-memory", action="store_true",
+                               help="report peak memory and the top allocation sites")
+        self._args = argparser.parse_args()
+
+        self._formats = list(dict.fromkeys(self._args.format.split(",")))
+        for fmt in self._formats:
+            if fmt not in format_extensions:
+                argparser.error(f"unknown output format \"{fmt}\"")
+
+        if self._args.watch and (self._args.batch or self._args.stream):
+            argparser.error("--watch cannot be used with --batch or --stream")
+
+        if self._args.analyze and (self._args.batch or self._args.stream):
+            argparser.error("--analyze cannot be used with --batch or --stream")
+
+        if self._args.memory_map and (self._args.batch or self._args.stream):
+            argparser.error("--memory-map cannot be used with --batch or --stream")
+
+        if "object" in self._formats and "symbols" in self._formats:
+            argparser.error("symbols of modules are only known once linked, by shass_link.py")
+
+        if "object" in self._formats and self._args.single_pass:
+            argparser.error("relocatable modules are assembled in two passes, without --single-pass")
+
+        if self._args.relax and self._args.stream:
+            argparser.error("--relax cannot be used with --stream")
+
+        if self._args.encode_jobs < 1:
+            argparser.error("--encode-jobs needs at least 1 process")
+        if self._args.encode_jobs > 1 and (self._args.batch or self._args.stream or self._args.single_pass):
+            argparser.error("--encode-jobs cannot be used with --batch, --stream or --single-pass")
+
+        if self._args.batch:
+            if self._args.output is not None:
+                argparser.error("--output cannot be used with --batch")
+            if self._args.stats or self._args.profile or self._args.trace_memory:
+                argparser.error("--stats, --profile and --trace-memory cannot be used with --batch")
+            self._main_file = None
+            return
+
+        if self._args.stream:
+            if self._args.entry_files or self._args.format != "listing" or self._args.output is not None:
+                argparser.error("--stream reads stdin and writes a listing to stdout")
+            self._main_file = "<stdin>"
+            return
+
+        # If no entry file supplied, go to main.asm by default.
+        if len(self._args.entry_files) > 1:
+            argparser.error("only one entry file can be given without --batch")
+        self._main_file = self._args.entry_files[0] if self._args.entry_files else "main.asm"
+
         # check that it exists
         ErrorHandler.checkFileExists(self._main_file)
     
     def getEntryFile(self):
         return self._main_file
 
-class FileWriter:
-    """Class through which all file writes are done."""
-    def __init__(self):
-        # The object file output is always going to be "a.obj"
-        self.filewrite = open("a.obj", "w")
+    def getBatchEntries(self):
+        return expandEntries(self._args.entry_files)
 
-    def writeLine(self, str):
-        self.filewrite.write(str + "\n")
+    def singlePass(self):
+        return self._args.single_pass
 
-    def close(self):
-        # Add a trailing blank line to the file.
-        self.writeLine("")
-        self.filewrite.close()
+    def batch(self):
+        return self._args.batch
 
-# Start execution of the assembler
-entry_file = CommandLineInputParser().getEntryFile()
+    def stream(self):
+        return self._args.stream
+
+    def watch(self):
+        return self._args.watch
+
+    def jobs(self):
+        return self._args.jobs
+
+    def encodeJobs(self):
+        return self._args.encode_jobs
+
+    def relax(self):
+        return self._args.relax
+
+    def allowOverlap(self):
+        return self._args.allow_overlap
+
+    def analyze(self):
+        return self._args.analyze
+
+    def memoryMap(self):
+        return self._args.memory_map
+
+    def cacheDir(self):
+        """The cache directory, or None if the cache is disabled."""
+        return None if self._args.no_cache else self._args.cache_dir
+
+    def cacheSize(self):
+        return int(self._args.cache_size * 2**20)
+
+    def formats(self):
+        return self._formats
+
+    def outputPaths(self):
+        """Output path for each requested format."""
+        return outputPaths(self._args.output, self._formats)
+
+    def byteorder(self):
+        return self._args.endian
+
+    def recover(self):
+        return self._args.all_errors
+
+    def diagnosticsFormat(self):
+        return self._args.diagnostics_format
 
-parser = Parser(entry_file)
+    def includePaths(self):
+        return self._args.include_path
 
-parser.first_parse()
+    def includeGraph(self):
+        """A fresh IncludeGraph searching the include paths."""
+        return IncludeGraph(self._args.include_path)
 
-f = FileWriter()
-parser.second_parse(f)
+    def stats(self):
+        """A fresh AssemblyStats if --stats was given, otherwise None."""
+        return AssemblyStats() if self._args.stats else None
+
+    def profileCapture(self):
+        return ProfileCapture(self._args.profile, self._args.trace_memory)
+
+def assembleBatch(cmdline):
+    """Assemble many entry files at once, and report on all of them."""
+
+    start = time.perf_counter()
+    results = runBatch(cmdline.getBatchEntries(), cmdline.jobs(), cmdline.singlePass(),
+                       cmdline.cacheDir(), cmdline.cacheSize(), cmdline.formats(),
+                       cmdline.byteorder(), cmdline.recover(), cmdline.includePaths(), cmdline.relax(),
+                       cmdline.allowOverlap())
+    printReport(results, time.perf_counter() - start)
+
+    # Let scripts know whether everything assembled.
+    if any(result.error is not None for result in results):
+        sys.exit(1)
+
+def assembleStream(cmdline):
+    """Assemble stdin to a listing on stdout, line by line."""
+
+    stats = cmdline.stats()
+    parser = Parser(cmdline.getEntryFile(), recover=cmdline.recover(), stats=stats,
+                    includes=cmdline.includeGraph(), overlap=cmdline.allowOverlap())
+    writer = StreamWriter(sys.stdout)
+
+    try:
+        parser.stream_parse(sys.stdin, writer)
+    except AssemblerError as error:
+        # stdout carries the listing, so errors go to stderr
+        sys.stdout.flush()
+        if cmdline.recover() or cmdline.diagnosticsFormat() == "json":
+            ErrorHandler.printDiagnostics(error.diagnostics, cmdline.diagnosticsFormat(), sys.stderr)
+        else:
+            ErrorHandler.printError(error, sys.stderr)
+        sys.exit(1)
+
+    writer.close()
+
+    if stats is not None:
+        stats.finish()
+        print(stats.format(), file=sys.stderr)
+
+def _build(cmdline, cache, includes, stats, memo=None):
+    """Assemble the entry file into a.obj, or the requested outputs.
+    Reports errors and returns whether it succeeded."""
+
+    parser = Parser(cmdline.getEntryFile(), cache=cache, recover=cmdline.recover(), stats=stats,
+                    includes=includes, memo=memo, jobs=cmdline.encodeJobs(),
+                    relocatable="object" in cmdline.formats(), relax=cmdline.relax(),
+                    overlap=cmdline.allowOverlap())
+
+    try:
+        if cmdline.singlePass():
+            parser.single_parse()
+        else:
+            parser.first_parse()
+            parser.second_parse()
+    except AssemblerError as error:
+        # Report the error(s), and stop.
+        if cmdline.recover() or cmdline.diagnosticsFormat() == "json":
+            ErrorHandler.printDiagnostics(error.diagnostics, cmdline.diagnosticsFormat())
+        else:
+            ErrorHandler.printError(error)
+        return False
+
+    # Each output is written in one go, and only once assembly succeeded.
+    # The image is only needed by the binary formats.
+    paths = cmdline.outputPaths()
+    words = parser.codeImage() if "bin" in paths or "ihex" in paths else None
+    ranges = parser.codeRanges() if "ihex" in paths else None
+    module = parser.objectModule() if "object" in paths else None
+    symbols = parser.symbolMap() if "symbols" in paths else None
+    try:
+        writeOutputs(paths, parser.listing(), words, ranges, cmdline.byteorder(), stats, module, symbols)
+    except OSError as error:
+        print(f"Cannot write output \"{error.filename}\": {error.strerror}.")
+        return False
+
+    # the statistics are of assembling, not of the reports below
+    if stats is not None:
+        stats.finish()
+
+    if cmdline.diagnosticsFormat() == "json":
+        ErrorHandler.printDiagnostics(parser.getDiagnostics(), "json")
+    else:
+        print("Assembler finished successfully!")
+
+    if cmdline.analyze():
+        print(formatReport(analyzeRoutines(parser.codeImage(), parser.getCodeSymbols(), parser.codeRanges())))
+
+    if cmdline.memoryMap():
+        print(parser.memoryMap().format())
+
+    if stats is not None:
+        print(stats.format())
+    return True
+
+def assembleSingle(cmdline):
+    """Assemble the entry file once."""
+
+    cache = None
+    if cmdline.cacheDir() is not None:
+        cache = SourceCache(cmdline.cacheDir(), cmdline.cacheSize())
+
+    try:
+        succeeded = _build(cmdline, cache, cmdline.includeGraph(), cmdline.stats())
+    finally:
+        # Keep whatever was cached, even for sources with errors.
+        if cache is not None:
+            cache.close()
+
+    if not succeeded:
+        sys.exit(1)
+
+def assembleWatch(cmdline):
+    """Assemble the entry file, then again whenever one of its files changes."""
+
+    # The tokens, first pass results and code of every file stay in memory
+    # between builds. The cache is only written back on exit, and with
+    # --no-cache it is never read from or written to disk at all.
+    cache = SourceCache(cmdline.cacheDir(), cmdline.cacheSize(), persistent=cmdline.cacheDir() is not None)
+    includes = cmdline.includeGraph()
+    memo = ParseMemo()
+    watcher = makeWatcher()
+
+    try:
+        while True:
+            start = time.perf_counter()
+            _build(cmdline, cache, includes, cmdline.stats(), memo)
+            files = includes.files()
+            print(f"Built in {(time.perf_counter() - start) * 1000:.1f} ms, "
+                  f"watching {len(files)} files.", flush=True)
+
+            # forget the code of older versions of the files
+            cache.retain(source.key for source in files)
+
+            watcher.watch(source.path for source in files)
+            for path in watcher.wait():
+                includes.forget(path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        cache.close()
+
+# Start execution of the assembler
+if __name__ == "__main__":
+    cmdline = CommandLineInputParser()
 
-f.close()
+    if cmdline.batch():
+        assembleBatch(cmdline)
+    else:
+        with cmdline.profileCapture() as capture:
+            if cmdline.stream():
+                assembleStream(cmdline)
+            elif cmdline.watch():
+                assembleWatch(cmdline)
+            else:
+                assembleSingle(cmdline)
 
-print("Assembler finished successfully!")
\ No newline at end of file
+        # stdout carries the listing when streaming
+        report = capture.format()
+        if report:
+            print(report, file=sys.stderr if cmdline.stream() else sys.stdout)
\ No newline at end of file
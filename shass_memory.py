@@ -0,0 +1,115 @@
+"""\
+Occupancy of the code and data address spaces, and memory maps.
+
+An Occupancy keeps a bit per address of a space: 8192 bits (1 KiB) for
+the code space and 256 for the data space, so telling whether a word is
+taken already is a single test. The parser fills one of each once the
+code is placed, reporting code placed by .org over code placed before
+(such as that of another included file), and code or variables past the
+end of their space.
+
+Their used and free ranges make up the memory map:
+
+    ./shass_main.py prog.asm --memory-map
+
+    Code: 26 of 8192 words used, 8166 free
+      $0000-$0019  used     26
+      $001A-$1FFF  free   8166
+    Data: 2 of 256 bytes used, 254 free
+      $0000-$0001  used      2
+      $0002-$00FF  free    254
+"""
+
+# size of the code and data address spaces
+CODE_SIZE = 8192
+DATA_SIZE = 256
+
+class Occupancy:
+    """The addresses of an address space that are taken, a bit each."""
+
+    __slots__ = ("size", "_bits")
+
+    def __init__(self, size):
+        self.size = size
+        self._bits = bytearray((size + 7) // 8)
+
+    def take(self, address):
+        """Mark an address of the space taken, returning whether it was
+        already."""
+
+        index = address >> 3
+        mask = 1 << (address & 7)
+        bits = self._bits[index]
+        self._bits[index] = bits | mask
+        return bits & mask != 0
+
+    def takeAll(self, addresses, overlap=False):
+        """Mark a sequence of addresses taken, returning the positions in it
+        of the addresses past the end of the space and, without overlap, of
+        those taken already (or earlier in the sequence)."""
+
+        # however long the sequence, there are only so many addresses, so
+        # when none clashes only the distinct ones are marked
+        distinct = set(addresses)
+        if max(distinct, default=0) < self.size and (overlap or (
+                len(distinct) == len(addresses) and not any(self.isTaken(address) for address in distinct))):
+            for address in distinct:
+                self.take(address)
+            return []
+
+        bits = self._bits
+        size = self.size
+        clashes = []
+        for position, address in enumerate(addresses):
+            if address >= size:
+                clashes.append(position)
+                continue
+            index = address >> 3
+            mask = 1 << (address & 7)
+            if not bits[index] & mask:
+                bits[index] |= mask
+            elif not overlap:
+                clashes.append(position)
+        return clashes
+
+    def isTaken(self, address):
+        return self._bits[address >> 3] & (1 << (address & 7)) != 0
+
+    def used(self):
+        """Number of addresses taken."""
+        return int.from_bytes(self._bits, "little").bit_count()
+
+    def ranges(self):
+        """(start, end, taken) of the runs of taken and free addresses,
+        covering the whole space in address order."""
+
+        ranges = []
+        start = 0
+        taken = self.isTaken(0)
+        for address in range(1, self.size):
+            if self.isTaken(address) != taken:
+                ranges.append((start, address, taken))
+                start = address
+                taken = not taken
+        ranges.append((start, self.size, taken))
+        return ranges
+
+class MemoryMap:
+    """The occupancy of the code and data spaces of a program."""
+
+    def __init__(self, code, data):
+        # Occupancy of the code words and of the data bytes
+        self.code = code
+        self.data = data
+
+    def format(self):
+        """The text of the memory map."""
+
+        lines = []
+        for name, unit, occupancy in (("Code", "words", self.code), ("Data", "bytes", self.data)):
+            used = occupancy.used()
+            lines.append(f"{name}: {used} of {occupancy.size} {unit} used, {occupancy.size - used} free")
+            for start, end, taken in occupancy.ranges():
+                lines.append("  ${:04X}-${:04X}  {:<4} {:>6}".format(start, end - 1, "used" if taken else "free",
+                                                                    end - start))
+        return "\n".join(lines)
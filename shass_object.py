@@ -0,0 +1,207 @@
+"""\
+Relocatable object modules, written with -f object and linked by
+shass_link.py:
+
+    ./shass_main.py main.asm -f object      # main.o
+    ./shass_main.py lib.asm -f object       # lib.o
+    ./shass_link.py main.o lib.o -o prog.obj
+
+A module is one entry file (with its includes) assembled on its own. Its
+code up to the first .org is relocatable, placed by the linker, and the
+code after every .org stays at that address. Its variables are relocatable
+too. Symbols other modules may use are exported with .global, and symbols
+of other modules are imported with .extern:
+
+    .global Main Buffer
+    .extern Print
+
+Both pseudo-ops do nothing when a program is assembled as a whole, so the
+same sources can also be included into a single entry file.
+
+Every operand whose value depends on where a section or an imported symbol
+ends up gets a relocation: the field (the 13-bit address of JMP and CALL,
+or the 8-bit operand of all others), the target (the module's relocatable
+code or data section, or an imported name), and the addend. Such operands
+must be the target plus or minus a constant; differences of symbols of the
+same section need no relocation. Jumps within the relocatable code keep
+their relative offsets, while relative operands in it referencing code at a
+fixed address get a relocation with the target ".abs". The linker computes the fields with the same rules
+as the assembler, so a relocated 8-bit operand referencing code becomes a
+relative offset, and one referencing data an address.
+
+The object file is JSON, of the form:
+
+    {"format": "shass-object", "version": 1, "name": "main.asm",
+     "sources": [[path, content key], ...],
+     "sections": [{"origin": null, "words": [...], "source": [...],
+                   "labels": [[offset, name], ...]}, ...],
+     "data_size": 4,
+     "symbols": {name: [kind, section, offset, global], ...},
+     "externs": [name, ...],
+     "relocations": [[section, offset, field, target, addend, weight,
+                      file, line], ...]}
+
+A section with a null origin is relocatable. Symbols have kind "code" or
+"data", and section -1 for data. A relocation's weight is the weight (see
+shass_expr) of the operand besides its target, file and line are where the
+operand is, for errors while linking.
+"""
+
+import json
+
+from shass_instruction import *
+from shass_error import *
+
+OBJECT_FORMAT = "shass-object"
+OBJECT_VERSION = 1
+
+# relocation fields: the 13-bit address of JMP/CALL, and 8-bit operands
+FIELD_ABSOLUTE = "abs13"
+FIELD_OPERAND = "op8"
+
+# targets of relocations besides imported names
+TARGET_CODE = ".code"
+TARGET_DATA = ".data"
+
+# target of relative operands in relocatable code referencing a fixed address
+TARGET_ABSOLUTE = ".abs"
+
+# how far sections are moved to see how an operand depends on them: not a
+# multiple of 256, so HIGH() and LOW() of a target do not look constant
+_SHIFT = 4099
+
+class ObjectModule:
+    """A relocatable module, as written to and read from an object file."""
+
+    def __init__(self, name, sources, sections, data_size, symbols, externs, relocations):
+        # the entry file the module was assembled from
+        self.name = name
+
+        # (path, content key) of every file read, to tell if it is current
+        self.sources = sources
+
+        # dicts with origin (None if relocatable), words, source lines of
+        #   the words and (offset, name) labels
+        self.sections = sections
+
+        # number of data addresses its variables take
+        self.data_size = data_size
+
+        # name -> (kind, section index or -1 for data, offset, exported)
+        self.symbols = symbols
+
+        # imported names
+        self.externs = externs
+
+        # (section, offset, field, target, addend, weight, file, line)
+        self.relocations = relocations
+
+    def toDict(self):
+        return {"format": OBJECT_FORMAT, "version": OBJECT_VERSION, "name": self.name,
+                "sources": [list(source) for source in self.sources],
+                "sections": self.sections, "data_size": self.data_size,
+                "symbols": {name: list(symbol) for name, symbol in self.symbols.items()},
+                "externs": list(self.externs),
+                "relocations": [list(relocation) for relocation in self.relocations]}
+
+    def format(self):
+        """The text of the object file."""
+        return json.dumps(self.toDict(), separators=(",", ":")) + "\n"
+
+    def fromDict(data):
+        if data.get("format") != OBJECT_FORMAT or data.get("version") != OBJECT_VERSION:
+            raise Exception("Not a shass-asm object file of version " + str(OBJECT_VERSION) + ".")
+        return ObjectModule(data["name"], [tuple(source) for source in data["sources"]], data["sections"],
+                            data["data_size"],
+                            {name: tuple(symbol) for name, symbol in data["symbols"].items()},
+                            data["externs"], [tuple(relocation) for relocation in data["relocations"]])
+
+    def read(path):
+        """Read an object file."""
+
+        with open(path, "r") as f:
+            try:
+                data = json.load(f)
+            except ValueError:
+                raise Exception(f"\"{path}\" is not an object file.")
+        return ObjectModule.fromDict(data)
+
+def relocateOperand(tokens, address, relocatable_ip, code_symbols, data_symbols, constants, target_of):
+    """The relocation of the value operand of a code line in a module, as
+    (field, target, addend, weight), or None if it needs none.
+
+    target_of(name) is the target a symbol moves with, or None if it stays
+    where it is. relocatable_ip tells whether the line itself is in the
+    relocatable code. Raises OperandError for operands that cannot be
+    relocated."""
+
+    if len(tokens) < 2:
+        return None
+
+    index = len(tokens) - 2
+    try:
+        expression = compileExpression(tokens[-1])
+    except OperandError:
+        # reported by encoding
+        return None
+
+    targets = {}
+    for name in expression.names:
+        target = target_of(name)
+        if target is not None:
+            targets[name] = target
+    absolute = tokens[0] in Opcode.long_operand_codes
+    uses_ip = relocatable_ip and ".IP" in tokens[-1]
+
+    # relative operands of lines that move change with them
+    relative = relocatable_ip and not absolute
+    if not targets and not uses_ip and not relative:
+        return None
+
+    def evaluate(shifted=None):
+        # the value with one target moved, imported names taken as data
+        code = {}
+        data = {}
+        for name in expression.names:
+            shift = _SHIFT if shifted is not None and targets.get(name) == shifted else 0
+            if name in code_symbols:
+                code[name] = code_symbols[name] + shift
+            elif name in data_symbols:
+                data[name] = data_symbols[name] + shift
+            elif name in targets:
+                data[name] = shift
+        ip = address + (_SHIFT if shifted == TARGET_CODE and relocatable_ip else 0)
+        return expression.evaluate(code, data, constants, ip)
+
+    try:
+        value, weight = evaluate()
+        moving = []
+        for target in set(targets.values()) | ({TARGET_CODE} if uses_ip else set()):
+            moved = evaluate(target)[0] - value
+            if moved == _SHIFT:
+                moving.append(target)
+            elif moved != 0:
+                raise OperandError("Operand cannot be relocated.", index)
+    except OperandError as error:
+        error.index = index
+        raise
+
+    # e.g. the difference of two labels of the relocatable code
+    if not moving:
+        # but an offset to a fixed address from code that moves
+        if relative and weight == 1:
+            return (FIELD_OPERAND, TARGET_ABSOLUTE, value, weight)
+        return None
+    if len(moving) > 1:
+        raise OperandError("Operand cannot be relocated.", index)
+    target = moving[0]
+
+    if target == TARGET_CODE:
+        # the weight of the label, the linker adds it back
+        weight -= 1
+
+        # relative jumps within the relocatable code move along with it
+        if not absolute and relocatable_ip and weight == 0:
+            return None
+
+    return (FIELD_ABSOLUTE if absolute else FIELD_OPERAND, target, value, weight)
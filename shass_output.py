@@ -0,0 +1,270 @@
+"""\
+Output formats of the assembler, and the atomic writing of output files.
+
+Formats:
+    listing     the human readable a.obj listing
+    bin         raw image of 16-bit code words from address 0, little or big
+                endian, with unused addresses zero - can be memory-mapped
+    ihex        Intel HEX, with each word at byte address 2 * code address
+    object      relocatable module for shass_link.py (see shass_object)
+
+The read functions turn each format back into code words, for the simulator
+and the disassembler.
+"""
+
+import os
+import re
+import stat
+import sys
+import tempfile
+import time
+from array import array
+
+# file extension used for each output format
+format_extensions = {
+    "listing": ".obj",
+    "bin": ".bin",
+    "ihex": ".hex",
+    "object": ".o",
+    "symbols": ".sym",
+}
+
+def _outputMode(path):
+    """The mode to give an output file: that of the file it replaces, or
+    what the umask leaves of 0666 for a new one, as open() would."""
+
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+def writeAtomic(path, data):
+    """Write data (str or bytes) to path in a single write, through a temporary
+    file renamed over the target, so readers never see a partial file."""
+
+    if isinstance(data, str):
+        data = data.encode()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".shass-", suffix=".tmp")
+    except OSError as error:
+        # report the actual output path, not the temporary one
+        raise OSError(error.errno, error.strerror, path)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+            # temporary files are only readable by their owner
+            os.fchmod(f.fileno(), _outputMode(path))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def listingCodeLine(address, word, raw):
+    """The listing line of a code word and its source text."""
+    return "{:04X}  {:04X};     ".format(address, word) + raw
+
+def listingLabelLine(name):
+    """The listing line of a label, for user-readable object code."""
+    return "          ; " + name
+
+def formatListing(lines):
+    """The listing as written to a.obj, with its trailing blank line."""
+
+    lines = list(lines)
+    return "\n".join(lines) + "\n\n" if lines else "\n"
+
+def formatBinary(words, byteorder="little"):
+    """Pack 16-bit words as bytes in the given byte order."""
+
+    words = array("H", words)
+    if (byteorder == "big") != (sys.byteorder == "big"):
+        words.byteswap()
+    return words.tobytes()
+
+def _hexRecord(address, record_type, data):
+    """A single Intel HEX record, with its checksum."""
+
+    record = bytes([len(data), (address >> 8) & 0xFF, address & 0xFF, record_type]) + data
+    checksum = (-sum(record)) & 0xFF
+    return ":" + record.hex().upper() + "{:02X}".format(checksum) + "\n"
+
+def formatIntelHex(words, ranges, byteorder="little"):
+    """Intel HEX for the used (start, end) word address ranges of the image."""
+
+    data = formatBinary(words, byteorder)
+    records = []
+    upper = 0
+
+    for start, end in ranges:
+        byte_address = 2 * start
+        while byte_address < 2 * end:
+            # a record never crosses a 64 KiB boundary
+            if byte_address >> 16 != upper:
+                upper = byte_address >> 16
+                records.append(_hexRecord(0, 0x04, upper.to_bytes(2, "big")))
+
+            count = min(16, 2 * end - byte_address, 0x10000 - (byte_address & 0xFFFF))
+            records.append(_hexRecord(byte_address & 0xFFFF, 0x00, data[byte_address:byte_address + count]))
+            byte_address += count
+
+    records.append(_hexRecord(0, 0x01, b""))
+    return "".join(records)
+
+def readListing(text):
+    """Code words and labels of a listing. Returns an address -> word dict
+    and a label -> address dict."""
+
+    words = {}
+    labels = []
+    code_symbols = {}
+    for match in re.finditer(r"^(?:([0-9A-Fa-f]{4})  ([0-9A-Fa-f]{4});|          ; (\S+))", text, re.MULTILINE):
+        if match.group(3) is not None:
+            labels.append(match.group(3))
+            continue
+
+        address = int(match.group(1), 16)
+        words[address] = int(match.group(2), 16)
+        # labels are listed right above the line they belong to
+        for label in labels:
+            code_symbols[label] = address
+        labels = []
+
+    return words, code_symbols
+
+def readBinary(data, byteorder="little"):
+    """Code words of a raw binary image, as an array."""
+
+    words = array("H")
+    words.frombytes(bytes(data[:len(data) & ~1]))
+    if (byteorder == "big") != (sys.byteorder == "big"):
+        words.byteswap()
+    return words
+
+def readIntelHex(text, byteorder="little"):
+    """Code words of Intel HEX text, as an address -> word dict."""
+
+    data = {}
+    upper = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line.startswith(":"):
+            continue
+
+        record = bytes.fromhex(line[1:])
+        count, record_type = record[0], record[3]
+        address = (upper << 16) | (record[1] << 8) | record[2]
+        if record_type == 0x00:
+            for i, byte in enumerate(record[4:4 + count]):
+                data[address + i] = byte
+        elif record_type == 0x04:
+            upper = (record[4] << 8) | record[5]
+        elif record_type == 0x01:
+            break
+
+    words = {}
+    shift = 8 if byteorder == "little" else 0
+    for byte_address in sorted(data):
+        words.setdefault(byte_address >> 1, 0)
+        words[byte_address >> 1] |= data[byte_address] << (shift if byte_address & 1 else 8 - shift)
+    return words
+
+def readImage(path, byteorder="little"):
+    """Code words and labels of an output file, by its extension: .bin and
+    .hex images, anything else is read as a listing. Returns an address ->
+    word mapping (an array for binary images) and the labels found."""
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".bin":
+        with open(path, "rb") as f:
+            return readBinary(f.read(), byteorder), {}
+
+    with open(path, "r") as f:
+        text = f.read()
+    if extension == ".hex":
+        return readIntelHex(text, byteorder), {}
+    return readListing(text)
+
+def outputPaths(output, formats, default_stem="a"):
+    """Map each format to its output path. A single format is written to the
+    given output path as is, several formats get their extensions added."""
+
+    if output is not None and len(formats) == 1:
+        return {formats[0]: output}
+
+    stem = default_stem if output is None else os.path.splitext(output)[0]
+    return {fmt: stem + format_extensions[fmt] for fmt in formats}
+
+def writeOutputs(paths, lines, words, ranges, byteorder="little", stats=None, module=None, symbols=None):
+    """Write every requested output format. stats is an optional
+    shass_stats.AssemblyStats to record the time and sizes in. module is
+    the shass_object.ObjectModule of the object format, and symbols the
+    shass_symbols.SymbolMap of the symbols format."""
+
+    start = time.perf_counter()
+
+    for fmt, path in paths.items():
+        if fmt == "listing":
+            f = FileWriter(path, stats)
+            f.writeLines(lines)
+            f.close()
+            continue
+
+        if fmt == "bin":
+            data = formatBinary(words, byteorder)
+        elif fmt == "ihex":
+            data = formatIntelHex(words, ranges, byteorder).encode()
+        elif fmt == "object":
+            data = module.format().encode()
+        elif fmt == "symbols":
+            data = symbols.format().encode()
+        else:
+            raise Exception(f"Output format \"{fmt}\" does not exist.")
+        writeAtomic(path, data)
+        if stats is not None:
+            stats.addOutput(fmt, len(data))
+
+    if stats is not None:
+        stats.addTime("output writing", time.perf_counter() - start)
+
+class StreamWriter:
+    """Listing writer passing lines straight on to an open stream, such as
+    stdout, for streamed assembly."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def writeLine(self, str):
+        self.stream.write(str + "\n")
+
+    def close(self):
+        # Same trailing blank line as a listing file.
+        self.stream.write("\n")
+        self.stream.flush()
+
+class FileWriter:
+    """Class through which listing writes are done.
+
+    Lines are collected, and written out in one go when closed."""
+    def __init__(self, path="a.obj", stats=None):
+        self.path = path
+        self.lines = []
+        # optional shass_stats.AssemblyStats, told the size written
+        self.stats = stats
+
+    def writeLine(self, str):
+        self.lines.append(str)
+
+    def writeLines(self, lines):
+        self.lines.extend(lines)
+
+    def close(self):
+        # Adds a trailing blank line to the file.
+        data = formatListing(self.lines).encode()
+        writeAtomic(self.path, data)
+        if self.stats is not None:
+            self.stats.addOutput("listing", len(data))
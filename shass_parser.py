@@ -1,20 +1,210 @@
+import sys
+import time
+from array import array
+
 from shass_instruction import *
 from shass_error import *
+from shass_include import *
+from shass_macro import *
+from shass_encode import *
+from shass_object import *
+from shass_symbols import *
+from shass_memory import *
+from shass_output import listingCodeLine, listingLabelLine
 
 """\
 This file contains the Parser class used for bulk of the parsing
 of the assembly files.
 """
 
+# an int object for every code address, so the lines at an address share it
+# rather than each keeping its own
+_code_addresses = tuple(range(CODE_SIZE))
+
+class SourceLine:
+    """A single tokenized source line, as recorded by the first pass.
+
+    The list of these forms the intermediate representation that the
+    second pass and the listing writer run off, so no file is read twice.
+    """
+
+    # kinds of lines
+    CODE = 0
+    LABEL = 1
+    VARIABLE = 2
+    PSEUDO = 3
+    # indented lines in a data segment
+    INVALID = 4
+
+    __slots__ = ("file", "line_num", "indent", "raw", "tokens", "kind", "code_segment", "address", "word")
+
+    def __init__(self, file, line_num, indent, raw, tokens, kind, code_segment, address):
+        # name of the source file (shared between all lines of a file)
+        self.file = file
+
+        # line number within the source file
+        self.line_num = line_num
+
+        # number of whitespace characters before the first token
+        self.indent = indent
+
+        # line text without comments and surrounding whitespace
+        self.raw = raw
+
+        # mnemonic/label followed by the operand tokens
+        self.tokens = tokens
+
+        # one of the kinds above
+        self.kind = kind
+
+        # whether the line was read in .cseg or .dseg
+        self.code_segment = code_segment
+
+        # code address for code and labels, data address for variables
+        self.address = address
+
+        # the encoded 16-bit word for code lines, None until encoded
+        self.word = None
+
+    def column(self, index=0):
+        """Return the 1-based column of a token, or the column just past the
+        end of the line if there is no such token (e.g. a missing operand)."""
+
+        if index >= len(self.tokens):
+            return self.indent + len(self.raw) + 1
+
+        pos = 0
+        for token in self.tokens[:index]:
+            pos = self.raw.find(token, pos) + len(token)
+        return self.indent + self.raw.find(self.tokens[index], pos) + 1
+
+class ParsedChunk:
+    """What the first pass got from a run of lines between includes."""
+
+    __slots__ = ("lines", "code_lines", "labels", "variables", "end_state", "listing", "listing_words")
+
+    def __init__(self, lines, code_lines, end_state):
+        # the IR of the run, and its code lines
+        self.lines = lines
+        self.code_lines = code_lines
+
+        # (name, address) of the labels and variables it defines
+        self.labels = []
+        self.variables = []
+        for srcline in lines:
+            if srcline.kind == SourceLine.LABEL:
+                self.labels.append((srcline.tokens[0], srcline.address))
+            elif srcline.kind == SourceLine.VARIABLE:
+                self.variables.append((srcline.tokens[0], srcline.address))
+
+        # code address, data address and segment after the run
+        self.end_state = end_state
+
+        # its listing lines, and the words they were made with
+        self.listing = None
+        self.listing_words = None
+
+class ParseMemo:
+    """Keeps what the first pass got from every run of lines between
+    includes, so the next build of the same program (see --watch) reuses
+    the runs of unchanged files that start at the same addresses."""
+
+    def __init__(self):
+        # entries of the previous build, and of the one running
+        self._previous = {}
+        self._current = {}
+
+    def begin(self):
+        """Start a build, keeping only what the last one used."""
+        self._previous, self._current = self._current, {}
+
+    def get(self, key):
+        value = self._current.get(key)
+        if value is None:
+            value = self._previous.get(key)
+            if value is not None:
+                self._current[key] = value
+        return value
+
+    def put(self, key, value):
+        self._current[key] = value
+
 class Parser:
-    def __init__(self, entry_file):
+    def __init__(self, entry_file, source_reader=None, cache=None, recover=False, stats=None, includes=None,
+                 memo=None, jobs=1, relocatable=False, relax=False, overlap=False):
+
+        # the main (entry) file name
+        self._entry_file = entry_file
+
+        # the IncludeGraph all files are read and tokenized through, which
+        #   may be shared with the parsers of other entry files. The one made
+        #   by default reads through source_reader, a callable returning the
+        #   text of a source file by name (None if it does not exist), or
+        #   from disk without one.
+        if includes is None:
+            includes = IncludeGraph(source_reader=source_reader, read_disk=source_reader is None)
+        self._includes = includes
+
+        # optional SourceCache for reusing tokenized files and encoded code
+        self._cache = cache
+
+        # for each file read with the cache: its cache key and code lines
+        self._file_units = []
+
+        # whether to carry on after errors, to report all of them in one run
+        self._recover = recover
+
+        # diagnostics reported so far, when recovering
+        self._diagnostics = []
+
+        # optional shass_stats.AssemblyStats collecting timings and counts
+        self._stats = stats
+
+        # source files in the order they were read: name -> where it was first
+        #   included, as the line numbers of the .include lines leading to it
+        #   from the entry file, so diagnostics sort in source order
+        self._file_order = {}
+
+        # (SourceFile, path) of the files being read, innermost last
+        self._include_stack = []
 
-        # the input file stream
-        self._file_read = open(entry_file, "r")
+        # whether to assemble a relocatable module, see shass_object
+        self._relocatable = relocatable
 
-        # the secondary file stream
-        #   from .include pseudo operations
-        self._file_read_secondary = 0
+        # whether to relax conditional jumps out of range, see _relaxJumps()
+        self._relax = relax
+
+        # number of jumps relaxed, and of passes over the IR it took
+        self._relaxation = (0, 0)
+
+        # whether code may be placed over code placed before, as by
+        #   generated programs starting over at .org 0
+        self._overlap = overlap
+
+        # which code words and data bytes are taken, see shass_memory
+        self._code_map = Occupancy(CODE_SIZE)
+        self._data_map = Occupancy(DATA_SIZE)
+
+        # when streaming: (past the end, address) of the last code line if
+        #   it clashed, so a run of such lines is reported once
+        self._clash = None
+
+        # when streaming: whether code or a variable did not fit its space or
+        #   overlapped code, after which no more lines are written out
+        self._stream_stopped = False
+
+        # optional ParseMemo of an earlier build of the same program, not
+        #   used for modules or when relaxing, which moves the lines; with a
+        #   cache, runs of lines missing from it are looked up there too
+        if memo is None and cache is not None:
+            memo = ParseMemo()
+        self._memo = None if relocatable or relax else memo
+
+        # (index into the IR, ParsedChunk) of the runs of lines from the memo
+        self._chunks = []
+
+        # number of processes the second pass encodes on, see shass_encode
+        self._jobs = jobs or 1
 
         # keeps track of the current location in code space
         self._code_address = 0
@@ -28,21 +218,111 @@ class Parser:
         # symbol table for keeping track of variables
         self._data_symbol_table = {}
 
+        # .equ constants: name -> (value, weight), see shass_expr
+        self._constant_table = {}
+
         # indicates whether parsing should be done as .cseg or .dseg
         self._code_segment = True
 
-        # indicates whether the second pass is being done
-        self._second_parse = False
+        # indicates whether code is encoded during the first (and only) pass
+        self._single_parse = False
+
+        # the intermediate representation: every non-empty source line, in order
+        self._lines = []
+
+        # fixup table of code lines with forward references (single pass only)
+        self._fixups = []
+
+        # where lines are written as they resolve, when streaming
+        self._stream_writer = None
+
+        # lines held back while streaming: undefined symbol -> code lines
+        self._pending = {}
+
+        # macros defined so far: name -> shass_macro.Macro
+        self._macros = {}
+
+        # the .macro or .rept block being read, None outside of one
+        self._block = None
+
+        # iterators of the records being read in the current file, the
+        #   file's own innermost first and the expansions in it after
+        self._expansions = []
+
+        # number of macro invocations expanded so far
+        self._macro_expansions = 0
+
+        # cache keys of files expanding macros of other files, whose code
+        #   is not cached as it changes with those files
+        self._uncached_keys = set()
+
+        # the pseudo-op line being handled
+        self._pseudo_line = None
 
-        # the output file stream, initially none for first pass
-        self._outputFileStream = None
+        # of modules: names imported with .extern
+        self._externs = set()
+
+        # of modules: names exported with .global -> the line exporting them
+        self._globals = {}
+
+        # of modules: index into the IR of the line after the first .org,
+        #   where the relocatable code ends, None before
+        self._origin_index = None
+
+        # of modules: labels defined after .org, which are not relocatable
+        self._absolute_labels = set()
+
+        # of modules: code line -> its relocation, see shass_object
+        self._relocations = {}
 
     def setCodeOrigin(self, num):
         """Called by .org pseudo-op"""
 
         if not self._code_segment:
             raise Exception("\".org\" cannot be set in a data segment!")
-        self._code_address = int(num)
+
+        address, _ = self._evaluateConstant(num)
+        if not (0 <= address < CODE_SIZE):
+            raise OperandError("Argument outside range.", 0)
+        self._code_address = address
+
+        # the relocatable code of a module ends here
+        if self._origin_index is None:
+            self._origin_index = len(self._lines)
+
+    def defineConstant(self, name, value):
+        """Called by .equ pseudo-op"""
+
+        if not name.isalnum() or name.isnumeric():
+            raise OperandError(f"\"{name}\" is not a valid constant name.", 0)
+        if (name in self._constant_table or name in self._code_symbol_table
+                or name in self._data_symbol_table):
+            raise OperandError(f"Symbol \"{name}\" already defined.", 0)
+
+        self._constant_table[name] = self._evaluateConstant(value, 1)
+
+    def _evaluateConstant(self, text, index=0):
+        """Evaluate the expression of a pseudo-op or variable argument into
+        (value, weight). It can only use symbols defined above it."""
+
+        try:
+            expression = compileExpression(text)
+            if expression.value is not None:
+                return expression.value, 0
+
+            # in a module, what is relocatable is only known once linked
+            if self._relocatable:
+                for name in expression.names:
+                    if self._targetOf(name) is not None:
+                        raise OperandError(f"\"{name}\" is relocatable, so it cannot be used here.", index)
+
+            return expression.evaluate(self._code_symbol_table, self._data_symbol_table,
+                                       self._constant_table, self._code_address)
+        except UndefinedSymbolError as error:
+            raise OperandError(f"\"{error.symbol}\" is not defined yet.", index)
+        except OperandError as error:
+            error.index = index
+            raise
 
     def setCodeSegment(self):
         """Called by .cseg pseudo-op"""
@@ -57,197 +337,1249 @@ class Parser:
     def includeFile(self, filename):
         """Called by .include pseudo-op"""
 
-        # Includes can only be used in the top-level asm file.
-        if self._file_read_secondary != 0:
-            raise Exception("Cannot include into included files.")
-        if filename == self._file_read.name:
-            raise Exception("Cannot open file that is already being read.")
-        
+        path = self._includes.resolve(filename, self._include_stack[-1][1])
+        if path is None:
+            raise Exception(f"File \"{filename}\" does not exist.")
+        source = self._includes.load(path, self._cache)
+
+        # A file including itself, directly or not, would never end.
+        sources = [s for s, _ in self._include_stack]
+        if source in sources:
+            chain = [p for _, p in self._include_stack[sources.index(source):]] + [path]
+            raise Exception("Include cycle: " + " -> ".join(chain) + ".")
+
         # by default, file starts at code segment
         # so need preserving the outer file segment type
         currentSeg = self._code_segment
         self.setCodeSegment()
 
-        # set the secondary file stream
-        self._file_read_secondary = open(filename, "r")
-
         # parse as secondary file
-        self._parse(secondary_file=True)
+        try:
+            if self._stats is None:
+                self._parse(path, source)
+            else:
+                with self._stats.timer("include handling"):
+                    self._parse(path, source)
+        finally:
+            # reset outer file segment type
+            self._code_segment = currentSeg
+
+    def exportSymbol(self, name, index=0):
+        """Called by .global pseudo-op"""
+
+        if self._relocatable:
+            self._globals.setdefault(name, self._pseudo_line)
+
+    def _isDefined(self, name):
+        """Whether a name is a label, variable, constant or external symbol."""
+
+        return (name in self._code_symbol_table or name in self._data_symbol_table
+                or name in self._constant_table or name in self._externs)
+
+    def importSymbol(self, name, index=0):
+        """Called by .extern pseudo-op"""
+
+        if not self._relocatable:
+            return
+        if not name.isalnum() or name.isnumeric():
+            raise OperandError(f"\"{name}\" is not a valid symbol name.", index)
+        if (name in self._code_symbol_table or name in self._data_symbol_table
+                or name in self._constant_table):
+            raise OperandError(f"Symbol \"{name}\" already defined.", index)
+        self._externs.add(name)
+
+    def _targetOf(self, name):
+        """What a symbol of a module moves with when linked: TARGET_CODE,
+        TARGET_DATA, its name if imported, or None if it stays in place."""
+
+        if name in self._code_symbol_table:
+            return None if name in self._absolute_labels else TARGET_CODE
+        if name in self._data_symbol_table:
+            return TARGET_DATA
+        if name in self._externs:
+            return name
+        return None
+
+    def beginMacro(self, name, params):
+        """Called by .macro pseudo-op"""
+
+        # the body is read (and skipped) even if the header is invalid
+        self._block = Block(".macro", None, self._pseudo_line)
+
+        if not name:
+            raise OperandError("Pseudo op \".macro\" needs a name.", 0)
+        if not name.isalnum() or name.isnumeric():
+            raise OperandError(f"\"{name}\" is not a valid macro name.", 0)
+        if name in Opcode.encoders:
+            raise OperandError(f"\"{name}\" is an instruction.", 0)
+        if name in self._macros:
+            raise OperandError(f"Macro \"{name}\" already defined.", 0)
+        for index, param in enumerate(params):
+            if not param.isalnum() or param.isnumeric() or param in params[:index]:
+                raise OperandError(f"\"{param}\" is not a valid parameter name.", 1 + index)
+
+        self._block.args = (name, params)
+
+    def endMacro(self):
+        """Called by .endm pseudo-op"""
+
+        block = self._endBlock(".macro", ".endm")
+        if block.args is not None:
+            name, params = block.args
+            source = self._include_stack[-1][0]
+            self._macros[name] = Macro(name, params, block.body, source and source.key)
+
+    def beginRepeat(self, count):
+        """Called by .rept pseudo-op"""
+
+        self._block = Block(".rept", None, self._pseudo_line)
+
+        if not count:
+            raise OperandError("Pseudo op \".rept\" needs an argument.", 0)
+        count, _ = self._evaluateConstant(count)
+        if count < 0:
+            raise OperandError("Argument outside range.", 0)
+        if count > MAX_REPEAT_COUNT:
+            raise OperandError(f"Cannot repeat more than {MAX_REPEAT_COUNT} times.", 0)
+
+        self._block.args = (count,)
+
+    def endRepeat(self):
+        """Called by .endr pseudo-op"""
+
+        block = self._endBlock(".rept", ".endr")
+        if block.args is not None and block.body:
+            self._expand(self._repeatRecords(block.body, block.args[0]))
+
+    def _repeatRecords(self, body, count):
+        """Generate the records of a body count times over, stopping once
+        its code runs past the end of the code space, after which every
+        repetition would only be another line that does not fit."""
+
+        for _ in range(count):
+            if self._code_address > CODE_SIZE:
+                break
+            yield from body
 
-        # after parsing is done, close the filestream
-        self._file_read_secondary.close()
+    def _endBlock(self, op, end):
+        """Close the block being read, which must have been opened by op."""
 
-        # and indicate that no secondary parsing is being done
-        self._file_read_secondary = 0
+        block = self._block
+        if block is None or block.op != op:
+            raise Exception(f"\"{end}\" without \"{op}\".")
+        self._block = None
+        return block
 
-        # reset outer file segment type
-        self._code_segment = currentSeg
+    def _expand(self, records):
+        """Read the records of an expansion before going on with the lines
+        after the one being handled."""
 
-    def _parsePseudoOp(self, split_line, line_num, fin):
+        if len(self._expansions) > MAX_NESTING:
+            raise Exception("Expansions nested too deeply (a macro invoking itself?).")
+        self._expansions.append(records)
+
+    def _invokeMacro(self, filename, record):
+        """Expand the macro an indented line invokes."""
+
+        line_num, indent, raw, tokens = record
+        macro = self._macros[tokens[0]]
+        args = tokens[1:]
+
+        try:
+            if len(args) != len(macro.params):
+                plural = "" if len(macro.params) == 1 else "s"
+                raise Exception(f"Macro \"{macro.name}\" takes {len(macro.params)} argument{plural}, "
+                                f"{len(args)} given.")
+            self._expand(macro.expand(args, line_num))
+        except Exception as error:
+            self._exceptionError(SourceLine(filename, line_num, indent, raw, tokens, SourceLine.CODE,
+                                            self._code_segment, None), error)
+            return
+
+        self._macro_expansions += 1
+        source = self._include_stack[-1][0]
+        if source is not None and macro.key != source.key:
+            self._uncached_keys.add(source.key)
+
+    def _expandRecords(self, filename, records):
+        """Generate the records of a file, with .macro and .rept blocks read
+        rather than handled, and expansions in their place."""
+
+        outer = self._expansions
+        stack = self._expansions = [iter(records)]
+        try:
+            while stack:
+                depth = len(stack)
+                for record in stack[-1]:
+                    if self._block is not None:
+                        if self._block.add(record):
+                            continue
+                    elif record[1] and record[3][0] in self._macros:
+                        self._invokeMacro(filename, record)
+                        if len(stack) != depth:
+                            break
+                        continue
+
+                    yield record
+
+                    # handling the record may have started an expansion
+                    if len(stack) != depth:
+                        break
+                else:
+                    stack.pop()
+
+            # a block is never left open at the end of a file
+            if self._block is not None:
+                block, self._block = self._block, None
+                end = ".endm" if block.op == ".macro" else ".endr"
+                self._error(block.srcline, f"\"{block.op}\" without \"{end}\".")
+        finally:
+            self._expansions = outer
+
+    def _error(self, srcline, message, index=0):
+        """Report an error at the token with the given index of a line.
+
+        Stops assembly, unless recovering, in which case the error is
+        recorded and parsing carries on with the next line."""
+
+        if not self._recover:
+            ErrorHandler.genericError(srcline.file, srcline.line_num, message, srcline.column(index))
+        self._diagnostics.append(Diagnostic(srcline.file, srcline.line_num, message,
+                                            column=srcline.column(index)))
+
+    def _exceptionError(self, srcline, error):
+        """Report an exception raised while handling a line."""
+
+        # errors in an operand point at that operand, others at the mnemonic
+        index = 1 + error.index if isinstance(error, OperandError) else 0
+        self._error(srcline, error, index)
+
+    def _checkDiagnostics(self):
+        """Stop assembly if any errors were recorded while recovering."""
+
+        # Report in source order, rather than the order the passes found them:
+        # an included file's lines go where it was included.
+        self._diagnostics.sort(key=lambda d: self._file_order.get(d.file, (-1,)) + (d.line_num,))
+
+        errors = [d for d in self._diagnostics if d.severity == "error"]
+        if errors:
+            raise AssemblerError(errors[0], self._diagnostics)
+
+    def getDiagnostics(self):
+        """Return the diagnostics reported so far."""
+        return self._diagnostics
+
+    def _parsePseudoOp(self, srcline):
         """Parses a pseudo-op type statement."""
 
-        # Depending on how many arguments given, call with one or none args
+        split_line = srcline.tokens
+
+        # Call with as many args as given
+        self._pseudo_line = srcline
         try:
-            if len(split_line) > 1:
-                PseudoOp.handlePseudoOp(self, split_line[0], split_line[1])
-            else:
-                PseudoOp.handlePseudoOp(self, split_line[0])
+            PseudoOp.handlePseudoOp(self, *split_line)
+        except AssemblerError:
+            # already reported against a line of an included file
+            raise
         except Exception as error:
-            ErrorHandler.genericError(fin.name, line_num, error)
+            self._exceptionError(srcline, error)
+
+    def _encodeLine(self, srcline, strarr=None):
+        """Encode a single code line (or other tokens at its address) into
+        its 16-bit word."""
+
+        if strarr is None:
+            strarr = srcline.tokens
+
+        # get operands from Operands class
+        operands = Operands(strarr[1:], self._data_symbol_table, self._code_symbol_table, srcline.address,
+                            self._constant_table)
+        # get the actual instruction word from Opcode
+        if self._stats is None:
+            return Opcode.encode(strarr[0], operands)
+
+        start = time.perf_counter()
+        try:
+            return Opcode.encode(strarr[0], operands)
+        finally:
+            self._stats.addTime("encoding", time.perf_counter() - start)
 
-    def _codeGen(self, strarr, line_num, fin, rawline):
-        """Perform actual line writes to the output object file"""
+    def _codeGen(self, srcline):
+        """Generate the code for a line, once all symbols are known."""
         try:
-            # get operands from Operands class
-            operands = Operands(strarr[1:], self._data_symbol_table, self._code_symbol_table, self._code_address)
-            # get the actual hex code output from Opcode, and concat with current code address
-            code_out = "{:04X}  ".format(self._code_address) + str(Opcode.opcodeFactory(strarr[0], operands))
-            # Finally, write to file
-            self._outputFileStream.writeLine(code_out + ";     " + rawline.strip())
+            srcline.word = self._encodeLine(srcline)
         except Exception as error:
-            ErrorHandler.genericError(fin.name, line_num, error)
+            self._exceptionError(srcline, error)
+
+    def _codeGenParallel(self, srclines):
+        """Generate the code for lines on a process pool, once all symbols
+        are known. Same words and errors as _codeGen() on each line."""
+
+        start = time.perf_counter()
+        words, errors = encodeParallel([(srcline.tokens, srcline.address) for srcline in srclines],
+                                       self._code_symbol_table, self._data_symbol_table,
+                                       self._constant_table, self._jobs)
+        if self._stats is not None:
+            self._stats.addTime("encoding", time.perf_counter() - start)
+
+        for srcline, word in zip(srclines, words):
+            srcline.word = word
+        for position, error in errors:
+            srclines[position].word = None
+            self._exceptionError(srclines[position], error)
+
+    def _codeGenModule(self):
+        """Generate the code of a module, with relocations for the operands
+        only known once linked."""
+
+        origin = len(self._lines) if self._origin_index is None else self._origin_index
+        for index, srcline in enumerate(self._lines):
+            if srcline.kind != SourceLine.CODE:
+                continue
+            try:
+                relocation = relocateOperand(srcline.tokens, srcline.address, index < origin,
+                                             self._code_symbol_table, self._data_symbol_table,
+                                             self._constant_table, self._targetOf)
+                if relocation is None:
+                    srcline.word = self._encodeLine(srcline)
+                else:
+                    # the linker fills in the operand
+                    srcline.word = self._encodeLine(srcline, srcline.tokens[:-1] + ("0",))
+                    self._relocations[srcline] = relocation
+            except Exception as error:
+                self._exceptionError(srcline, error)
+
+        for name, srcline in self._globals.items():
+            if name not in self._code_symbol_table and name not in self._data_symbol_table:
+                self._error(srcline, f"\"{name}\" is exported, but not defined here.")
+
+    def _codeGenSingle(self, srcline):
+        """Encode a line during the single pass, deferring forward references."""
+        try:
+            srcline.word = self._encodeLine(srcline)
+        except UndefinedSymbolError as error:
+            # the symbol may still be defined later on, so remember to patch it
+            if self._stream_writer is None:
+                self._fixups.append(srcline)
+            else:
+                symbol = error.symbol or srcline.tokens[1 + error.index]
+                self._pending.setdefault(symbol, []).append(srcline)
+        except Exception as error:
+            self._exceptionError(srcline, error)
+
+    def _resolveFixups(self):
+        """Patch all lines with forward references, once symbol tables are complete."""
+
+        for srcline in self._fixups:
+            self._codeGen(srcline)
+
+        self._fixups = []
+
+    def _resolvePending(self, symbol):
+        """Encode and write the streamed lines waiting for a symbol that was
+        just defined. Lines waiting on another symbol too are held again."""
+
+        for srcline in self._pending.pop(symbol, ()):
+            self._codeGenSingle(srcline)
+            if srcline.word is not None:
+                self._streamWrite(srcline)
 
+    def _streamWrite(self, srcline):
+        """Write out the listing line of a streamed line, unless code or
+        data did not fit already."""
 
-    def _parseCodeSeg(self, line, split_line, line_num, fin):
+        if not self._stream_stopped:
+            self._stream_writer.writeLine(self._listingLine(srcline))
+
+    def _streamLine(self, srcline):
+        """Handle a line while streaming, writing it out once resolved."""
+
+        if self._code_segment:
+            self._parseCodeSeg(srcline)
+        else:
+            self._parseDataSeg(srcline)
+
+        if srcline.kind == SourceLine.CODE:
+            self._occupyStreamed(srcline)
+            if srcline.word is not None:
+                self._streamWrite(srcline)
+        elif srcline.kind == SourceLine.LABEL or srcline.kind == SourceLine.VARIABLE:
+            name = srcline.tokens[0]
+            if srcline.kind == SourceLine.VARIABLE and self._data_symbol_table.get(name) == srcline.address:
+                self._occupyData(srcline, self._data_address)
+            if srcline.kind == SourceLine.LABEL and self._code_symbol_table.get(name) == srcline.address:
+                self._streamWrite(srcline)
+            if name in self._pending:
+                self._resolvePending(name)
+        elif srcline.kind == SourceLine.PSEUDO and srcline.tokens[0] == ".equ" and len(srcline.tokens) > 1:
+            if srcline.tokens[1] in self._pending:
+                self._resolvePending(srcline.tokens[1])
+
+    def _parseCodeSeg(self, srcline):
         """Parse code segment section."""
 
+        split_line = srcline.tokens
+
         # line is indented
-        if re.match(r'\s', line):
+        if srcline.kind == SourceLine.CODE:
 
-            # if the second parse, means code generation should happen
-            if self._second_parse:
-                self._codeGen(split_line, line_num, fin, line)
+            # in single pass mode, code is generated right away
+            if self._single_parse:
+                self._codeGenSingle(srcline)
 
             # line is handled, so code address should increment
             self._code_address += 1
 
-        # if there is something in the first column
-        else:
-
-            # if starts with period, matches a pseudoop
-            if re.match(r'\.', line):
-                self._parsePseudoOp(split_line, line_num, fin)
+        # if starts with period, matches a pseudoop
+        elif srcline.kind == SourceLine.PSEUDO:
+            self._parsePseudoOp(srcline)
 
-            # if we are on the first parse, should handle labels
-            elif not self._second_parse:
+        # otherwise should be a label
+        else:
 
-                # check if only contains alphanumeric characters, not only numbers
-                if split_line[0].isalnum() and not split_line[0].isnumeric():
+            # check if only contains alphanumeric characters, not only numbers
+            if split_line[0].isalnum() and not split_line[0].isnumeric():
 
-                    # check if label not already defined
-                    if split_line[0] in self._code_symbol_table:
-                        ErrorHandler.genericError(fin.name, line_num, f"Label \"{split_line[0]}\" already defined.")
+                # check if label not already defined, as any kind of symbol:
+                # operands look names up in every table, so the passes could
+                # otherwise take different ones
+                if self._isDefined(split_line[0]):
+                    self._error(srcline, f"Label \"{split_line[0]}\" already defined.")
+                    return
 
-                    # Save in symbol table
-                    self._code_symbol_table[split_line[0]] = self._code_address
+                # Save in symbol table
+                self._code_symbol_table[split_line[0]] = self._code_address
+                if self._origin_index is not None and self._relocatable:
+                    self._absolute_labels.add(split_line[0])
 
-                # Invalid statement (contains special characters)
-                else:
-                    ErrorHandler.genericError(fin.name, line_num, f"\"{split_line[0]}\" is not a valid statement"
-                                                                        "on the first column.")
-                    
-            # We are on the second parse, so output the current address for user-readable
-            # object code. All errors should already be caught in the first parse.
+            # Invalid statement (contains special characters)
             else:
-                self._outputFileStream.writeLine("          ; " + split_line[0])
+                self._error(srcline, f"\"{split_line[0]}\" is not a valid statement"
+                                     "on the first column.")
 
-    def _parseDataSeg(self, line, split_line, line_num, fin):
+    def _parseDataSeg(self, srcline):
         """Parse data segment section."""
 
-        # Check if there is something in the first column
-        if not re.match(r'\s', line):
+        split_line = srcline.tokens
 
-            # Begins with a period - pseudoop
-            if re.match(r'\.', line):
-                self._parsePseudoOp(split_line, line_num, fin)
+        # Begins with a period - pseudoop
+        if srcline.kind == SourceLine.PSEUDO:
+            self._parsePseudoOp(srcline)
 
-            # Otherwise, if on the first parse, update variable symbol table
-            elif not self._second_parse:
+        # Something in the first column, update variable symbol table
+        elif srcline.kind == SourceLine.VARIABLE:
 
-                # check for only valid characters, and not only numeric characters
-                if split_line[0].isalnum() and not split_line[0].isnumeric():
+            # check for only valid characters, and not only numeric characters
+            if split_line[0].isalnum() and not split_line[0].isnumeric():
 
-                    # check not already defined
-                    if split_line[0] in self._data_symbol_table:
-                        ErrorHandler.genericError(fin.name, line_num, f"Variable \"{split_line[0]}\" already defined.")
+                # check not already defined, as any kind of symbol
+                if self._isDefined(split_line[0]):
+                    self._error(srcline, f"Variable \"{split_line[0]}\" already defined.")
+                    return
 
-                    # Update symbol table
-                    self._data_symbol_table[split_line[0]] = self._data_address
+                # Update symbol table
+                self._data_symbol_table[split_line[0]] = self._data_address
 
-                    # check that the length of the variable supplied correctly
-                    if len(split_line) < 2 or not split_line[1].isnumeric():
-                        ErrorHandler.genericError(fin.name, line_num, "Invalid variable length supplied.")
+                # check that the length of the variable supplied correctly
+                try:
+                    length = self._evaluateConstant(split_line[1], 1)[0] if len(split_line) > 1 else -1
+                except OperandError:
+                    length = -1
+                if length < 0:
+                    self._error(srcline, "Invalid variable length supplied.", 1)
+                    return
 
-                    # Increment location in data segment.
-                    self._data_address += int(split_line[1])
+                # Increment location in data segment.
+                self._data_address += length
+
+            # Does not match anything legal - throw an error
+            else:
+                self._error(srcline, f"\"{split_line[0]}\" is not a valid statement"
+                                     "on the first column.")
 
-                # Does not match anything legal - throw an error
-                else:
-                    ErrorHandler.genericError(fin.name, line_num, f"\"{split_line[0]}\" is not a valid statement"
-                                                                        "on the first column.")
-                
         # data segment should not have any lines with text starting after first column
         else:
-            ErrorHandler.genericError(fin.name, line_num, "All valid statements in data segment "
-                                                          "should start on first column.")
+            self._error(srcline, "All valid statements in data segment "
+                                 "should start on first column.")
 
+    def _makeSourceLine(self, filename, record):
+        """Build the IR record for a lexed non-empty line."""
 
-    def _parse(self, secondary_file = False):
-        """Main parsing entry, for both passes"""
+        line_num, indent, raw, tokens = record
 
-        # If there is a secondary file present (from an include), that should
-        # be parsed first. Otherwise parse the main file.
-        filestream = self._file_read_secondary if secondary_file else self._file_read
+        # lines share the int objects of their code addresses
+        address = self._code_address
+        if address < CODE_SIZE:
+            address = _code_addresses[address]
 
-        # Start on line number 1.
-        line_num = 1
+        # line is indented - an instruction in code, invalid in data
+        if indent:
+            if self._code_segment:
+                return SourceLine(filename, line_num, indent, raw, tokens, SourceLine.CODE, True, address)
+            return SourceLine(filename, line_num, indent, raw, tokens, SourceLine.INVALID, False, None)
 
-        while True:
-            # read in lines until end of file is reached
-            line = filestream.readline()
-            if not line:
-                break
+        # if starts with period, matches a pseudoop
+        if raw[0] == ".":
+            return SourceLine(filename, line_num, 0, raw, tokens, SourceLine.PSEUDO,
+                              self._code_segment, None)
 
-            # Remove comments from parsing
-            line += " "
-            line = line[:line.find(';')]
+        # otherwise a label or a variable
+        if self._code_segment:
+            return SourceLine(filename, line_num, 0, raw, tokens, SourceLine.LABEL, True, address)
+        return SourceLine(filename, line_num, 0, raw, tokens, SourceLine.VARIABLE, False, self._data_address)
 
-            # Split the line on whitespace
-            split_line = line.split()
+    def _parse(self, filename, source=None):
+        """First pass over a file: handle each of its tokenized lines."""
 
-            # If the line is not empty, parse in either code or data segment.
-            if len(split_line) > 0:
-                if self._code_segment:
-                    self._parseCodeSeg(line, split_line, line_num, filestream)
-                else:
-                    self._parseDataSeg(line, split_line, line_num, filestream)
-                
-            # Parsing complete, move on to the next line
-            line_num += 1
+        filename = sys.intern(filename)
+        if source is None:
+            source = self._includes.load(filename, self._cache)
 
-    def first_parse(self):
-        """Perform the first pass. Should be called before second_parse()"""
-        self._parse()
+        self._include_stack.append((source, filename))
+        try:
+            code_lines = self._parseRecords(filename, source.records, source)
+        finally:
+            self._include_stack.pop()
+
+        if self._cache is not None and source.key not in self._uncached_keys and not self._relocatable:
+            self._file_units.append((source.key, code_lines))
 
-    def second_parse(self, f):
-        """Perform the second pass. Should be called after first_parse()"""
+    def _parseRecords(self, filename, records, source=None):
+        """Handle the lexed records of a file, returning its code lines."""
 
-        # Indicate second pass.
-        self._second_parse = True
+        if filename not in self._file_order:
+            if len(self._include_stack) > 1:
+                includer = self._include_stack[-2][1]
+                self._file_order[filename] = self._file_order[includer] + (self._pseudo_line.line_num,)
+            else:
+                self._file_order[filename] = ()
+
+        code_lines = []
+        if self._memo is None or source is None or self._single_parse:
+            statements, line_num = self._parseChunk(filename, records, code_lines)
+        else:
+            for start, end, memoize in self._chunkBounds(source):
+                if memoize:
+                    self._parseMemoChunk(filename, source, start, end, code_lines)
+                else:
+                    self._parseChunk(filename, source.records[start:end], code_lines)
+            statements = len(records)
+            line_num = records[-1][0] if records else 0
+
+        if self._stats is not None:
+            self._stats.addFile(line_num, statements, (srcline.tokens[0] for srcline in code_lines))
+
+        return code_lines
+
+    def _parseChunk(self, filename, records, code_lines):
+        """Handle lexed records, adding to code_lines. Returns the number of
+        records and the last line number."""
+
+        statements = 0
+        line_num = 0
+        for record in self._expandRecords(filename, records):
+            statements += 1
+            if record[0] > line_num:
+                line_num = record[0]
+            srcline = self._makeSourceLine(filename, record)
+
+            # streamed lines are written out and dropped, rather than kept
+            if self._stream_writer is not None:
+                self._streamLine(srcline)
+                if self._stats is not None and srcline.kind == SourceLine.CODE:
+                    self._stats.mnemonics[srcline.tokens[0]] += 1
+                continue
+
+            self._lines.append(srcline)
+
+            # Parse in either code or data segment.
+            if self._code_segment:
+                self._parseCodeSeg(srcline)
+                if srcline.kind == SourceLine.CODE:
+                    code_lines.append(srcline)
+            else:
+                self._parseDataSeg(srcline)
+
+        return statements, line_num
+
+    def _chunkBounds(self, source):
+        """(start, end, memoize) record indexes of the runs of lines between
+        the includes of a file, with every include line a run of its own
+        that is not memoized.
+
+        So are lines in the first column with an argument that is no plain
+        number (.include, .equ, .org or variable sizes using constants),
+        as what they do depends on more than the addresses they start at,
+        and whole .macro and .rept blocks."""
+
+        bounds = self._memo.get((source,))
+        if bounds is None:
+            bounds = []
+            start = 0
+            depth = 0
+            for index, (indent, _, tokens) in enumerate(source.records.lexed):
+                if indent:
+                    continue
+                if tokens[0] == ".macro" or tokens[0] == ".rept":
+                    if depth == 0 and start < index:
+                        bounds.append((start, index, True))
+                        start = index
+                    depth += 1
+                elif depth:
+                    if tokens[0] == ".endm" or tokens[0] == ".endr":
+                        depth -= 1
+                        if depth == 0:
+                            bounds.append((start, index + 1, False))
+                            start = index + 1
+                elif len(tokens) > 1 and not tokens[1].isnumeric():
+                    if start < index:
+                        bounds.append((start, index, True))
+                    bounds.append((index, index + 1, False))
+                    start = index + 1
+            if start < len(source.records):
+                bounds.append((start, len(source.records), depth == 0))
+            self._memo.put((source,), bounds)
+        return bounds
+
+    def _parseMemoChunk(self, filename, source, start, end, code_lines):
+        """Handle a run of records, reusing what an earlier build got from
+        it where it started out in the same state."""
+
+        state = (filename, self._code_address, self._data_address, self._code_segment)
+        key = (source, start) + state
+        chunk = self._memo.get(key)
+        if chunk is None and self._cache is not None:
+            chunk = self._cachedChunk(filename, source, start, end, state)
+            if chunk is not None:
+                self._memo.put(key, chunk)
+        if chunk is not None and self._reuseChunk(chunk):
+            code_lines.extend(chunk.code_lines)
+            return
+
+        lines_start = len(self._lines)
+        errors = len(self._diagnostics)
+        expansions = self._macro_expansions
+        chunk_code_lines = []
+        self._parseChunk(filename, source.records[start:end], chunk_code_lines)
+        code_lines.extend(chunk_code_lines)
+
+        # runs with errors are parsed again, to report them every time, and
+        # so are those invoking macros, which may be defined differently
+        if len(self._diagnostics) == errors and self._macro_expansions == expansions:
+            chunk = ParsedChunk(self._lines[lines_start:], chunk_code_lines,
+                                (self._code_address, self._data_address, self._code_segment))
+            self._memo.put(key, chunk)
+            self._chunks.append((lines_start, chunk))
+            if self._cache is not None:
+                self._cache.storeChunk(source.key, start, state, self._packChunk(chunk))
+
+    def _packChunk(self, chunk):
+        """What the cache keeps of a run of lines: the kind and segment of
+        every line, a byte each, their addresses and the state after them."""
+
+        kinds = bytes([srcline.kind | srcline.code_segment << 3 for srcline in chunk.lines])
+        addresses = array("l", [-1 if srcline.address is None else srcline.address for srcline in chunk.lines])
+        return kinds, addresses.tobytes(), chunk.end_state
+
+    def _cachedChunk(self, filename, source, start, end, state):
+        """The run of lines from record start to end as an earlier run
+        parsed it from the same state, rebuilt from the cache, or None if
+        the cache does not have it."""
+
+        cached = self._cache.loadChunk(source.key, start, state)
+        if cached is None:
+            return None
+
+        kinds, addresses, end_state = cached
+        records = source.records[start:end]
+        lines = []
+        code_lines = []
+        add = lines.append
+        add_code = code_lines.append
+        code = SourceLine.CODE
+        for line_num, (indent, raw, tokens), flags, address in zip(records.line_nums, records.lexed, kinds,
+                                                                  array("l", addresses)):
+            # most lines are code, in the code segment
+            if flags == code | 8:
+                srcline = SourceLine(filename, line_num, indent, raw, tokens, code, True,
+                                     _code_addresses[address] if address < CODE_SIZE else address)
+                add_code(srcline)
+            else:
+                kind = flags & 7
+                if address < 0:
+                    address = None
+                elif kind == SourceLine.LABEL and address < CODE_SIZE:
+                    address = _code_addresses[address]
+                srcline = SourceLine(filename, line_num, indent if kind == SourceLine.INVALID else 0, raw, tokens,
+                                     kind, flags >> 3 != 0, address)
+            add(srcline)
+
+        return ParsedChunk(lines, code_lines, end_state)
+
+    def _reuseChunk(self, chunk):
+        """Add a run of lines parsed by an earlier build to the IR, unless
+        one of its symbols is defined already. Returns whether it was."""
+
+        for name, _ in chunk.labels + chunk.variables:
+            if self._isDefined(name):
+                return False
+
+        # lines that would invoke a macro defined since
+        if self._macros and any(srcline.tokens[0] in self._macros for srcline in chunk.code_lines):
+            return False
+
+        self._code_symbol_table.update(chunk.labels)
+        self._data_symbol_table.update(chunk.variables)
+        self._code_address, self._data_address, self._code_segment = chunk.end_state
+
+        # the code is encoded again, unless the cache has it
+        for srcline in chunk.code_lines:
+            srcline.word = None
+
+        self._chunks.append((len(self._lines), chunk))
+        self._lines.extend(chunk.lines)
+        return True
+
+    def _jumpOutOfRange(self, srcline, relocatable_ip):
+        """Whether a conditional jump cannot reach its target."""
+
+        # in a module, jumps whose offset is only known once linked
+        if self._relocatable:
+            try:
+                if relocateOperand(srcline.tokens, srcline.address, relocatable_ip, self._code_symbol_table,
+                                   self._data_symbol_table, self._constant_table, self._targetOf) is not None:
+                    return True
+            except OperandError:
+                # reported by encoding
+                return False
+
+        try:
+            value, weight = compileExpression(srcline.tokens[1]).evaluate(
+                self._code_symbol_table, self._data_symbol_table, self._constant_table, srcline.address)
+        except OperandError:
+            return False
+
+        # only jumps to code addresses, numbers are offsets already
+        if weight != 1:
+            return False
+        try:
+            Operands.operandField(value, weight, srcline.address)
+        except OperandError:
+            return True
+        return False
+
+    def _placeCode(self, lines, relaxed):
+        """Give the code and labels of lines their addresses with the relaxed
+        jumps taking three words, as the first pass did with one, and
+        evaluate again the .equ constants and .org addresses that may
+        depend on them. A number in lines stands for as many code lines
+        only placed later."""
 
-        # Reinitialize code and address locations.
         self._code_address = 0
-        self._data_address = 0
+        for srcline in lines:
+            if isinstance(srcline, int):
+                self._code_address += srcline
+                continue
+
+            kind = srcline.kind
+            if kind == SourceLine.CODE:
+                srcline.address = self._code_address
+                self._code_address += 3 if srcline in relaxed else 1
+            elif kind == SourceLine.LABEL:
+                srcline.address = self._code_address
+                if srcline.tokens[0].isalnum():
+                    self._code_symbol_table[srcline.tokens[0]] = self._code_address
+            elif kind == SourceLine.PSEUDO and len(srcline.tokens) > 1:
+                op = srcline.tokens[0]
+                try:
+                    if op == ".org" and srcline.code_segment:
+                        self._code_address = self._evaluateConstant(srcline.tokens[1])[0]
+                    elif op == ".equ" and len(srcline.tokens) > 2 and srcline.tokens[1] in self._constant_table:
+                        self._constant_table[srcline.tokens[1]] = self._evaluateConstant(srcline.tokens[2], 1)
+                except Exception as error:
+                    self._exceptionError(srcline, error)
+
+    def _fixedCodeStart(self):
+        """Index into the IR of the first line whose code is placed by the
+        assembler, rather than by the linker."""
+
+        if not self._relocatable:
+            return 0
+        return len(self._lines) if self._origin_index is None else self._origin_index
+
+    def _codeLineAt(self, address, before):
+        """The first code line of the IR placed at an address before a given
+        line, None if there is none (or no IR, when streaming)."""
+
+        for srcline in self._lines[self._fixedCodeStart():]:
+            if srcline is before:
+                break
+            if srcline.kind == SourceLine.CODE and srcline.address == address:
+                return srcline
+        return None
+
+    def _clashError(self, srcline):
+        """Report a code line past the end of the code space, or over code
+        placed before."""
+
+        address = srcline.address
+        if address >= CODE_SIZE:
+            self._error(srcline, f"Code at ${address:04X} does not fit the code space, "
+                                 f"which ends at ${CODE_SIZE - 1:04X}.")
+            return
+
+        placed = self._codeLineAt(address, srcline)
+        where = "" if placed is None else f" by line {placed.line_num} of \"{placed.file}\""
+        self._error(srcline, f"Code at ${address:04X} overwrites the code placed there before{where}.")
+
+    def _occupyStreamed(self, srcline):
+        """Take the word of a streamed code line, reporting it if it clashes
+        (see _checkMemory)."""
+
+        address = srcline.address
+        past_end = address >= CODE_SIZE
+        if past_end or (self._code_map.take(address) and not self._overlap):
+            if self._clash != (past_end, address - 1):
+                self._clashError(srcline)
+            self._clash = (past_end, address)
+            self._stream_stopped = True
+        else:
+            self._clash = None
+
+    def _occupyData(self, srcline, end):
+        """Take the data bytes of a variable, up to end, reporting it if it
+        does not fit the data space."""
+
+        if end > DATA_SIZE:
+            self._stream_stopped = True
+            self._error(srcline, f"Variable \"{srcline.tokens[0]}\" at ${srcline.address:04X} does not fit "
+                                 f"the data space, which ends at ${DATA_SIZE - 1:04X}.")
+        for address in range(srcline.address, min(end, DATA_SIZE)):
+            self._data_map.take(address)
+
+    def _checkMemory(self):
+        """Fill the occupancy bitmaps from the placed code and variables,
+        reporting code past the end of the code space, code placed over code
+        placed before (unless overlaps are allowed) and variables past the
+        end of the data space. Of a run of code lines that clash alike, only
+        the first one is reported."""
+
+        lines = self._lines[self._fixedCodeStart():]
+        clashes = self._code_map.takeAll([srcline.address for srcline in lines
+                                          if srcline.kind == SourceLine.CODE], self._overlap)
+        if clashes:
+            code_lines = [srcline for srcline in lines if srcline.kind == SourceLine.CODE]
+            run = None
+            for position in clashes:
+                srcline = code_lines[position]
+                past_end = srcline.address >= CODE_SIZE
+                if run != (past_end, srcline.address - 1, position - 1):
+                    self._clashError(srcline)
+                run = (past_end, srcline.address, position)
+
+        # the variables take the data from address 0 on, one after the other
+        for address in range(min(self._data_address, DATA_SIZE)):
+            self._data_map.take(address)
+        if self._data_address <= DATA_SIZE:
+            return
+
+        # a variable takes the data up to the next one
+        variable = None
+        for srcline in self._lines:
+            if srcline.kind != SourceLine.VARIABLE:
+                continue
+            if self._data_symbol_table.get(srcline.tokens[0]) == srcline.address:
+                if variable is not None:
+                    self._occupyData(variable, srcline.address)
+                variable = srcline
+        if variable is not None:
+            self._occupyData(variable, self._data_address)
+
+    def _relaxedLines(self, srcline):
+        """The three code lines replacing a relaxed jump."""
+
+        mnemonic, target = srcline.tokens
+        lines = []
+        for tokens in ((Opcode.inverse_jumps[mnemonic], ".IP+3"), ("NOP",), ("JMP", target)):
+            tokens = tuple([sys.intern(token) for token in tokens])
+            lines.append(SourceLine(srcline.file, srcline.line_num, srcline.indent, " ".join(tokens), tokens,
+                                    SourceLine.CODE, True, srcline.address + len(lines)))
+        return lines
+
+    def _relaxJumps(self):
+        """Replace every conditional jump that cannot reach its target by
+        the inverse jump over a JMP to the target:
+
+                JZ    Far       ->      JNZ   .IP+3
+                                        NOP
+                                        JMP   Far
+
+        Jumps have a delay slot, so the inverse jump goes past the NOP in
+        its own to the line after the original jump, which is in turn the
+        delay slot of the JMP. Relaxing moves the code after it, which can
+        put more jumps out of range, so it is repeated until no jump needs
+        it. Relaxed jumps are never shortened again, so that always ends.
+
+        The passes only place the lines they need: the jumps, labels, .org
+        and .equ lines, with the code in between counted. All lines are
+        placed once, at the end."""
+
+        # conditional jumps to an operand not relative to themselves
+        origin = len(self._lines) if self._origin_index is None else self._origin_index
+        jumps = [(srcline, index < origin) for index, srcline in enumerate(self._lines)
+                 if srcline.kind == SourceLine.CODE and srcline.tokens[0] in Opcode.inverse_jumps
+                 and len(srcline.tokens) == 2 and ".IP" not in srcline.tokens[1]]
+
+        layout = []
+        count = 0
+        candidates = set(srcline for srcline, _ in jumps)
+        for srcline in self._lines:
+            if srcline.kind == SourceLine.CODE and srcline not in candidates:
+                count += 1
+            elif (srcline.kind == SourceLine.CODE or srcline.kind == SourceLine.LABEL
+                    or srcline.kind == SourceLine.PSEUDO and srcline.tokens[0] in (".org", ".equ")):
+                if count:
+                    layout.append(count)
+                    count = 0
+                layout.append(srcline)
+
+        relaxed = set()
+        passes = 0
+        while jumps:
+            passes += 1
+            found = [srcline for srcline, relocatable_ip in jumps
+                     if self._jumpOutOfRange(srcline, relocatable_ip)]
+            if not found:
+                break
+            relaxed.update(found)
+            jumps = [jump for jump in jumps if jump[0] not in relaxed]
+            self._placeCode(layout, relaxed)
+
+        self._relaxation = (len(relaxed), passes)
+        if not relaxed:
+            return
+        self._placeCode(self._lines, relaxed)
+
+        # the IR, and the code lines of the files cached, with the new lines
+        replacements = {}
+        lines = []
+        for index, srcline in enumerate(self._lines):
+            if index == self._origin_index:
+                origin = len(lines)
+            if srcline in relaxed:
+                replacements[srcline] = self._relaxedLines(srcline)
+                lines.extend(replacements[srcline])
+            else:
+                lines.append(srcline)
+        self._lines = lines
+        if self._origin_index is not None:
+            self._origin_index = origin
+
+        for unit, (key, code_lines) in enumerate(self._file_units):
+            if any(srcline in replacements for srcline in code_lines):
+                unit_lines = []
+                for srcline in code_lines:
+                    unit_lines.extend(replacements.get(srcline, (srcline,)))
+                self._file_units[unit] = (key, unit_lines)
+
+    def getRelaxation(self):
+        """Return (jumps relaxed, passes it took) of the first pass."""
+        return self._relaxation
+
+    def _listingLine(self, srcline):
+        """The listing line of a code or label line."""
+
+        if srcline.kind == SourceLine.CODE:
+            return listingCodeLine(srcline.address, srcline.word, srcline.raw)
+
+        # output labels for user-readable object code
+        return listingLabelLine(srcline.tokens[0])
+
+    def listing(self):
+        """Generate the lines of the object file listing from the IR."""
+
+        index = 0
+        for start, chunk in self._chunks:
+            yield from self._listingRange(index, start)
+            yield from self._chunkListing(chunk)
+            index = start + len(chunk.lines)
+        yield from self._listingRange(index, len(self._lines))
+
+    def _listingRange(self, start, end):
+        """Generate the listing lines of a range of the IR."""
+
+        lines = self._lines
+        for index in range(start, end):
+            srcline = lines[index]
+            if srcline.kind == SourceLine.CODE or srcline.kind == SourceLine.LABEL:
+                yield self._listingLine(srcline)
+
+    def _chunkListing(self, chunk):
+        """The listing lines of a run of lines from the memo, made again only
+        if its code changed."""
+
+        words = [srcline.word for srcline in chunk.code_lines]
+        if chunk.listing_words != words:
+            chunk.listing = [self._listingLine(srcline) for srcline in chunk.lines
+                             if srcline.kind == SourceLine.CODE or srcline.kind == SourceLine.LABEL]
+            chunk.listing_words = words
+        return chunk.listing
+
+    def _writeListing(self, f):
+        """Write the object file listing from the IR."""
+
+        for line in self.listing():
+            f.writeLine(line)
+
+    def _phase(self, name, function, *args):
+        """Run a pass, timing it if statistics are collected."""
+
+        if self._stats is None:
+            return function(*args)
+
+        with self._stats.timer(name):
+            result = function(*args)
+        self._stats.setSymbols(self._code_symbol_table, self._data_symbol_table)
+        return result
 
-        # By default start at code segment again.
-        self._code_segment = True
+    def first_parse(self):
+        """Perform the first pass. Should be called before second_parse()"""
+        self._phase("first pass", self._firstParse)
+
+        # with errors, addresses are not worth getting right
+        if self._relax and not self._diagnostics:
+            self._phase("jump relaxation", self._relaxJumps)
+
+        self._phase("memory check", self._checkMemory)
+
+    def _firstParse(self):
+        # Read every file up front, then go through them in order.
+        if self._memo is not None:
+            self._memo.begin()
+        self._includes.build(self._entry_file, self._cache)
+        self._parse(self._entry_file)
+
+    def second_parse(self, f=None):
+        """Perform the second pass. Should be called after first_parse()
+
+        Without an output file stream, code is only generated into the IR.
+        """
+
+        self._phase("second pass", self._secondParse, f)
+
+    def _secondParse(self, f):
+        # Reuse the code of files whose addresses and referenced symbols
+        # are unchanged since they were cached.
+        encoded_units = []
+        for key, code_lines in self._file_units:
+            if not self._cache.reuseWords(key, code_lines, self._code_symbol_table,
+                                          self._data_symbol_table, self._constant_table):
+                encoded_units.append((key, code_lines))
+
+        # Generate code for every other code line recorded in the first pass.
+        # All errors other than in code should already be caught.
+        if self._relocatable:
+            self._codeGenModule()
+        else:
+            srclines = [srcline for srcline in self._lines
+                        if srcline.kind == SourceLine.CODE and srcline.word is None]
+            if self._jobs > 1 and len(srclines) >= MIN_PARALLEL_LINES:
+                self._codeGenParallel(srclines)
+            else:
+                for srcline in srclines:
+                    self._codeGen(srcline)
+
+        # Stop here if anything went wrong, rather than caching broken code.
+        self._checkDiagnostics()
+
+        for key, code_lines in encoded_units:
+            self._cache.storeWords(key, code_lines, self._code_symbol_table, self._data_symbol_table,
+                                   self._constant_table)
+
+        # And write out the listing.
+        if f is not None:
+            self._writeListing(f)
+
+    def single_parse(self, f=None):
+        """Perform a single pass, encoding code as it is read and backpatching
+        forward references afterwards. Replaces first_parse() and second_parse()."""
+
+        # modules and relaxed jumps need all symbols known first
+        if self._relocatable or self._relax:
+            self.first_parse()
+            self.second_parse(f)
+            return
+
+        self._phase("single pass", self._singleParse, f)
+
+    def _singleParse(self, f):
+        # Indicate single pass.
+        self._single_parse = True
+
+        # Parse, generating code for everything already resolvable.
+        self._includes.build(self._entry_file, self._cache)
+        self._parse(self._entry_file)
+        self._checkMemory()
+
+        # All symbols are known now, so patch the remaining lines.
+        self._resolveFixups()
+        self._checkDiagnostics()
+
+        # Finally write out everything in order.
+        if f is not None:
+            self._writeListing(f)
+
+    def stream_parse(self, lines, f):
+        """Assemble source read line by line from an iterable (such as a
+        pipe), writing listing lines to f as soon as they can be encoded.
+        Replaces all other passes.
+
+        Lines referencing a symbol not defined yet are held until it is,
+        so the listing comes out of order where there are forward
+        references. Neither the IR nor the cache is kept, memory only grows
+        with the symbol tables and the lines still held back."""
+
+        self._phase("stream", self._streamParse, lines, f)
+
+    def _streamParse(self, lines, f):
+        self._single_parse = True
+        self._stream_writer = f
+        self._cache = None
+
+        entry = sys.intern(self._entry_file)
+        self._include_stack.append((None, entry))
+        self._parseRecords(entry, lexLines(lines))
+
+        # Whatever is still held back references undefined symbols, which
+        # encoding now reports.
+        pending, self._pending = self._pending, {}
+        for srclines in pending.values():
+            for srcline in srclines:
+                self._codeGen(srcline)
+                if srcline.word is not None:
+                    self._streamWrite(srcline)
+
+        self._checkDiagnostics()
+
+    def getLines(self):
+        """Return the intermediate representation built by the first pass."""
+        return self._lines
+
+    def getIncludeGraph(self):
+        """Return the IncludeGraph the source files were read through."""
+        return self._includes
+
+    def getCodeSymbols(self):
+        """Return the label symbol table."""
+        return self._code_symbol_table
+
+    def getDataSymbols(self):
+        """Return the variable symbol table."""
+        return self._data_symbol_table
+
+    def isRelocatable(self):
+        """Whether the parser assembles a relocatable module."""
+        return self._relocatable
+
+    def objectModule(self):
+        """The shass_object.ObjectModule assembled, once second_parse() of a
+        parser made with relocatable set is done."""
+
+        sections = []
+        section = None
+        start = 0
+        relocations = []
+        symbols = {}
+        origin = len(self._lines) if self._origin_index is None else self._origin_index
+
+        for index, srcline in enumerate(self._lines):
+            # every .org starts a section at a fixed address
+            if srcline.kind == SourceLine.PSEUDO and srcline.tokens[0] == ".org":
+                section = None
+                continue
+            if srcline.kind != SourceLine.CODE and srcline.kind != SourceLine.LABEL:
+                continue
+
+            if section is None:
+                start = srcline.address if index >= origin else 0
+                section = {"origin": start if index >= origin else None, "words": [], "source": [], "labels": []}
+                sections.append(section)
+            offset = srcline.address - start
+
+            if srcline.kind == SourceLine.LABEL:
+                name = srcline.tokens[0]
+                section["labels"].append([offset, name])
+                symbols[name] = ("code", len(sections) - 1, offset, name in self._globals)
+                continue
+
+            section["words"].append(srcline.word)
+            section["source"].append(srcline.raw)
+            relocation = self._relocations.get(srcline)
+            if relocation is not None:
+                relocations.append((len(sections) - 1, offset) + relocation + (srcline.file, srcline.line_num))
+
+        for name, address in self._data_symbol_table.items():
+            symbols[name] = ("data", -1, address, name in self._globals)
+
+        sources = [(name, self._includes.load(name).key) for name in self._file_order]
+        return ObjectModule(self._entry_file, sources, sections, self._data_address, symbols,
+                            sorted(self._externs), relocations)
+
+    def memoryMap(self):
+        """The shass_memory.MemoryMap of the code and data spaces, once
+        assembled. Of a module, it only has the code after .org."""
+        return MemoryMap(self._code_map, self._data_map)
+
+    def symbolMap(self):
+        """The shass_symbols.SymbolMap of the labels and variables, once
+        assembled."""
+
+        origins = {}
+        variables = []
+        for srcline in self._lines:
+            if srcline.kind == SourceLine.LABEL:
+                key = ("code", srcline.tokens[0])
+                if key not in origins and self._code_symbol_table.get(key[1]) == srcline.address:
+                    origins[key] = (srcline.file, srcline.line_num)
+            elif srcline.kind == SourceLine.VARIABLE:
+                key = ("data", srcline.tokens[0])
+                if key not in origins and self._data_symbol_table.get(key[1]) == srcline.address:
+                    origins[key] = (srcline.file, srcline.line_num)
+                    variables.append(key[1])
+
+        # variables take the data addresses one after the other
+        data_sizes = {}
+        ends = [self._data_symbol_table[name] for name in variables[1:]] + [self._data_address]
+        for name, end in zip(variables, ends):
+            data_sizes[name] = end - self._data_symbol_table[name]
+
+        return buildSymbolMap(self._code_symbol_table, self._data_symbol_table, self.codeRanges(),
+                              data_sizes, origins)
+
+    def getConstants(self):
+        """Return the .equ constants, as name -> value."""
+        return {name: value for name, (value, _) in self._constant_table.items()}
+
+    def codeRanges(self):
+        """Return the sorted (start, end) address ranges holding code."""
+
+        ranges = []
+        for address in sorted(set(srcline.address for srcline in self._lines
+                                  if srcline.kind == SourceLine.CODE)):
+            if ranges and ranges[-1][1] == address:
+                ranges[-1][1] = address + 1
+            else:
+                ranges.append([address, address + 1])
+        return [tuple(r) for r in ranges]
 
-        # Specify output file stream.
-        self._outputFileStream = f
+    def codeImage(self):
+        """Return the generated code as a dense array of 16-bit words from
+        address 0, with unused addresses left at zero."""
 
-        # Restart reading main file from beginning again.
-        self._file_read.seek(0)
+        code_lines = [srcline for srcline in self._lines if srcline.kind == SourceLine.CODE]
+        size = max((srcline.address + 1 for srcline in code_lines), default=0)
 
-        # And parse.
-        self._parse()
-        self._file_read.close()
\ No newline at end of file
+        image = array("H", bytes(2 * size))
+        for srcline in code_lines:
+            image[srcline.address] = srcline.word
+        return image
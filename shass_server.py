@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+"""\
+Local assembly server, so frontends do not start an assembler process for
+every program.
+
+    ./shass_server.py --socket /tmp/shass.sock
+    ./shass_server.py --port 8750
+
+It speaks plain HTTP with JSON bodies, on a Unix socket or on localhost:
+
+    POST /assemble   {"source": "...", "files": {"lib.asm": "..."},
+                      "filename": "main.asm", "single_pass": false,
+                      "recover": false}
+    GET  /metrics    request counts and latency percentiles
+
+    curl --unix-socket /tmp/shass.sock -d @request.json http://localhost/assemble
+
+Programs are assembled on a pool of worker processes, each keeping its
+opcode tables loaded, and only ever from the source and the virtual
+include files of the request; nothing is read from or written to disk.
+A successful assembly answers 200 with the code words (from address 0),
+code ranges, listing, symbols and diagnostics. Errors in the program
+answer 422 with the diagnostics, a full queue 503 and a request taking
+longer than the timeout 504. A worker stops assembling a program once it
+has taken the timeout, so programs nobody waits for do not hold it.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import signal
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from shass_api import *
+
+# bound of request bodies
+MAX_BODY_SIZE = 16 * 2**20
+
+# number of latest requests the latency percentiles are taken over
+LATENCY_WINDOW = 10000
+
+_status_texts = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                 413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error",
+                 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+class JobTimeout(BaseException):
+    """Raised in a worker when a job has taken the timeout. Not an
+    Exception, so the assembler does not report it as an error of a line."""
+
+def _jobTimedOut(signum, frame):
+    raise JobTimeout()
+
+class RequestError(Exception):
+    """A request that cannot be served, with the HTTP status to answer."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def assembleRequest(request):
+    """Assemble the program of a request into a (status, response) pair.
+    Runs in the workers."""
+
+    try:
+        result = assemble(request["source"], include_resolver=request.get("files") or {},
+                          filename=request.get("filename") or "main.asm",
+                          single_pass=bool(request.get("single_pass")), recover=bool(request.get("recover")))
+    except AssemblerError as e:
+        return 422, {"ok": False, "diagnostics": [d.toDict() for d in e.diagnostics]}
+
+    return 200, {"ok": True, "words": result.words.tolist(), "ranges": result.ranges,
+                 "listing": result.listing, "code_symbols": result.code_symbols,
+                 "data_symbols": result.data_symbols,
+                 "diagnostics": [d.toDict() for d in result.diagnostics]}
+
+def _checkRequest(request):
+    """Check the shape of an assemble request."""
+
+    if not isinstance(request, dict) or not isinstance(request.get("source"), str):
+        raise RequestError(400, "Request needs a \"source\" string.")
+    files = request.get("files")
+    if files is not None and not (isinstance(files, dict) and
+                                  all(isinstance(text, str) for text in files.values())):
+        raise RequestError(400, "\"files\" must map include names to their text.")
+    if not isinstance(request.get("filename", ""), str):
+        raise RequestError(400, "\"filename\" must be a string.")
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values, None if there are none."""
+
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+class ServerMetrics:
+    """Request counts and latencies of a server."""
+
+    def __init__(self):
+        self._start = time.monotonic()
+
+        # requests answered per HTTP status
+        self.statuses = {}
+
+        # jobs waiting for or being assembled on the pool, including those
+        #   whose request timed out
+        self.in_flight = 0
+
+        # seconds from receiving to answering the latest assemble requests,
+        # and of those the time spent assembling
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.assembly_times = deque(maxlen=LATENCY_WINDOW)
+
+    def record(self, status, latency=None, assembly_time=None):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if latency is not None:
+            self.latencies.append(latency)
+        if assembly_time is not None:
+            self.assembly_times.append(assembly_time)
+
+    def _percentiles(self, values):
+        values = sorted(values)
+        return {name: None if not values else percentile(values, fraction) * 1000
+                for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))}
+
+    def toDict(self, max_queue):
+        return {"uptime": time.monotonic() - self._start,
+                "requests": sum(self.statuses.values()),
+                "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+                "in_flight": self.in_flight, "max_queue": max_queue,
+                "latency_ms": self._percentiles(self.latencies),
+                "assembly_ms": self._percentiles(self.assembly_times)}
+
+class AssemblyServer:
+    """Serves assemble requests on a pool of worker processes."""
+
+    def __init__(self, workers=None, timeout=10.0, max_queue=64):
+        self._workers = workers or os.cpu_count() or 1
+        self._timeout = timeout
+        self._max_queue = max_queue
+        self._pool = None
+        self.metrics = ServerMetrics()
+
+    def _startPool(self):
+        self._pool = ProcessPoolExecutor(max_workers=self._workers)
+
+    async def _assemble(self, request):
+        """Assemble a request on the pool, returning (status, response,
+        seconds spent assembling)."""
+
+        # Refuse rather than queue without bound.
+        if self.metrics.in_flight >= self._max_queue:
+            raise RequestError(503, f"Queue is full ({self._max_queue} requests).")
+
+        future = asyncio.get_running_loop().run_in_executor(self._pool, _timedAssembleRequest, request,
+                                                            self._timeout)
+
+        # A job counts until its worker is done with it, also after its
+        # request timed out (the worker gives up on it at the latest after
+        # the timeout), so jobs nobody waits for still fill the queue.
+        self.metrics.in_flight += 1
+        future.add_done_callback(self._jobDone)
+
+        try:
+            # time spent queued counts too, so stop waiting; the worker stops
+            # on its own, once the job has run for the timeout
+            return await asyncio.wait_for(asyncio.shield(future), self._timeout)
+        except asyncio.TimeoutError:
+            raise RequestError(504, f"Assembly took longer than {self._timeout} s.")
+        except BrokenProcessPool:
+            # a worker died, start over with a fresh pool
+            self._pool.shutdown(wait=False)
+            self._startPool()
+            raise RequestError(500, "A worker process died.")
+
+    def _jobDone(self, future):
+        """Count a job of the pool as done."""
+
+        self.metrics.in_flight -= 1
+
+        # of jobs that timed out, nobody else looks at the outcome
+        if not future.cancelled():
+            future.exception()
+
+    async def _route(self, method, path, body):
+        """Handle a request, returning (status, response, assembly time)."""
+
+        if path == "/metrics":
+            if method != "GET":
+                raise RequestError(405, "Use GET for /metrics.")
+            return 200, self.metrics.toDict(self._max_queue), None
+
+        if path == "/assemble":
+            if method != "POST":
+                raise RequestError(405, "Use POST for /assemble.")
+            try:
+                request = json.loads(body)
+            except ValueError as e:
+                raise RequestError(400, f"Body is no valid JSON: {e}")
+            _checkRequest(request)
+            return await self._assemble(request)
+
+        raise RequestError(404, f"No such endpoint \"{path}\".")
+
+    async def _readRequest(self, reader):
+        """Read an HTTP request: (method, path, headers, body), or None at
+        the end of the connection."""
+
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, path, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise RequestError(400, "Malformed request line.")
+
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise RequestError(400, "Malformed Content-Length.")
+        if length > MAX_BODY_SIZE:
+            raise RequestError(413, f"Body larger than {MAX_BODY_SIZE} bytes.")
+        body = await reader.readexactly(length)
+
+        return method, path.split("?", 1)[0], headers, body
+
+    async def _handleConnection(self, reader, writer):
+        """Serve the requests of a connection, keeping it open between them."""
+
+        try:
+            while True:
+                start = time.perf_counter()
+                path = None
+                keep_alive = False
+                assembly_time = None
+                try:
+                    request = await self._readRequest(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    status, response, assembly_time = await self._route(method, path, body)
+                except RequestError as e:
+                    status, response = e.status, {"ok": False, "error": str(e)}
+                except asyncio.LimitOverrunError:
+                    status, response = 400, {"ok": False, "error": "Request head too long."}
+
+                data = json.dumps(response).encode()
+                writer.write(f"HTTP/1.1 {status} {_status_texts.get(status, '')}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+                await writer.drain()
+
+                # latencies are of assemble requests only
+                if path == "/assemble":
+                    self.metrics.record(status, time.perf_counter() - start, assembly_time)
+                else:
+                    self.metrics.record(status)
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path=None, host="127.0.0.1", port=8750):
+        """Serve until cancelled, on a Unix socket if a path is given,
+        otherwise on host and port."""
+
+        # stop as cleanly on SIGTERM as on Ctrl-C
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+        self._startPool()
+        try:
+            if socket_path is not None:
+                server = await asyncio.start_unix_server(self._handleConnection, socket_path)
+            else:
+                server = await asyncio.start_server(self._handleConnection, host, port)
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._pool.shutdown(cancel_futures=True)
+            if socket_path is not None and os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+def _timedAssembleRequest(request, timeout=None):
+    """assembleRequest(), also returning the seconds it took. Gives up
+    with a 504 once it has taken timeout seconds."""
+
+    start = time.perf_counter()
+    if timeout is not None:
+        signal.signal(signal.SIGALRM, _jobTimedOut)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        status, response = assembleRequest(request)
+    except JobTimeout:
+        status, response = 504, {"ok": False, "error": f"Assembly took longer than {timeout} s."}
+    finally:
+        if timeout is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return status, response, time.perf_counter() - start
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Local assembly server for the Caltech10 CPU.")
+    argparser.add_argument("--socket", metavar="PATH", help="serve on a Unix socket instead of TCP")
+    argparser.add_argument("--host", default="127.0.0.1", help="address to serve on (default: localhost)")
+    argparser.add_argument("--port", type=int, default=8750)
+    argparser.add_argument("--workers", type=int, default=None,
+                           help="number of worker processes (default: cores)")
+    argparser.add_argument("--timeout", type=float, default=10.0,
+                           help="seconds a request may take before answering 504")
+    argparser.add_argument("--max-queue", type=int, default=64,
+                           help="requests waiting or being assembled before answering 503")
+    args = argparser.parse_args()
+
+    server = AssemblyServer(args.workers, args.timeout, args.max_queue)
+    try:
+        asyncio.run(server.serve(args.socket, args.host, args.port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -0,0 +1,644 @@
+#!/usr/bin/env python3
+
+"""\
+Caltech10 simulator.
+
+Runs the assembler's output (an a.obj listing, a raw binary or Intel HEX
+image, or the words of an in-process AssemblyResult):
+
+    from shass_sim import Simulator, loadImage
+
+    sim = Simulator(loadImage("a.obj"))
+    sim.memory[3] = 0x0D
+    sim.call(0)
+    print(sim.returnLine())     # RETURN  A:E9 F:01 X:00 S:00 P:0000
+
+Every code word is predecoded once into a handler and its operand, through
+a 65536-entry table built from the disassembler's decode table, which
+inverts the opcode tables of shass_instruction.Opcode. The run loop then
+only indexes the predecoded program and calls handlers working on a small
+register list and a byte array holding data memory followed by the I/O
+ports.
+
+Behaviour follows the traces of the external Caltech10 Simulator:
+    - JMP, CALL and the conditional jumps have a delay slot, RTS does not
+    - flags are Z 0x01, S 0x02, V 0x04, C 0x08, U 0x20 and I 0x80
+    - C is the borrow after a subtract, INC and DEC update C like ADD/SUB
+    - CALL pushes the address after the delay slot, high byte first
+    - call() pushes return address 0, and stops at the RTS returning to it
+
+Run as a program, it loads an image, sets memory and either calls the code
+or traces single steps:
+    ./shass_sim.py a.obj --set 3=0D --call 0
+    ./shass_sim.py a.obj --set 0=19 --set 1=E2 --trace 6
+"""
+
+import argparse
+import sys
+from array import array
+
+from shass_instruction import *
+from shass_output import *
+from shass_disasm import *
+from shass_memory import CODE_SIZE, DATA_SIZE
+
+# flag bits of the F register
+FLAG_Z = 0x01
+FLAG_S = 0x02
+FLAG_V = 0x04
+FLAG_C = 0x08
+FLAG_U = 0x20
+FLAG_I = 0x80
+
+# the I/O ports follow data memory in the memory array
+IO_BASE = DATA_SIZE
+
+# Executes at most this many instructions in call(), so a program that
+# never returns does not hang the caller.
+DEFAULT_MAX_STEPS = 100000000
+
+# indexes into the register list (the last one is the call depth)
+REG_A = 0
+REG_F = 1
+REG_X = 2
+REG_S = 3
+REG_DEPTH = 4
+
+# A handler returns None to carry on with the next instruction, or the
+# target of a jump taking effect after the delay slot. These bits mark a
+# target taking effect immediately, and the return from call().
+_IMMEDIATE = 0x10000
+_HALT = 0x20000
+
+# decode table entry kinds, telling how predecoding turns the operand into
+# the handler's argument
+_PLAIN = 0
+_RELATIVE = 1
+_CALL = 2
+
+# Z and S flags of every result byte
+_SZ = [(FLAG_Z if value == 0 else 0) | (FLAG_S if value & 0x80 else 0) for value in range(256)]
+
+# flags kept by arithmetic and by logic/shift instructions
+_KEEP_ARITH = 0xFF & ~(FLAG_Z | FLAG_S | FLAG_V | FLAG_C)
+_KEEP_SHIFT = 0xFF & ~(FLAG_Z | FLAG_S | FLAG_C)
+
+# arithmetic, setting the flags and returning the result byte
+
+def _add(r, a, value, carry):
+    result = a + value + carry
+    r[1] = ((r[1] & _KEEP_ARITH) | _SZ[result & 0xFF] | (FLAG_C if result > 0xFF else 0)
+            | (FLAG_V if (a ^ result) & (value ^ result) & 0x80 else 0))
+    return result & 0xFF
+
+def _sub(r, a, value, borrow):
+    result = a - value - borrow
+    r[1] = ((r[1] & _KEEP_ARITH) | _SZ[result & 0xFF] | (FLAG_C if result < 0 else 0)
+            | (FLAG_V if (a ^ value) & (a ^ result) & 0x80 else 0))
+    return result & 0xFF
+
+def _logic(r, result):
+    r[1] = (r[1] & _KEEP_ARITH) | _SZ[result]
+    return result
+
+def _shift(r, result, carry):
+    r[1] = (r[1] & _KEEP_SHIFT) | _SZ[result] | (FLAG_C if carry else 0)
+    return result
+
+# ALU operations on the accumulator and an operand value
+
+def _aluAdd(r, value):
+    r[0] = _add(r, r[0], value, 0)
+
+def _aluAdc(r, value):
+    r[0] = _add(r, r[0], value, 1 if r[1] & FLAG_C else 0)
+
+def _aluSub(r, value):
+    r[0] = _sub(r, r[0], value, 0)
+
+def _aluSbb(r, value):
+    r[0] = _sub(r, r[0], value, 1 if r[1] & FLAG_C else 0)
+
+def _aluCmp(r, value):
+    _sub(r, r[0], value, 0)
+
+def _aluAnd(r, value):
+    r[0] = _logic(r, r[0] & value)
+
+def _aluOr(r, value):
+    r[0] = _logic(r, r[0] | value)
+
+def _aluXor(r, value):
+    r[0] = _logic(r, r[0] ^ value)
+
+def _aluTst(r, value):
+    _logic(r, r[0] & value)
+
+_alu_operations = {
+    "ADD": _aluAdd,
+    "ADC": _aluAdc,
+    "SUB": _aluSub,
+    "SBB": _aluSbb,
+    "CMP": _aluCmp,
+    "AND": _aluAnd,
+    "OR": _aluOr,
+    "XOR": _aluXor,
+    "TST": _aluTst,
+}
+
+def _aluHandler(operation, mode):
+    """Handler fetching the ALU operand in an addressing mode (the 2 bits
+    above the operand: direct, X indexed, S indexed or immediate)."""
+
+    if mode == 0b00:
+        def handler(r, m, arg):
+            operation(r, m[arg])
+    elif mode == 0b01:
+        def handler(r, m, arg):
+            operation(r, m[(r[2] + arg) & 0xFF])
+    elif mode == 0b10:
+        def handler(r, m, arg):
+            operation(r, m[(r[3] + arg) & 0xFF])
+    else:
+        def handler(r, m, arg):
+            operation(r, arg)
+    return handler
+
+def _stLdHandler(load, bits):
+    """Handler for LD or ST with the 5-bit index pattern (see
+    Operands.sxBits) above the offset."""
+
+    post = bits & 0b10000
+    delta = -1 if bits & 0b01000 else 1
+    reg = REG_X if bits & 0b00100 else REG_S
+    if bits & 0b11 == 0b11:
+        delta = 0
+
+    pre_delta = 0 if post else delta
+    post_delta = delta if post else 0
+
+    if load:
+        def handler(r, m, arg):
+            r[reg] = (r[reg] + pre_delta) & 0xFF
+            r[0] = m[(r[reg] + arg) & 0xFF]
+            r[reg] = (r[reg] + post_delta) & 0xFF
+    else:
+        def handler(r, m, arg):
+            r[reg] = (r[reg] + pre_delta) & 0xFF
+            m[(r[reg] + arg) & 0xFF] = r[0]
+            r[reg] = (r[reg] + post_delta) & 0xFF
+    return handler
+
+# jump conditions on the flags
+_conditions = {
+    "JA": lambda f: not f & FLAG_C and not f & FLAG_Z,
+    "JAE": lambda f: not f & FLAG_C,
+    "JNC": lambda f: not f & FLAG_C,
+    "JB": lambda f: f & FLAG_C,
+    "JC": lambda f: f & FLAG_C,
+    "JBE": lambda f: f & (FLAG_C | FLAG_Z),
+    "JE": lambda f: f & FLAG_Z,
+    "JZ": lambda f: f & FLAG_Z,
+    "JNE": lambda f: not f & FLAG_Z,
+    "JNZ": lambda f: not f & FLAG_Z,
+    "JG": lambda f: not f & FLAG_Z and bool(f & FLAG_S) == bool(f & FLAG_V),
+    "JGE": lambda f: bool(f & FLAG_S) == bool(f & FLAG_V),
+    "JL": lambda f: bool(f & FLAG_S) != bool(f & FLAG_V),
+    "JLE": lambda f: f & FLAG_Z or bool(f & FLAG_S) != bool(f & FLAG_V),
+    "JS": lambda f: f & FLAG_S,
+    "JNS": lambda f: not f & FLAG_S,
+    "JU": lambda f: f & FLAG_U,
+    "JNU": lambda f: not f & FLAG_U,
+    "JV": lambda f: f & FLAG_V,
+    "JNV": lambda f: not f & FLAG_V,
+}
+
+def _jumpHandler(condition):
+    """Handler for a conditional jump, looking the flags up in a table."""
+
+    taken = [bool(condition(f)) for f in range(256)]
+
+    def handler(r, m, arg):
+        if taken[r[1]]:
+            return arg
+    return handler
+
+# instructions with no operand
+
+def _push(r, m, value):
+    r[3] = (r[3] - 1) & 0xFF
+    m[r[3]] = value
+
+def _pop(r, m):
+    value = m[r[3]]
+    r[3] = (r[3] + 1) & 0xFF
+    return value
+
+def _inc(r, m, arg):
+    r[0] = _add(r, r[0], 1, 0)
+
+def _dec(r, m, arg):
+    r[0] = _sub(r, r[0], 1, 0)
+
+def _neg(r, m, arg):
+    r[0] = _sub(r, 0, r[0], 0)
+
+def _not(r, m, arg):
+    r[0] = r[0] ^ 0xFF
+    r[1] = (r[1] & ~(FLAG_Z | FLAG_S)) | _SZ[r[0]]
+
+def _asr(r, m, arg):
+    a = r[0]
+    r[0] = _shift(r, (a >> 1) | (a & 0x80), a & 0x01)
+
+def _lsl(r, m, arg):
+    a = r[0]
+    r[0] = _shift(r, (a << 1) & 0xFF, a & 0x80)
+
+def _lsr(r, m, arg):
+    a = r[0]
+    r[0] = _shift(r, a >> 1, a & 0x01)
+
+def _rlc(r, m, arg):
+    a = r[0]
+    r[0] = _shift(r, ((a << 1) & 0xFF) | (1 if r[1] & FLAG_C else 0), a & 0x80)
+
+def _rol(r, m, arg):
+    a = r[0]
+    r[0] = _shift(r, ((a << 1) & 0xFF) | (a >> 7), a & 0x80)
+
+def _ror(r, m, arg):
+    a = r[0]
+    r[0] = _shift(r, (a >> 1) | ((a & 0x01) << 7), a & 0x01)
+
+def _rrc(r, m, arg):
+    a = r[0]
+    r[0] = _shift(r, (a >> 1) | (0x80 if r[1] & FLAG_C else 0), a & 0x01)
+
+def _flagHandler(set_bits, clear_bits):
+    def handler(r, m, arg):
+        r[1] = (r[1] & ~clear_bits) | set_bits
+    return handler
+
+def _tax(r, m, arg):
+    r[2] = r[0]
+
+def _txa(r, m, arg):
+    r[0] = r[2]
+
+def _inx(r, m, arg):
+    r[2] = (r[2] + 1) & 0xFF
+
+def _dex(r, m, arg):
+    r[2] = (r[2] - 1) & 0xFF
+
+def _tas(r, m, arg):
+    r[3] = r[0]
+
+def _tsa(r, m, arg):
+    r[0] = r[3]
+
+def _ins(r, m, arg):
+    r[3] = (r[3] + 1) & 0xFF
+
+def _des(r, m, arg):
+    r[3] = (r[3] - 1) & 0xFF
+
+def _popf(r, m, arg):
+    r[1] = _pop(r, m)
+
+def _pushf(r, m, arg):
+    _push(r, m, r[1])
+
+def _nop(r, m, arg):
+    pass
+
+def _rts(r, m, arg):
+    low = _pop(r, m)
+    target = ((_pop(r, m) << 8) | low) & (CODE_SIZE - 1)
+    r[4] -= 1
+    if r[4] < 0:
+        return target | _IMMEDIATE | _HALT
+    return target | _IMMEDIATE
+
+_no_operand_handlers = {
+    "ASR": _asr,
+    "DEC": _dec,
+    "INC": _inc,
+    "LSL": _lsl,
+    "LSR": _lsr,
+    "NEG": _neg,
+    "NOT": _not,
+    "RLC": _rlc,
+    "ROL": _rol,
+    "ROR": _ror,
+    "RRC": _rrc,
+    "STI": _flagHandler(FLAG_I, 0),
+    "CLI": _flagHandler(0, FLAG_I),
+    "STU": _flagHandler(FLAG_U, 0),
+    "CLU": _flagHandler(0, FLAG_U),
+    "STC": _flagHandler(FLAG_C, 0),
+    "CLC": _flagHandler(0, FLAG_C),
+    "TAX": _tax,
+    "TXA": _txa,
+    "INX": _inx,
+    "DEX": _dex,
+    "TAS": _tas,
+    "TSA": _tsa,
+    "INS": _ins,
+    "DES": _des,
+    "RTS": _rts,
+    "POPF": _popf,
+    "PUSHF": _pushf,
+    "NOP": _nop,
+}
+
+# instructions with an 8-bit operand, other than immediate ALU and jumps
+
+def _ldi(r, m, arg):
+    r[0] = arg
+
+def _ldd(r, m, arg):
+    r[0] = m[arg]
+
+def _std(r, m, arg):
+    m[arg] = r[0]
+
+def _in(r, m, arg):
+    r[0] = m[IO_BASE + arg]
+
+def _out(r, m, arg):
+    m[IO_BASE + arg] = r[0]
+
+_one_operand_handlers = {
+    "LDI": _ldi,
+    "LDD": _ldd,
+    "STD": _std,
+    "IN": _in,
+    "OUT": _out,
+}
+
+# instructions with a 13-bit address
+
+def _jmp(r, m, arg):
+    return arg
+
+def _call(r, m, arg):
+    target, return_address = arg
+    _push(r, m, return_address >> 8)
+    _push(r, m, return_address & 0xFF)
+    r[4] += 1
+    return target
+
+def _illegal(r, m, arg):
+    word, address = arg
+    raise Exception("Illegal instruction {:04X} at address {:04X}.".format(word, address))
+
+_handler_table = None
+
+def _handler(mnemonic, kind, index, cache):
+    """The handler of an instruction, shared by all its words."""
+
+    key = (mnemonic, index)
+    if key in cache:
+        return cache[key]
+
+    if kind == OPERAND_NONE:
+        handler = _no_operand_handlers[mnemonic]
+    elif kind == OPERAND_RELATIVE:
+        handler = _jumpHandler(_conditions[mnemonic])
+    elif kind == OPERAND_ABSOLUTE:
+        handler = _call if mnemonic == "CALL" else _jmp
+    elif mnemonic in _one_operand_handlers:
+        handler = _one_operand_handlers[mnemonic]
+    elif mnemonic in Opcode.st_ld_codes:
+        bits = int(Operands([index, "0"], {}, {}, 0).sxPattern(), 2)
+        handler = _stLdHandler(mnemonic == "LD", bits)
+    elif kind == OPERAND_IMMEDIATE:
+        # immediate forms of the ALU instructions (ADDI, ...)
+        handler = _aluHandler(_alu_operations[mnemonic[:-1]], 0b11)
+    else:
+        mode = {None: 0b00, "X": 0b01, "S": 0b10}[index]
+        handler = _aluHandler(_alu_operations[mnemonic], mode)
+
+    cache[key] = handler
+    return handler
+
+def handlerTable():
+    """The 65536-entry table from instruction word to a (mnemonic, handler,
+    operand, kind) entry, or None for illegal words. Built on first use
+    from the disassembler's decode table, which inverts the opcode tables
+    of shass_instruction.Opcode."""
+
+    global _handler_table
+    if _handler_table is not None:
+        return _handler_table
+
+    table = [None] * 65536
+    cache = {}
+    for word, entry in enumerate(decodeTable()):
+        if entry is None:
+            continue
+        mnemonic, kind, index, value = entry
+        if kind == OPERAND_RELATIVE:
+            sim_kind = _RELATIVE
+        elif mnemonic == "CALL":
+            sim_kind = _CALL
+        else:
+            sim_kind = _PLAIN
+        table[word] = (mnemonic, _handler(mnemonic, kind, index, cache), value or 0, sim_kind)
+
+    _handler_table = table
+    return table
+
+def predecode(words):
+    """Predecode a code image into a list of (handler, argument) pairs, one
+    for every code address. Relative jump targets and the return address
+    of CALL are resolved here, once."""
+
+    table = handlerTable()
+    program = []
+
+    for address in range(CODE_SIZE):
+        word = words[address] if address < len(words) else 0
+        entry = table[word]
+
+        if entry is None:
+            program.append((_illegal, (word, address)))
+            continue
+
+        mnemonic, handler, operand, kind = entry
+        if kind == _RELATIVE:
+            # the offset is from the next instruction, 8-bit two's complement
+            operand = (address + 1 + (operand ^ 0x80) - 0x80) & (CODE_SIZE - 1)
+        elif kind == _CALL:
+            operand = (operand, (address + 2) & (CODE_SIZE - 1))
+        program.append((handler, operand))
+
+    return program
+
+def loadImage(path, byteorder="little"):
+    """Code words from an output file of the assembler, see
+    shass_output.readImage, as an image from address 0."""
+
+    image, _ = readImage(path, byteorder)
+    if not isinstance(image, dict):
+        return image[:CODE_SIZE]
+
+    words = array("H", bytes(2 * CODE_SIZE))
+    for address, word in image.items():
+        if address < CODE_SIZE:
+            words[address] = word
+    return words
+
+class Simulator:
+    """A Caltech10 CPU running a predecoded code image."""
+
+    def __init__(self, words):
+        # registers A, F, X, S and the call depth, see REG_*
+        self.registers = [0, 0, 0, 0, 0]
+
+        # data memory, followed by the I/O ports at IO_BASE
+        self.memory = bytearray(DATA_SIZE + 256)
+
+        # address of the next instruction, and of the one after it (which
+        # differs after a jump, with the delay slot next)
+        self.pc = 0
+        self._next_pc = 1
+
+        # instructions executed so far
+        self.steps = 0
+
+        self.load(words)
+
+    def load(self, words):
+        """Load and predecode a new code image."""
+
+        self._words = array("H", words[:CODE_SIZE])
+        self._words.extend(bytes(2 * (CODE_SIZE - len(self._words))))
+        self._program = predecode(self._words)
+
+    def reset(self, pc=0):
+        """Clear the registers and continue at pc. Memory is kept."""
+
+        self.registers[:] = [0, 0, 0, 0, 0]
+        self.jump(pc)
+
+    def jump(self, pc):
+        """Continue execution at pc."""
+
+        self.pc = pc & (CODE_SIZE - 1)
+        self._next_pc = (self.pc + 1) & (CODE_SIZE - 1)
+
+    def run(self, max_steps):
+        """Execute up to max_steps instructions. Stops early when call()'s
+        return is reached. Returns whether it was reached."""
+
+        program = self._program
+        r = self.registers
+        m = self.memory
+        pc = self.pc
+        next_pc = self._next_pc
+        mask = CODE_SIZE - 1
+        halted = False
+
+        steps = 0
+        while steps < max_steps:
+            handler, arg = program[pc]
+            steps += 1
+            target = handler(r, m, arg)
+            if target is None:
+                pc = next_pc
+                next_pc = (next_pc + 1) & mask
+            elif target < CODE_SIZE:
+                # the delay slot runs first
+                pc = next_pc
+                next_pc = target
+            else:
+                pc = target & mask
+                next_pc = (pc + 1) & mask
+                if target & _HALT:
+                    halted = True
+                    break
+
+        self.pc = pc
+        self._next_pc = next_pc
+        self.steps += steps
+        return halted
+
+    def step(self):
+        """Execute a single instruction."""
+
+        return self.run(1)
+
+    def call(self, start=0, max_steps=DEFAULT_MAX_STEPS):
+        """Call the code at start, like the simulator's S command, running
+        until it returns. Raises an Exception if it does not return within
+        max_steps instructions."""
+
+        r = self.registers
+        r[REG_DEPTH] = 0
+        _push(r, self.memory, 0)
+        _push(r, self.memory, 0)
+        self.jump(start)
+
+        if not self.run(max_steps):
+            raise Exception(f"Program did not return within {max_steps} instructions.")
+
+    def _registerText(self):
+        r = self.registers
+        return "A:{:02X} F:{:02X} X:{:02X} S:{:02X} P:{:04X}".format(r[0], r[1], r[2], r[3], self.pc)
+
+    def traceLine(self):
+        """The state as the simulator's T command prints it."""
+
+        return "TRACE   {} / {:04X}".format(self._registerText(), self._words[self.pc])
+
+    def returnLine(self):
+        """The state as the simulator's S command prints it on return."""
+
+        return "RETURN  " + self._registerText()
+
+def _parseAssignment(text):
+    """Parse an ADDRESS=VALUE memory assignment, both in hex."""
+
+    address, _, value = text.partition("=")
+    return int(address, 16) & (DATA_SIZE - 1), int(value, 16) & 0xFF
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Caltech10 simulator.")
+    argparser.add_argument("image", nargs="?", default="a.obj",
+                           help="listing, .bin or .hex file to run (default: a.obj)")
+    argparser.add_argument("--endian", choices=["little", "big"], default="little",
+                           help="byte order of .bin and .hex images")
+    argparser.add_argument("--set", metavar="ADDR=VALUE", action="append", default=[],
+                           type=_parseAssignment, help="set a data memory byte (hex) before running")
+    group = argparser.add_mutually_exclusive_group()
+    group.add_argument("--call", metavar="ADDR", type=lambda text: int(text, 16),
+                       help="call the code at ADDR (hex) and print the state on return")
+    group.add_argument("--trace", metavar="COUNT", type=int,
+                       help="execute COUNT instructions from address 0, printing the state after each")
+    argparser.add_argument("--max-steps", type=int, default=DEFAULT_MAX_STEPS,
+                           help="instructions to execute at most in --call")
+    args = argparser.parse_args()
+
+    try:
+        sim = Simulator(loadImage(args.image, args.endian))
+    except OSError as e:
+        print(f"File \"{args.image}\" could not be read: {e.strerror}.")
+        sys.exit(1)
+
+    for address, value in args.set:
+        sim.memory[address] = value
+
+    try:
+        if args.trace is not None:
+            for _ in range(args.trace):
+                sim.step()
+                print(sim.traceLine())
+        else:
+            sim.call(args.call or 0, args.max_steps)
+            print(sim.returnLine())
+    except Exception as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,189 @@
+"""\
+Instrumentation of assembly runs, for --stats.
+
+An AssemblyStats passed to the Parser (and to writeOutputs) collects the
+wall time of every phase, the throughput, the symbol table sizes and how
+often each mnemonic occurs:
+
+    from shass_api import assemble
+    from shass_stats import AssemblyStats
+
+    stats = AssemblyStats()
+    result = assemble(source, stats=stats)
+    print(stats.format())
+
+ProfileCapture additionally runs cProfile and/or tracemalloc around a run.
+"""
+
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from collections import Counter
+
+class _PhaseTimer:
+    """Adds the time spent in a with block to a phase."""
+
+    def __init__(self, stats, phase):
+        self._stats = stats
+        self._phase = phase
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self._stats.addTime(self._phase, time.perf_counter() - self._start)
+
+class AssemblyStats:
+    """Timings and counts collected while assembling."""
+
+    # phases in report order, with the phase each one is part of
+    phases = {
+        "first pass": None,
+        "include handling": "first pass",
+        "jump relaxation": None,
+        "memory check": None,
+        "second pass": None,
+        "single pass": None,
+        "stream": None,
+        "encoding": "passes",
+        "output writing": None,
+    }
+
+    def __init__(self):
+        # wall time per phase, for the phases that ran
+        self.times = {}
+
+        # source files read, their lines and non-empty lines (statements)
+        self.files = 0
+        self.source_lines = 0
+        self.statements = 0
+
+        # sizes of the symbol tables
+        self.code_symbols = 0
+        self.data_symbols = 0
+
+        # instructions per mnemonic
+        self.mnemonics = Counter()
+
+        # bytes written per output format
+        self.output_bytes = {}
+
+        self._start = time.perf_counter()
+        self.wall_time = None
+
+    def timer(self, phase):
+        """Context manager timing a phase."""
+        return _PhaseTimer(self, phase)
+
+    def addTime(self, phase, seconds):
+        self.times[phase] = self.times.get(phase, 0.0) + seconds
+
+    def addFile(self, source_lines, statements, mnemonics=()):
+        """Record a source file that was read, with the mnemonics of its
+        instructions."""
+
+        self.files += 1
+        self.source_lines += source_lines
+        self.statements += statements
+        self.mnemonics.update(mnemonics)
+
+    def setSymbols(self, code_symbols, data_symbols):
+        self.code_symbols = len(code_symbols)
+        self.data_symbols = len(data_symbols)
+
+    def addOutput(self, fmt, size):
+        self.output_bytes[fmt] = self.output_bytes.get(fmt, 0) + size
+
+    def finish(self):
+        """Stop the wall clock of the whole run."""
+        self.wall_time = time.perf_counter() - self._start
+
+    def _wallTime(self):
+        return self.wall_time if self.wall_time is not None else time.perf_counter() - self._start
+
+    def linesPerSecond(self):
+        """Source lines assembled per second of wall time."""
+
+        wall_time = self._wallTime()
+        return self.source_lines / wall_time if wall_time > 0 else 0.0
+
+    def toDict(self):
+        """The statistics as a plain dict, e.g. for JSON output."""
+
+        return {"wall_time": self._wallTime(), "phases": dict(self.times),
+                "files": self.files, "source_lines": self.source_lines,
+                "statements": self.statements, "lines_per_second": self.linesPerSecond(),
+                "code_symbols": self.code_symbols, "data_symbols": self.data_symbols,
+                "instructions": sum(self.mnemonics.values()), "mnemonics": dict(self.mnemonics),
+                "output_bytes": dict(self.output_bytes)}
+
+    def format(self):
+        """The statistics as a human readable report."""
+
+        lines = [f"wall time:         {self._wallTime() * 1000:10.1f} ms"]
+        for phase, parent in self.phases.items():
+            if phase in self.times:
+                # phases that are part of another one are indented
+                name = phase + ":" if parent is None else "  " + phase + ":"
+                lines.append(f"{name:<19}{self.times[phase] * 1000:10.1f} ms")
+
+        lines.append(f"source files:      {self.files:10}")
+        lines.append(f"source lines:      {self.source_lines:10} ({self.statements} statements)")
+        lines.append(f"throughput:        {self.linesPerSecond():10.0f} lines/s")
+        lines.append(f"code symbols:      {self.code_symbols:10}")
+        lines.append(f"data symbols:      {self.data_symbols:10}")
+        lines.append(f"instructions:      {sum(self.mnemonics.values()):10}")
+        for fmt, size in self.output_bytes.items():
+            lines.append(f"{fmt + ' output:':<19}{size:10} bytes")
+
+        lines.append("mnemonics:")
+        for mnemonic, count in self.mnemonics.most_common():
+            lines.append(f"    {mnemonic:<8}{count:10}")
+        return "\n".join(lines)
+
+class ProfileCapture:
+    """Runs cProfile (dumping to profile_path) and/or tracemalloc around a
+    with block, and reports on both afterwards."""
+
+    def __init__(self, profile_path=None, trace_memory=False):
+        self._profile_path = profile_path
+        self._trace_memory = trace_memory
+        self._profiler = None
+        self._snapshot = None
+        self.memory_peak = None
+
+    def __enter__(self):
+        if self._trace_memory:
+            tracemalloc.start()
+        if self._profile_path is not None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self._profile_path)
+        if self._trace_memory:
+            self._snapshot = tracemalloc.take_snapshot()
+            _, self.memory_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    def format(self, top=15):
+        """Report the top functions by cumulative time and the top
+        allocation sites."""
+
+        lines = []
+        if self._profiler is not None:
+            out = io.StringIO()
+            pstats.Stats(self._profiler, stream=out).sort_stats("cumulative").print_stats(top)
+            lines.append(f"profile written to \"{self._profile_path}\"")
+            lines.append(out.getvalue().strip())
+
+        if self._snapshot is not None:
+            lines.append(f"memory peak:       {self.memory_peak / 2**20:10.1f} MiB")
+            for stat in self._snapshot.statistics("lineno")[:top]:
+                lines.append(f"    {stat}")
+        return "\n".join(lines)
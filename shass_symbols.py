@@ -0,0 +1,173 @@
+"""\
+Symbol maps: the labels and variables of a program, with their sizes and
+where they are defined, sorted by address.
+
+Written with -f symbols (a.sym), as one line per symbol, here for
+Examples/GCD/gcd.asm assembled in its directory:
+
+    ; shass-asm symbols 1
+    0000 code Zero 7 14 gcd.asm
+    0007 code Start 6 24 gcd.asm
+    000D code Swap 11 32 gcd.asm
+    0018 code End 1 47 gcd.asm
+    0019 code EndN 1 49 gcd.asm
+    0000 data a 1 55 gcd.asm
+    0001 data b 1 56 gcd.asm
+
+that is the address (hex), code or data, the name, the size in words or
+bytes, and the line and file of the definition (line 0 where it is not
+known, as for linked programs). Code symbols come first, then data
+symbols, each sorted by address, so tools can load the file and look
+addresses up by binary search. The first three fields are those of the
+symbol files shass_disasm.py reads.
+
+The size of a label is the code up to the next label or gap in the code,
+that of a variable its declared length.
+"""
+
+import bisect
+
+SYMBOLS_HEADER = "; shass-asm symbols 1"
+
+# the segments, in file order
+SEGMENTS = ("code", "data")
+
+class Symbol:
+    """A label or variable."""
+
+    __slots__ = ("name", "segment", "address", "size", "file", "line")
+
+    def __init__(self, name, segment, address, size, file, line):
+        self.name = name
+
+        # "code" or "data"
+        self.segment = segment
+
+        self.address = address
+        self.size = size
+
+        # where it is defined, None and 0 if not known
+        self.file = file
+        self.line = line
+
+    def __repr__(self):
+        return f"Symbol({self.name!r}, {self.segment!r}, {self.address}, {self.size})"
+
+class SymbolMap:
+    """The symbols of a program, indexed by address and by name."""
+
+    def __init__(self, symbols):
+        # per segment: the symbols sorted by address, and their addresses
+        self._symbols = {}
+        self._addresses = {}
+        for segment in SEGMENTS:
+            self._symbols[segment] = sorted((symbol for symbol in symbols if symbol.segment == segment),
+                                            key=lambda symbol: (symbol.address, symbol.name))
+            self._addresses[segment] = [symbol.address for symbol in self._symbols[segment]]
+
+        # (segment, name) -> Symbol, as a label and a variable may share a name
+        self._names = {(symbol.segment, symbol.name): symbol for symbol in symbols}
+
+    def symbols(self, segment=None):
+        """The symbols of a segment (or all of them), sorted by address."""
+
+        if segment is not None:
+            return list(self._symbols[segment])
+        return [symbol for segment in SEGMENTS for symbol in self._symbols[segment]]
+
+    def find(self, name, segment=None):
+        """The symbol of a name, the label before the variable if no segment
+        is given, or None."""
+
+        for segment in (SEGMENTS if segment is None else (segment,)):
+            symbol = self._names.get((segment, name))
+            if symbol is not None:
+                return symbol
+        return None
+
+    def lookup(self, address, segment="code"):
+        """The symbol an address is in: the one at the highest address not
+        above it whose size covers it, or one right at the address. None
+        if there is no such symbol."""
+
+        addresses = self._addresses[segment]
+        end = bisect.bisect_right(addresses, address)
+        if end == 0:
+            return None
+        start = bisect.bisect_left(addresses, addresses[end - 1])
+
+        # of several symbols at one address, the first covering it
+        for symbol in self._symbols[segment][start:end]:
+            if address < symbol.address + symbol.size:
+                return symbol
+        symbol = self._symbols[segment][start]
+        return symbol if symbol.address == address else None
+
+    def format(self):
+        """The text of the symbol file."""
+
+        lines = [SYMBOLS_HEADER]
+        for symbol in self.symbols():
+            lines.append(f"{symbol.address:04X} {symbol.segment} {symbol.name} {symbol.size} "
+                         f"{symbol.line} {symbol.file or '-'}")
+        return "\n".join(lines) + "\n"
+
+    def parse(text):
+        """The SymbolMap of the text of a symbol file."""
+
+        symbols = []
+        for line in text.splitlines():
+            fields = line.split(None, 5)
+            if not fields or fields[0].startswith(";"):
+                continue
+            if len(fields) < 3 or fields[1] not in SEGMENTS:
+                raise Exception(f"Invalid symbol line \"{line}\".")
+
+            size = int(fields[3]) if len(fields) > 3 else 0
+            line_num = int(fields[4]) if len(fields) > 4 else 0
+            file = fields[5] if len(fields) > 5 and fields[5] != "-" else None
+            symbols.append(Symbol(fields[2], fields[1], int(fields[0], 16), size, file, line_num))
+        return SymbolMap(symbols)
+
+    def read(path):
+        """Read a symbol file."""
+
+        with open(path, "r") as f:
+            return SymbolMap.parse(f.read())
+
+def codeSizes(code_symbols, ranges):
+    """name -> size of labels: the words up to the next label or the end of
+    the code range they are in, 0 outside of the code."""
+
+    addresses = sorted(set(code_symbols.values()))
+    starts = [start for start, _ in ranges]
+
+    sizes = {}
+    for name, address in code_symbols.items():
+        index = bisect.bisect_right(starts, address) - 1
+        if index < 0 or address >= ranges[index][1]:
+            sizes[name] = 0
+            continue
+
+        following = bisect.bisect_right(addresses, address)
+        end = ranges[index][1]
+        if following < len(addresses):
+            end = min(end, addresses[following])
+        sizes[name] = end - address
+    return sizes
+
+def buildSymbolMap(code_symbols, data_symbols, ranges, data_sizes, origins=None):
+    """The SymbolMap of symbol tables (name -> address), the (start, end)
+    ranges holding code, and the sizes of the variables. origins maps
+    (segment, name) to the (file, line) defining a symbol."""
+
+    origins = origins or {}
+    sizes = codeSizes(code_symbols, ranges)
+
+    symbols = []
+    for name, address in code_symbols.items():
+        symbols.append(Symbol(name, "code", address, sizes[name], *origins.get(("code", name), (None, 0))))
+    for name, address in data_symbols.items():
+        symbols.append(Symbol(name, "data", address, data_sizes.get(name, 0),
+                              *origins.get(("data", name), (None, 0))))
+    return SymbolMap(symbols)
@@ -0,0 +1,162 @@
+"""\
+File watching for --watch, which reassembles whenever the entry file or one
+of its includes changes:
+
+    ./shass_main.py main.asm --watch
+
+The process stays alive between builds, keeping the opcode tables, the
+IncludeGraph with the tokens of every file and the SourceCache with their
+code. A save re-reads and re-tokenizes only the changed file, and the code
+of every other file is reused while it sits at the same addresses with the
+same symbol values.
+
+Changes are picked up with inotify (through ctypes) on Linux, or by polling
+the modification times of the files elsewhere.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# inotify events after which a file has new contents: written and closed,
+# replaced by a rename (as many editors save) or deleted
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_DELETE = 0x00000200
+_IN_EVENTS = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_DELETE
+
+# header of an inotify event: watch descriptor, mask, cookie, name length
+_event_header = struct.Struct("iIII")
+
+# how long to keep collecting events after the first one, so the several
+# events of a single save trigger a single build
+SETTLE_TIME = 0.005
+
+class InotifyWatcher:
+    """Waits for changes to a set of files with inotify."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+        # directories are watched rather than files, to see files replaced
+        # by a rename: watch descriptor -> directory, and back
+        self._directories = {}
+        self._descriptors = {}
+
+        # real paths of the watched files
+        self._paths = set()
+
+    def watch(self, paths):
+        """Set the files to watch."""
+
+        self._paths = set(os.path.realpath(path) for path in paths)
+        directories = set(os.path.dirname(path) for path in self._paths)
+
+        for directory in directories - set(self._descriptors):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_EVENTS)
+            if wd >= 0:
+                self._directories[wd] = directory
+                self._descriptors[directory] = wd
+
+        for directory in set(self._descriptors) - directories:
+            wd = self._descriptors.pop(directory)
+            del self._directories[wd]
+            self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _changes(self, data):
+        """Watched files named in a buffer of events."""
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _event_header.unpack_from(data, offset)
+            offset += _event_header.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            directory = self._directories.get(wd)
+            if directory is not None and name:
+                path = os.path.join(directory, os.fsdecode(name))
+                if path in self._paths:
+                    changed.add(path)
+        return changed
+
+    def wait(self):
+        """Block until watched files change, returning their real paths."""
+
+        changed = set()
+        timeout = None
+        while True:
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+            if not ready:
+                if changed:
+                    return changed
+                continue
+            changed |= self._changes(os.read(self._fd, 65536))
+            if changed:
+                timeout = SETTLE_TIME
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingWatcher:
+    """Waits for changes to a set of files by polling their modification
+    times, where inotify is not available."""
+
+    def __init__(self, interval=0.1):
+        self._interval = interval
+
+        # real path -> (modification time, size), or None if missing
+        self._states = {}
+
+    def _state(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def watch(self, paths):
+        """Set the files to watch."""
+
+        states = {}
+        for path in paths:
+            path = os.path.realpath(path)
+            states[path] = self._states[path] if path in self._states else self._state(path)
+        self._states = states
+
+    def wait(self):
+        """Block until watched files change, returning their real paths."""
+
+        while True:
+            time.sleep(self._interval)
+            changed = set()
+            for path, state in self._states.items():
+                current = self._state(path)
+                if current != state:
+                    self._states[path] = current
+                    changed.add(path)
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+def makeWatcher(polling=False):
+    """An InotifyWatcher if inotify is available (and polling is not asked
+    for), otherwise a PollingWatcher."""
+
+    if not polling:
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            # no libc or no inotify_init1 in it
+            pass
+    return PollingWatcher()
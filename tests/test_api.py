@@ -0,0 +1,19 @@
+from pathlib import Path
+
+import pytest
+
+from shass_api import *
+from shass_error import *
+
+def test_missing_entry_file_is_not_found():
+    with pytest.raises(FileNotFoundError, match="nonexistent.asm"):
+        assemble(Path("/nonexistent.asm"))
+
+def test_missing_include_is_an_assembler_error(tmp_path):
+    entry = tmp_path / "main.asm"
+    entry.write_text(".include \"missing.asm\"\n")
+
+    with pytest.raises(AssemblerError) as error:
+        assemble(entry)
+    assert error.value.line_num == 1
+    assert "missing.asm" in error.value.message
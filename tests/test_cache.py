@@ -0,0 +1,71 @@
+from shass_api import *
+from shass_cache import *
+from shass_parser import *
+
+_main = ".dseg\ncount 1\n.cseg\nStart\n  LDD count\n  CALL Sub\n  NOP\n.include lib.asm\nEnd\n  JMP Start\n  NOP\n"
+_lib = "Sub\n  INC\n  STD count\n  JNZ Sub\n  NOP\n  RTS\n"
+
+def _write(tmp_path, lib):
+    (tmp_path / "main.asm").write_text(_main)
+    (tmp_path / "lib.asm").write_text(lib)
+
+def _assemble(tmp_path, monkeypatch, cache=None):
+    """Assemble with a cache (closed afterwards unless given), returning
+    the result and the number of lines the first pass handled."""
+
+    handled = []
+    makeSourceLine = Parser._makeSourceLine
+    monkeypatch.setattr(Parser, "_makeSourceLine",
+                        lambda self, filename, record: handled.append(record) or makeSourceLine(self, filename, record))
+
+    own_cache = cache is None
+    if own_cache:
+        cache = SourceCache(str(tmp_path / "cache"))
+    try:
+        result = assembleFile(tmp_path / "main.asm", cache=cache)
+    finally:
+        if own_cache:
+            cache.close()
+        monkeypatch.undo()
+    return result, len(handled)
+
+def test_cached_files_skip_the_first_pass(tmp_path, monkeypatch):
+    _write(tmp_path, _lib)
+    cold, cold_lines = _assemble(tmp_path, monkeypatch)
+    warm, warm_lines = _assemble(tmp_path, monkeypatch)
+
+    assert cold_lines == 17
+    # only the .include line is handled again
+    assert warm_lines == 1
+    assert warm.words == cold.words
+    assert warm.listing == cold.listing
+    assert warm.code_symbols == cold.code_symbols
+
+def test_edited_files_are_parsed_again(tmp_path, monkeypatch):
+    _write(tmp_path, _lib)
+    _assemble(tmp_path, monkeypatch)
+
+    # moves the labels after it, and the code using them
+    _write(tmp_path, "  NOP\n" + _lib)
+    edited, edited_lines = _assemble(tmp_path, monkeypatch)
+
+    assert edited_lines > 1
+    fresh = assembleFile(tmp_path / "main.asm")
+    assert edited.words == fresh.words
+    assert edited.listing == fresh.listing
+    assert edited.code_symbols["End"] == fresh.code_symbols["End"] == 9
+
+def test_memory_cache_never_touches_the_disk(tmp_path, monkeypatch):
+    _write(tmp_path, _lib)
+    _assemble(tmp_path, monkeypatch)
+    entries = {path.name: path.stat().st_mtime_ns for path in (tmp_path / "cache").iterdir()}
+
+    cache = SourceCache(str(tmp_path / "cache"), persistent=False)
+    _, first_lines = _assemble(tmp_path, monkeypatch, cache)
+    _, second_lines = _assemble(tmp_path, monkeypatch, cache)
+    cache.close()
+
+    # the entries on disk are not read, but those in memory are reused
+    assert first_lines == 17
+    assert second_lines == 1
+    assert {path.name: path.stat().st_mtime_ns for path in (tmp_path / "cache").iterdir()} == entries
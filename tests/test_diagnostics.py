@@ -0,0 +1,31 @@
+import pytest
+
+from shass_api import *
+from shass_error import *
+from shass_parser import *
+
+class _Listing:
+    def __init__(self):
+        self.lines = []
+
+    def writeLine(self, line):
+        self.lines.append(line)
+
+def test_included_errors_sort_where_included():
+    files = {"inc.asm": ".cseg\n  NOP\n  BAD1\n"}
+    source = ".cseg\n  BAD0\n.include inc.asm\n  BAD2\n.org 1\n  NOP\n"
+
+    with pytest.raises(AssemblerError) as error:
+        assemble(source, files, recover=True)
+    assert [(d.file, d.line_num) for d in error.value.diagnostics] == [
+        ("<string>", 2), ("inc.asm", 3), ("<string>", 4), ("<string>", 6)]
+
+@pytest.mark.parametrize("source", [".cseg\n.org $1FFF\n  NOP\n  NOP\n  NOP\n",
+                                    ".cseg\n  NOP\n.org 0\n  INC\n  NOP\n"])
+def test_stream_stops_at_a_memory_error(source):
+    listing = _Listing()
+    parser = Parser("<stdin>", recover=True)
+
+    with pytest.raises(AssemblerError):
+        parser.stream_parse(source.splitlines(keepends=True), listing)
+    assert len(listing.lines) == 1
@@ -0,0 +1,56 @@
+import pytest
+
+from shass_api import *
+from shass_error import *
+from shass_expr import *
+
+_code = {"Start": 16, "End": 24}
+_data = {"count": 3}
+_constants = {"SIZE": (4, 0), "Entry": (16, 1)}
+
+@pytest.mark.parametrize("text, value, weight", [
+    ("12", 12, 0),
+    ("$1F", 31, 0),
+    ("0b101", 5, 0),
+    ("count+1", 4, 0),
+    ("SIZE*2", 8, 0),
+    ("Start", 16, 1),
+    ("Start+SIZE", 20, 1),
+    ("Entry", 16, 1),
+    (".IP+2", 42, 1),
+    ("End-Start", 8, 0),
+    ("End-.IP", -16, 0),
+    ("-Start", -16, -1),
+    ("Start+End", 40, 2),
+    ("HIGH(Start*32)", 2, 0),
+    ("LOW(End)", 24, 0),
+])
+def test_code_addresses_weigh_one(text, value, weight):
+    assert compileExpression(text).evaluate(_code, _data, _constants, 40) == (value, weight)
+
+def test_expressions_without_names_are_folded():
+    expression = compileExpression("(2+3)*$10")
+    assert expression.value == 80
+    assert expression.names == []
+    assert compileExpression("End-Start+count").names == ["End", "Start", "count"]
+
+@pytest.mark.parametrize("text", ["Start+", "(Start", "Start,End", ""])
+def test_syntax_errors(text):
+    with pytest.raises(OperandError):
+        compileExpression(text)
+
+@pytest.mark.parametrize("source, plain", [
+    # weight 1: an offset from the next instruction
+    (".cseg\n  NOP\nLoop\n  JZ Loop+1\n", ".cseg\n  NOP\n  JZ 0\n"),
+    (".cseg\n  JZ .IP+2\n", ".cseg\n  JZ 1\n"),
+    # weight 0: a plain number, even if made of labels
+    (".cseg\nA\n  NOP\nB\n  LDI B-A\n", ".cseg\n  NOP\n  LDI 1\n"),
+    # absolute operands take the address itself
+    (".cseg\n  JMP .IP+2\n", ".cseg\n  JMP 2\n"),
+])
+def test_weights_decide_what_operands_mean(source, plain):
+    assert assemble(source).words == assemble(plain).words
+
+def test_sums_of_labels_are_rejected():
+    with pytest.raises(AssemblerError, match="Invalid argument given"):
+        assemble(".cseg\nA\n  NOP\n  JMP A+A\n")
@@ -0,0 +1,12 @@
+import pytest
+
+from shass_api import *
+from shass_gen import *
+
+@pytest.mark.parametrize("label_density", [0.005, 0.02, 0.5])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_generated_programs_assemble(tmp_path, label_density, seed):
+    entry = generateProgram(tmp_path, 10000, seed=seed, label_density=label_density)
+
+    result = assembleFile(entry, overlap=True)
+    assert not result.diagnostics
@@ -0,0 +1,50 @@
+import pytest
+
+from shass_api import *
+from shass_error import *
+from shass_include import *
+
+_lib = "Twice\n  INC\n.include util.asm\n  RTS\n"
+_util = "  NOP\n  DEC\n"
+
+def _written(tmp_path):
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "main.asm").write_text(".cseg\n  CALL Twice\n.include lib/lib.asm\n  JMP Twice\n  NOP\n")
+    # next to the file including it
+    (tmp_path / "lib" / "lib.asm").write_text(_lib)
+    (tmp_path / "lib" / "util.asm").write_text(_util)
+
+def test_nested_includes_match_the_written_out_program(tmp_path):
+    _written(tmp_path)
+    written_out = ".cseg\n  CALL Twice\nTwice\n  INC\n  NOP\n  DEC\n  RTS\n  JMP Twice\n  NOP\n"
+
+    assert assembleFile(tmp_path / "main.asm").words == assemble(written_out).words
+
+def test_files_are_read_once(tmp_path):
+    reads = []
+    files = {"lib.asm": "  INC\n.include util.asm\n", "util.asm": _util}
+    includes = IncludeGraph(source_reader=lambda name: reads.append(name) or files.get(name), read_disk=False)
+
+    source = ".cseg\n.include util.asm\n.include lib.asm\n.include util.asm\n"
+    first = assemble(source, includes=includes)
+    second = assemble(".cseg\n.include lib.asm\n", includes=includes)
+
+    assert sorted(reads) == ["lib.asm", "util.asm"]
+    assert sorted(source.path for source in includes.files()) == ["<string>", "lib.asm", "util.asm"]
+    assert first.words == assemble(".cseg\n" + _util + "  INC\n" + _util + _util).words
+    assert second.words == assemble(".cseg\n  INC\n" + _util).words
+
+def test_include_cycles_are_found_up_front(tmp_path):
+    (tmp_path / "main.asm").write_text(".cseg\n.include a.asm\n")
+    (tmp_path / "a.asm").write_text("  NOP\n.include b.asm\n")
+    (tmp_path / "b.asm").write_text("  INC\n.include a.asm\n")
+
+    cycles = IncludeGraph().build(str(tmp_path / "main.asm"))
+    assert [[path.rsplit("/", 1)[-1] for path in cycle] for cycle in cycles] == [["a.asm", "b.asm", "a.asm"]]
+
+    with pytest.raises(AssemblerError, match="Include cycle"):
+        assembleFile(tmp_path / "main.asm")
+
+def test_missing_includes_are_reported():
+    with pytest.raises(AssemblerError, match="does not exist"):
+        assemble(".cseg\n.include none.asm\n", {})
@@ -0,0 +1,47 @@
+import pytest
+
+from shass_api import *
+from shass_error import *
+from shass_link import *
+from shass_object import *
+
+_main = (".global Start count\n.extern Sub table\n.dseg\ncount 1\n.cseg\n"
+         "Start\n  LDD count\n  CALL Sub\n  NOP\n  LDI table\n  JZ Start\n  NOP\n  JMP Sub\n  NOP\n")
+_lib = (".global Sub table\n.extern count\n.dseg\ntable 4\n.cseg\n"
+        "Sub\n  INC\n  STD count\n  ADD X table\n  JNZ Sub\n  NOP\n  RTS\n")
+
+def _linked(sources, code_base=0):
+    modules = []
+    for name, source in sources:
+        module = assemble(source, filename=name, relocatable=True).module
+        # as written to and read from the object file
+        modules.append(ObjectModule.fromDict(module.toDict()))
+    return Linker(modules, code_base).link()
+
+def test_linked_modules_match_the_whole_program():
+    linked = _linked([("main.asm", _main), ("lib.asm", _lib)])
+    whole = assemble(_main + ".include lib.asm\n", {"lib.asm": _lib})
+
+    assert linked.words == whole.words
+    assert linked.ranges == whole.ranges
+    assert linked.code_symbols == whole.code_symbols
+    assert linked.data_symbols == whole.data_symbols
+
+def test_fixed_code_stays_put():
+    fixed = ".global Far\n.cseg\n.org $100\nFar\n  JZ Far\n  NOP\n  RTS\n"
+    main = ".extern Far\n.cseg\n  CALL Far\n  NOP\n  JMP Far\n  NOP\n"
+    linked = _linked([("main.asm", main), ("fixed.asm", fixed)])
+    whole = assemble(main + ".include fixed.asm\n", {"fixed.asm": fixed})
+
+    assert linked.words == whole.words
+    assert linked.ranges == whole.ranges == [(0, 4), (0x100, 0x103)]
+
+def test_code_base_moves_relocatable_code():
+    linked = _linked([("main.asm", _main), ("lib.asm", _lib)], code_base=0x40)
+
+    assert linked.code_symbols["Start"] == 0x40
+    assert linked.ranges[0][0] == 0x40
+
+def test_unresolved_imports_are_errors():
+    with pytest.raises(AssemblerError, match="not exported by any module"):
+        _linked([("main.asm", _main)])
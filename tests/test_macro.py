@@ -0,0 +1,42 @@
+import pytest
+
+from shass_api import *
+from shass_error import *
+
+def test_rept_count_is_bounded():
+    with pytest.raises(AssemblerError, match="Cannot repeat more than 8192 times"):
+        assemble(".rept 1000000\n        NOP\n.endr\n")
+
+def test_rept_stops_past_the_code_space():
+    # would be 64 million lines if expanded in full
+    with pytest.raises(AssemblerError, match="does not fit the code space") as error:
+        assemble(".rept 8000\n.rept 8000\n        NOP\n.endr\n.endr\n", recover=True)
+    assert len(error.value.diagnostics) == 1
+
+_macro = ".macro ENTRY value\n        LDI value\n        STD table\n.endm\n.dseg\ntable 1\n.cseg\n"
+
+def test_rept_gives_the_lines_written_out():
+    repeated = assemble(_macro + ".rept 3\n        ENTRY 5\n.rept 2\n        NOP\n.endr\n.endr\n")
+    written = assemble(_macro + ("        LDI 5\n        STD table\n        NOP\n        NOP\n" * 3))
+
+    assert repeated.words == written.words
+
+def test_rept_count_is_a_constant_expression():
+    result = assemble(".equ N 2\n.cseg\n.rept N*2\n        INC\n.endr\n")
+    assert result.ranges == [(0, 4)]
+
+def test_macro_arguments_replace_whole_words():
+    result = assemble(".macro LOAD value\n        LDI value\n        LDI value1\n.endm\n"
+                      ".equ value1 9\n.cseg\n        LOAD 3\n        LOAD 4\n")
+    written = assemble(".equ value1 9\n.cseg\n        LDI 3\n        LDI value1\n        LDI 4\n        LDI value1\n")
+
+    assert result.words == written.words
+
+def test_expansion_errors_are_reported_at_the_invocation():
+    with pytest.raises(AssemblerError) as error:
+        assemble(_macro + "        NOP\n        ENTRY 300\n")
+    assert error.value.line_num == 9
+
+def test_macro_arguments_are_counted():
+    with pytest.raises(AssemblerError, match="takes 1 argument, 2 given"):
+        assemble(_macro + "        ENTRY 1 2\n")
@@ -0,0 +1,32 @@
+import os
+import stat
+
+from shass_output import *
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def test_new_outputs_follow_the_umask(tmp_path):
+    umask = os.umask(0o022)
+    try:
+        writeAtomic(tmp_path / "a.obj", "listing")
+        os.umask(0o027)
+        writeAtomic(tmp_path / "b.obj", "listing")
+    finally:
+        os.umask(umask)
+
+    assert _mode(tmp_path / "a.obj") == 0o644
+    assert _mode(tmp_path / "b.obj") == 0o640
+
+def test_replaced_outputs_keep_their_mode(tmp_path):
+    path = tmp_path / "a.bin"
+    path.write_bytes(b"old")
+    os.chmod(path, 0o604)
+
+    writeAtomic(path, b"new")
+    assert path.read_bytes() == b"new"
+    assert _mode(path) == 0o604
+
+def test_no_temporary_file_is_left(tmp_path):
+    writeAtomic(tmp_path / "a.hex", "data")
+    assert sorted(os.listdir(tmp_path)) == ["a.hex"]
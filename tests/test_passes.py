@@ -0,0 +1,34 @@
+import pytest
+
+from shass_api import *
+from shass_error import *
+
+_sources = [
+    # forward and backward references to labels, variables and constants
+    ".dseg\nfoo 1\nbar 2\n.cseg\nStart\n  LDD foo\n  STD bar\n  JMP End\n  NOP\nLoop\n  JNZ Loop\n  NOP\nEnd\n",
+    ".equ K 3\n.cseg\n  LDI K\n  JMP Far\n  NOP\n.org $40\nFar\n  JZ Far\n  NOP\n",
+    ".cseg\n  CALL Sub\n  NOP\n  LDD var\nSub\n  RTS\n.dseg\nvar 1\n",
+    ".cseg\n  LDI N+1\n.equ N 4\n  ADD X foo\n  LD X+ foo\n  JMP .IP+2\n  NOP\n.dseg\nfoo 1\n",
+]
+
+# a name used for symbols of two kinds, which the passes could resolve
+# differently
+_clashes = [
+    ".dseg\nfoo 1\n.cseg\n  LDD foo\n  NOP\nfoo\n  NOP\n",
+    ".equ K 1\n.cseg\n  JMP K\n  NOP\nK\n",
+    ".cseg\nfoo\n  NOP\n.dseg\nfoo 1\n",
+]
+
+@pytest.mark.parametrize("source", _sources)
+def test_single_pass_matches_two_passes(source):
+    two_pass = assemble(source)
+    single_pass = assemble(source, single_pass=True)
+
+    assert single_pass.words == two_pass.words
+    assert single_pass.listing == two_pass.listing
+
+@pytest.mark.parametrize("single_pass", [False, True])
+@pytest.mark.parametrize("source", _clashes)
+def test_symbols_of_different_kinds_clash(source, single_pass):
+    with pytest.raises(AssemblerError, match="already defined"):
+        assemble(source, single_pass=single_pass)
@@ -0,0 +1,63 @@
+import pytest
+
+from shass_api import *
+from shass_disasm import *
+
+def _farJumps(distance):
+    """A forward and a backward conditional jump distance words away."""
+
+    return ("Start\n"
+            "        JZ    Far\n"
+            "        NOP\n"
+            + "        INC\n" * (distance - 2) +
+            "Far\n"
+            "        JZ    Start\n"
+            "        NOP\n")
+
+def _target(word, address):
+    """The address a relative jump at address goes to, as the CPU reads it."""
+
+    operand = word & 0xFF
+    return (address + 1 + (operand ^ 0x80) - 0x80) & 0x1FFF
+
+@pytest.mark.parametrize("distance", [128, 200, 255])
+def test_jump_out_of_signed_range_is_an_error(distance):
+    with pytest.raises(AssemblerError) as error:
+        assemble(_farJumps(distance))
+    assert "outside range" in error.value.message
+
+@pytest.fixture
+def table(tmp_path):
+    # built in a directory of its own rather than the user's cache
+    return decodeTable(str(tmp_path))
+
+def _reaches(table, words, address):
+    """Where a JZ at address ends up going: directly, or relaxed into
+    JNZ .IP+3, NOP, JMP target."""
+
+    # JZ and JE (JNZ and JNE) are the same instruction
+    mnemonic = table[words[address]][0]
+    if mnemonic in ("JZ", "JE"):
+        return _target(words[address], address)
+
+    assert mnemonic in ("JNZ", "JNE") and _target(words[address], address) == address + 3
+    assert table[words[address + 2]][0] == "JMP"
+    return words[address + 2] & 0x1FFF
+
+@pytest.mark.parametrize("distance", [128, 200, 255])
+def test_jump_out_of_signed_range_is_relaxed(distance, table):
+    result = assemble(_farJumps(distance), relax=True)
+    start = result.code_symbols["Start"]
+    far = result.code_symbols["Far"]
+
+    assert _reaches(table, result.words, start) == far
+    assert _reaches(table, result.words, far) == start
+
+    # the jump back is always out of range, the one forward from 129 on
+    relaxed = Opcode.one_operand_codes["JNZ"]
+    assert result.words[far] >> 8 == relaxed
+    assert (result.words[start] >> 8 == relaxed) == (distance > 128)
+
+def test_jump_in_range_keeps_its_offset():
+    result = assemble(_farJumps(127))
+    assert _target(result.words[0], 0) == result.code_symbols["Far"]
@@ -0,0 +1,82 @@
+import asyncio
+import multiprocessing
+import signal
+import time
+
+import pytest
+
+import shass_server
+from shass_server import *
+
+# programs that take as long as they say, however fast the machine: the
+# workers are forked with assembleRequest replaced
+_slow = {"source": "", "sleep": 60}
+# one that does not notice the timeout until it is done, like a long call
+# into C
+_stuck = {"source": "", "sleep": 1.0, "stuck": True}
+_quick = {"source": "        NOP\n"}
+
+_assembleRequest = shass_server.assembleRequest
+
+def _sleepingAssembleRequest(request):
+    if "sleep" not in request:
+        return _assembleRequest(request)
+
+    if request.get("stuck"):
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+    try:
+        time.sleep(request["sleep"])
+    finally:
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGALRM})
+    return 200, {"ok": True}
+
+@pytest.fixture
+def server(monkeypatch):
+    if multiprocessing.get_start_method() != "fork":
+        pytest.skip("needs workers forked from the test")
+    monkeypatch.setattr(shass_server, "assembleRequest", _sleepingAssembleRequest)
+    return AssemblyServer(workers=1, timeout=0.3, max_queue=2)
+
+async def _status(server, request):
+    try:
+        return (await server._assemble(request))[0]
+    except RequestError as error:
+        return error.status
+
+async def _drained(server, seconds):
+    deadline = time.monotonic() + seconds
+    while server.metrics.in_flight and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    return server.metrics.in_flight == 0
+
+def test_timed_out_jobs_count_until_they_finish(server):
+    async def run():
+        server._startPool()
+        try:
+            # both time out, but keep the only worker busy
+            assert await asyncio.gather(_status(server, _stuck), _status(server, _stuck)) == [504, 504]
+            assert server.metrics.in_flight == 2
+
+            # so the queue is full
+            assert await _status(server, _quick) == 503
+
+            assert await _drained(server, 30)
+            assert await _status(server, _quick) == 200
+        finally:
+            server._pool.shutdown()
+
+    asyncio.run(run())
+
+def test_workers_stop_jobs_at_the_timeout(server):
+    async def run():
+        server._startPool()
+        try:
+            assert await _status(server, _slow) == 504
+
+            # long before the program would be done, and on the same worker
+            assert await _drained(server, 10)
+            assert await _status(server, _quick) == 200
+        finally:
+            server._pool.shutdown()
+
+    asyncio.run(run())